@@ -1,110 +1,111 @@
 import os
+import time
 import server
 from aiohttp import web
 import folder_paths
 from pathlib import Path
 
 # --- ИМПОРТ КЛАССОВ НОД ---
-from .video_crossfade import VideoBatchCrossfade
+from .video_crossfade import VideoBatchCrossfade, VideoBatchCrossfadeStream
 from .ultimate_memory_cleaner import _UltimateMemoryCleaner
 from .enhanced_video_preview import EnhancedVideoPreview
 from .save_images_preview import SaveImagesPreviewPassthrough
 from .video_concat import VideoConcatFFmpeg
 from .image_size_control import GetImageSizeWithPreview
-
-# Константы безопасности
-MAX_PATH_LENGTH = 1024  # Разумное ограничение
+from .dir_listing import list_page_async, run_blocking, get_cache, get_latency, ListingTimeout, ListingBusy, MAX_LIMIT
+from .path_policy import is_allowed, WRITE_ROOTS, MAX_PATH_LENGTH
 
 # --- БЕЗОПАСНАЯ ПРОВЕРКА ПУТЕЙ ---
 def is_path_allowed(path_str: str) -> bool:
-    """Проверяет, что путь находится внутри разрешенных директорий ComfyUI"""
-    try:
-        if not path_str: return False
-        if len(path_str) > MAX_PATH_LENGTH: return False
-        
-        path = Path(path_str)
-        resolved = path.resolve()
-        
-        # Разрешенные корневые директории
-        allowed_roots = [
-            Path(folder_paths.get_output_directory()).resolve(),
-            Path(folder_paths.get_temp_directory()).resolve()
-        ]
-        
-        for allowed in allowed_roots:
-            try:
-                # Для Python 3.9+
-                if hasattr(resolved, "is_relative_to"):
-                    if resolved.is_relative_to(allowed):
-                        return True
-                else:
-                    # Для Python 3.8
-                    if str(resolved).startswith(str(allowed)):
-                        return True
-            except: continue
-        
-        return False
-    except Exception:
-        return False
+    """Браузер папок показывает только output и temp"""
+    return is_allowed(path_str, WRITE_ROOTS)
 
 # --- ОБЩАЯ ЛОГИКА API ДЛЯ БРАУЗЕРА ПАПОК ---
+def _resolve_listing_path(current_path):
+    """Синхронная часть запроса (resolve, проверка доступа, isdir): на сетевом диске тоже может висеть, поэтому в пуле list_dirs"""
+    abs_current_path = str(Path(current_path).resolve())
+    if not is_path_allowed(abs_current_path):
+        return abs_current_path, None, 403
+    if not os.path.isdir(abs_current_path):
+        return abs_current_path, None, 404
+    parent_path = os.path.dirname(abs_current_path)
+    if not is_path_allowed(parent_path):
+        parent_path = None
+    return abs_current_path, parent_path, 200
+
+
 async def handle_list_dirs(request):
+    """Обертка: время ответа каждого запроса идет в гистограмму задержек (/save_preview/list_dirs/stats)"""
+    start = time.perf_counter()
+    response, event = await _handle_list_dirs(request)
+    get_latency().record((time.perf_counter() - start) * 1000.0, event)
+    return response
+
+
+async def _handle_list_dirs(request):
     try:
         data = await request.json()
         current_path = data.get("path", "")
+        # Постраничная выдача: offset/limit (limit 0 — вся папка), prefix — фильтр по началу имени
+        try:
+            offset = max(0, int(data.get("offset", 0) or 0))
+            limit = min(MAX_LIMIT, max(0, int(data.get("limit", 0) or 0)))
+        except (TypeError, ValueError):
+            return web.json_response({"error": "Invalid offset/limit"}, status=400), None
+        prefix = str(data.get("prefix", "") or "")
         
         # Проверка длины пути
         if len(current_path) > MAX_PATH_LENGTH:
-             return web.json_response({"error": "Path too long"}, status=400)
+             return web.json_response({"error": "Path too long"}, status=400), None
 
         # Если путь не задан, используем output directory
         if not current_path or current_path.strip() == "":
             current_path = folder_paths.get_output_directory()
         
-        # Нормализация
+        # Нормализация и проверки — вне event loop
         try:
-            abs_current_path = str(Path(current_path).resolve())
+            abs_current_path, parent_path, status = await run_blocking(_resolve_listing_path, current_path)
+        except ListingTimeout as e:
+            return web.json_response({"error": str(e), "path": current_path}, status=504), "timeout"
         except:
-            return web.json_response({"error": "Invalid path syntax"}, status=400)
+            return web.json_response({"error": "Invalid path syntax"}, status=400), None
 
         # КРИТИЧЕСКАЯ ПРОВЕРКА БЕЗОПАСНОСТИ
-        if not is_path_allowed(abs_current_path):
+        if status == 403:
             return web.json_response(
                 {"error": "Access denied: Path is outside allowed directories", "path": current_path}, 
                 status=403
-            )
+            ), None
 
-        if not os.path.exists(abs_current_path) or not os.path.isdir(abs_current_path):
+        if status == 404:
             return web.json_response(
                 {"error": "Path not found", "path": current_path}, 
                 status=404
-            )
+            ), None
 
-        # Проверяем родителя
-        parent_path = os.path.dirname(abs_current_path)
-        if not is_path_allowed(parent_path):
-            parent_path = None
-
-        dirs = []
+        # Сканирование (с кэшем): медленная папка — частичный список вместо зависания
         try:
-            with os.scandir(abs_current_path) as it:
-                for entry in it:
-                    if entry.is_dir() and not entry.name.startswith('.'):
-                        dirs.append(entry.name)
+            dirs, total, partial = await list_page_async(abs_current_path, offset, limit, prefix)
+        except ListingBusy as e:
+            return web.json_response({"error": str(e)}, status=503), "busy"
         except PermissionError:
-            return web.json_response({"error": "Permission denied"}, status=403)
+            return web.json_response({"error": "Permission denied"}, status=403), None
         except Exception as e:
-            return web.json_response({"error": str(e)}, status=500)
-
-        dirs.sort()
+            return web.json_response({"error": str(e)}, status=500), None
 
         return web.json_response({
             "current_path": abs_current_path,
             "parent_path": parent_path,
-            "dirs": dirs
-        })
+            "dirs": dirs,
+            "offset": offset,
+            "limit": limit,
+            "prefix": prefix,
+            "total": total,
+            "has_more": offset + len(dirs) < total,
+            "partial": partial
+        }), ("partial" if partial else None)
     except Exception as e:
-        return web.json_response({"error": f"Unexpected error: {str(e)}"}, status=500)
+        return web.json_response({"error": f"Unexpected error: {str(e)}"}, status=500), None
 
 
 # --- РЕГИСТРАЦИЯ МАРШРУТОВ API ---
@@ -120,10 +121,15 @@ async def route_save_list_dirs(request):
 async def route_api_save_list_dirs(request):
     return await handle_list_dirs(request)
 
+@server.PromptServer.instance.routes.get("/save_preview/list_dirs/stats")
+async def route_list_dirs_stats(request):
+    return web.json_response({"latency": get_latency().snapshot(), "cache": dict(get_cache().stats)})
+
 
 # --- MAPPINGS ---
 NODE_CLASS_MAPPINGS = {
     "VideoBatchCrossfade": VideoBatchCrossfade,
+    "VideoBatchCrossfadeStream": VideoBatchCrossfadeStream,
     "UltimateMemoryCleaner": _UltimateMemoryCleaner,
     "EnhancedVideoPreview": EnhancedVideoPreview,
     "Save Images & Preview": SaveImagesPreviewPassthrough,
@@ -133,6 +139,7 @@ NODE_CLASS_MAPPINGS = {
 
 NODE_DISPLAY_NAME_MAPPINGS = {
     "VideoBatchCrossfade": "📹 Video Batch Crossfade",
+    "VideoBatchCrossfadeStream": "📹 Video Batch Crossfade (Stream)",
     "UltimateMemoryCleaner": "🧹 Ultimate Memory Cleaner",
     "EnhancedVideoPreview": "🎬 Enhanced Video Save'n'Preview",
     "Save Images & Preview": "💾 Save Images & Preview (Passthrough)",
@@ -0,0 +1,18 @@
+"""
+Общее для бенчмарков: модули репозитория как пакет spolet_nodes.
+
+Модули импортируют друг друга относительно (from .ffmpeg_runner import ...), поэтому папка репозитория
+подключается как пакет — без выполнения __init__.py (он регистрирует ноды и требует ComfyUI).
+Бенчмарк делает `import _common` до импортов из spolet_nodes.
+"""
+import os
+import sys
+import types
+
+PACKAGE = "spolet_nodes"
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if PACKAGE not in sys.modules:
+    _package = types.ModuleType(PACKAGE)
+    _package.__path__ = [REPO_ROOT]
+    sys.modules[PACKAGE] = _package
@@ -0,0 +1,121 @@
+"""
+Бенчмарк профилей энкодера (encoder_profiles) на синтетических кадрах.
+
+Кадры (градиенты + движущийся шум, uint8 rgb24) подаются в ffmpeg через pipe так же, как это делает
+EnhancedVideoPreview; для каждого кодека, который есть в локальной сборке ffmpeg, и каждого профиля
+печатается скорость кодирования (fps), размер файла и PSNR относительно исходных кадров.
+
+Нужен ffmpeg в PATH. Запуск из корня репозитория:
+    python benchmarks/bench_encoder_profiles.py
+    python benchmarks/bench_encoder_profiles.py --size 1920x1080 --frames 120 --codecs h264 h265 --threads 4
+    python benchmarks/bench_encoder_profiles.py --backend auto   # с аппаратным энкодером, если он есть
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+import _common  # noqa: F401  (пакет spolet_nodes)
+from spolet_nodes import encoder_profiles  # noqa: E402
+
+CONTAINERS = {"vp8": "webm", "vp9": "webm"}
+
+
+def make_frames(width, height, count, seed=0):
+    """Плавные градиенты с движением и немного шума — что-то между анимацией и живым видео"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    frames = np.empty((count, height, width, 3), dtype=np.uint8)
+    for i in range(count):
+        t = i / max(count - 1, 1)
+        r = 127 + 120 * np.sin(x / width * 6.0 + t * 6.0)
+        g = 127 + 120 * np.sin(y / height * 4.0 - t * 4.0)
+        b = 127 + 120 * np.sin((x + y) / (width + height) * 8.0 + t * 3.0)
+        frame = np.stack([r, g, b], axis=-1) + rng.normal(0, 6, (height, width, 3))
+        frames[i] = np.clip(frame, 0, 255).astype(np.uint8)
+    return frames
+
+
+def encode(frames, path, fps, args):
+    count, height, width, _ = frames.shape
+    cmd = ["ffmpeg", "-y", "-v", "error", "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}",
+           "-r", str(fps), "-i", "-"] + args + [path]
+    start = time.perf_counter()
+    process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        process.stdin.write(memoryview(frames).cast("B"))
+    except BrokenPipeError:
+        pass
+    process.stdin.close()
+    err = process.stderr.read()
+    process.wait()
+    elapsed = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(err.decode(errors="ignore").strip()[-300:])
+    return elapsed
+
+
+def decode(path, width, height):
+    cmd = ["ffmpeg", "-v", "error", "-i", path, "-f", "rawvideo", "-pix_fmt", "rgb24", "-"]
+    data = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+    n = len(data) // (width * height * 3)
+    return np.frombuffer(data, dtype=np.uint8, count=n * width * height * 3).reshape(n, height, width, 3)
+
+
+def psnr(reference, decoded):
+    n = min(len(reference), len(decoded))
+    if n == 0:
+        return float("nan")
+    mse = np.mean((reference[:n].astype(np.float32) - decoded[:n].astype(np.float32)) ** 2)
+    return float("inf") if mse == 0 else 10.0 * np.log10(255.0 ** 2 / mse)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", default="1280x720")
+    parser.add_argument("--frames", type=int, default=96)
+    parser.add_argument("--fps", type=float, default=24.0)
+    parser.add_argument("--codecs", nargs="+", default=["h264", "h265", "vp9", "av1"])
+    parser.add_argument("--profiles", nargs="+", default=encoder_profiles.PROFILES)
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--backend", default="cpu", choices=encoder_profiles.BACKENDS)
+    args = parser.parse_args()
+
+    width, height = map(int, args.size.split("x"))
+    frames = make_frames(width, height, args.frames)
+    available = encoder_profiles.available_encoders()
+    print(f"{args.frames} frames {width}x{height}; ffmpeg video encoders found: {len(available)}")
+
+    directory = tempfile.mkdtemp(prefix="encoder_bench_")
+    try:
+        print(f"{'codec':>6} | {'encoder':>12} | {'profile':>9} | {'fps':>8} | {'size':>9} | {'PSNR':>7}")
+        for codec in args.codecs:
+            encoder = encoder_profiles.resolve_encoder(codec, args.backend)
+            family = encoder_profiles.CODEC_ALIASES.get(codec, codec)
+            if (available and encoder not in available) or encoder not in encoder_profiles.ENCODER_PROFILES \
+                    or (family != "h264" and encoder == "libx264"):
+                print(f"{codec:>6} | {encoder:>12} | not available in this ffmpeg build")
+                continue
+            for profile in args.profiles:
+                path = os.path.join(directory, f"{codec}_{profile}.{CONTAINERS.get(family, 'mp4')}")
+                enc_args = encoder_profiles.encoder_args(codec, profile, pix_fmt="yuv420p",
+                                                         threads=args.threads, backend=args.backend)
+                try:
+                    elapsed = encode(frames, path, args.fps, enc_args)
+                except RuntimeError as e:
+                    print(f"{codec:>6} | {encoder:>12} | {profile:>9} | failed: {e}")
+                    continue
+                size_kb = os.path.getsize(path) / 1024.0
+                quality = psnr(frames, decode(path, width, height))
+                print(f"{codec:>6} | {encoder:>12} | {profile:>9} | {args.frames / elapsed:>8.1f} | "
+                      f"{size_kb:>7.0f}KB | {quality:>5.2f}dB")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Бенчмарк анализа цвета клипов для VideoConcat.
+
+Сравнивает старый путь (кадр -> PNG через pipe -> PIL RGB -> PIL HSV) с frame_stats
+(rawvideo rgb24 уменьшенного кадра прямо в numpy) по скорости и по расхождению статистик.
+Для выборки из K кадров показывает, насколько она отличается от одного кадра на 20%
+(это уже не ошибка, а изменение картинки по ходу клипа — у mandelbrot оно большое).
+
+Нужен ffmpeg в PATH. Запуск из корня репозитория:
+    python benchmarks/bench_frame_stats.py
+    python benchmarks/bench_frame_stats.py --size 3840x2160 --frames 1 5 9 --repeats 3
+"""
+import argparse
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+import _common  # noqa: F401  (пакет spolet_nodes)
+from spolet_nodes import frame_stats  # noqa: E402
+
+SOURCES = {
+    "testsrc2": "testsrc2=d={d}:s={s}:r=25",
+    "mandelbrot": "mandelbrot=s={s}:r=25",
+    "gradient": "gradients=d={d}:s={s}:r=25:speed=0.05",
+}
+KEYS = ["r_avg", "g_avg", "b_avg", "luma_avg", "luma_std", "sat_avg"]
+
+
+def make_clip(directory, name, source, size, duration):
+    path = os.path.join(directory, f"{name}.mp4")
+    cmd = ["ffmpeg", "-y", "-v", "error", "-f", "lavfi", "-i", source.format(d=duration, s=size),
+           "-t", str(duration), "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", path]
+    subprocess.run(cmd, check=True)
+    return path
+
+
+def legacy_stats(path, duration):
+    """Старый analyze_frame_stats: PNG round-trip и PIL"""
+    seek_time = max(0.5, duration * 0.2)
+    if seek_time > duration: seek_time = 0.0
+    cmd = ["ffmpeg", "-ss", str(seek_time), "-i", path, "-vframes", "1", "-f", "image2pipe", "-vcodec", "png", "-"]
+    stdout_data = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+    image = Image.open(io.BytesIO(stdout_data)).convert("RGB")
+    np_img = np.array(image)
+    means = np_img.mean(axis=(0, 1))
+    luma = 0.299 * np_img[:, :, 0] + 0.587 * np_img[:, :, 1] + 0.114 * np_img[:, :, 2]
+    hsv_img = np.array(image.convert('HSV'))
+    valid_mask = hsv_img[:, :, 2] > 25
+    sat = np.percentile(hsv_img[:, :, 1][valid_mask], 90) if np.any(valid_mask) else 0.0
+    return {"r_avg": means[0], "g_avg": means[1], "b_avg": means[2],
+            "luma_avg": luma.mean(), "luma_std": luma.std(), "sat_avg": float(sat)}
+
+
+def new_stats(path, duration, count):
+    frames = frame_stats.read_rgb_frames(path, frame_stats.sample_times(duration, count))
+    return frame_stats.rgb_stats(frames)
+
+
+def timed(fn, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = fn()
+    return (time.perf_counter() - start) / repeats * 1000.0, result
+
+
+def max_diff(a, b):
+    return max(abs(float(a[k]) - float(b[k])) for k in KEYS)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", default="1920x1080")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--frames", type=int, nargs="+", default=[1, 5])
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="frame_stats_bench_")
+    try:
+        print(f"clips {args.size}, {args.duration:.0f}s; stats image {frame_stats.STATS_WIDTH}x{frame_stats.STATS_HEIGHT}")
+        print(f"{'clip':>11} | {'method':>12} | {'time':>9} | {'max |diff|':>10} | " + " ".join(f"{k:>8}" for k in KEYS))
+        for name, source in SOURCES.items():
+            path = make_clip(directory, name, source, args.size, args.duration)
+
+            t_old, ref = timed(lambda: legacy_stats(path, args.duration), args.repeats)
+            print(f"{name:>11} | {'png+PIL':>12} | {t_old:>7.1f}ms | {'-':>10} | " + " ".join(f"{float(ref[k]):>8.2f}" for k in KEYS))
+
+            for count in args.frames:
+                t_new, res = timed(lambda: new_stats(path, args.duration, count), args.repeats)
+                label = f"raw x{count}"
+                print(f"{name:>11} | {label:>12} | {t_new:>7.1f}ms | {max_diff(ref, res):>10.2f} | " + " ".join(f"{res[k]:>8.2f}" for k in KEYS))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
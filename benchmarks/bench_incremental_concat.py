@@ -0,0 +1,130 @@
+"""
+Проверка и бенчмарк инкрементальной склейки (incremental_concat).
+
+N одинаковых клипов дописываются к результату по одному и сравниваются с полной пересборкой тех же клипов:
+r_frame_rate и число кадров должны совпасть, длина звука — не уходить от длины видео больше чем на кадр.
+Клипы — как у генерации: низкий fps и звук чуть длиннее картинки (на этом раньше "уплывал" fps).
+Режимы: copy (как Copy/Smart: полная сборка и совпадающие клипы — без перекодирования) и reencode (как Auto:
+полная сборка и каждый новый клип — через энкодер с одним профилем). Код выхода 1, если хоть одна проверка не прошла.
+
+Нужны ffmpeg и ffprobe в PATH. Запуск из корня репозитория:
+    python benchmarks/bench_incremental_concat.py
+    python benchmarks/bench_incremental_concat.py --clips 12 --fps 24 --size 1280x720
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import _common  # noqa: F401  (пакет spolet_nodes)
+from spolet_nodes.incremental_concat import IncrementalConcat  # noqa: E402
+from spolet_nodes.smart_concat import smart_concat, write_concat_list, video_end  # noqa: E402
+from spolet_nodes.encoder_profiles import encoder_args  # noqa: E402
+
+SETTINGS = {"bench": 1}
+PROFILE = "speed"
+
+
+def make_clip(path, size, fps, duration):
+    # Звук на полкадра длиннее видео
+    cmd = ["ffmpeg", "-y", "-v", "error", "-f", "lavfi", "-i", f"testsrc=s={size}:d={duration}:r={fps}",
+           "-f", "lavfi", "-i", f"sine=d={duration + 0.5 / fps}", "-c:v", "libx264", "-preset", "ultrafast",
+           "-pix_fmt", "yuv420p", "-c:a", "aac", path]
+    subprocess.run(cmd, check=True)
+
+
+def measure(path):
+    """(r_frame_rate, кадров, длина видео, длина звука)"""
+    cmd = ["ffprobe", "-v", "error", "-count_frames", "-show_streams", "-of", "json", path]
+    streams = json.loads(subprocess.run(cmd, capture_output=True, text=True, check=True).stdout)["streams"]
+    v = next(s for s in streams if s["codec_type"] == "video")
+    a = next((s for s in streams if s["codec_type"] == "audio"), None)
+    return v["r_frame_rate"], int(v["nb_read_frames"]), float(v["duration"]), float(a["duration"]) if a else None
+
+
+def reencode(paths, output):
+    """Полная сборка как в VideoConcat Auto с incremental: concat demuxer с outpoint и кодирование всего списка"""
+    list_path = output + ".txt"
+    write_concat_list(list_path, paths, [video_end(p) for p in paths])
+    cmd = ["ffmpeg", "-y", "-v", "error", "-f", "concat", "-safe", "0", "-i", list_path] + \
+        encoder_args("h264", PROFILE, pix_fmt="yuv420p") + ["-c:a", "aac", output]
+    subprocess.run(cmd, check=True)
+    os.remove(list_path)
+    return True
+
+
+def full_build(output, paths, copy_matching):
+    job = IncrementalConcat(output, paths, SETTINGS, tag="[bench]")
+    if job.update(False):
+        raise RuntimeError("full build expected")
+    if copy_matching:
+        built = smart_concat(paths, job.build_path, tag="[bench]", trim_to_video=True)
+    else:
+        built = reencode(paths, job.build_path)
+    if not built or not job.commit():
+        raise RuntimeError("full build failed")
+
+
+def run_mode(directory, clips, copy_matching):
+    output = os.path.join(directory, f"out_{'copy' if copy_matching else 'reencode'}.mp4")
+    full_build(output, clips[:1], copy_matching)
+    append_s = 0.0
+    for n in range(2, len(clips) + 1):
+        job = IncrementalConcat(output, clips[:n], SETTINGS, tag="[bench]")
+        start = time.perf_counter()
+        if not job.update(True, {"profile": PROFILE}, copy_matching):
+            raise RuntimeError(f"append of clip {n} fell back to a full rebuild")
+        append_s += time.perf_counter() - start
+    incremental = measure(output)
+
+    reference = os.path.join(directory, f"reference_{os.path.basename(output)}")
+    start = time.perf_counter()
+    full_build(reference, clips, copy_matching)
+    rebuild_s = time.perf_counter() - start
+    return incremental, measure(reference), append_s, rebuild_s
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clips", type=int, default=8)
+    parser.add_argument("--fps", type=int, default=10)
+    parser.add_argument("--size", default="320x240")
+    parser.add_argument("--duration", type=float, default=2.0)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="incremental_concat_bench_")
+    failed = False
+    try:
+        clips = []
+        for i in range(args.clips):
+            clips.append(os.path.join(directory, f"clip_{i:03d}.mp4"))
+            make_clip(clips[-1], args.size, args.fps, args.duration)
+        print(f"{args.clips} clips {args.size}, {args.fps} fps, {args.duration:g}s")
+        print(f"{'mode':>8} | {'build':>11} | {'fps':>6} | {'frames':>6} | {'video':>8} | {'audio':>8} | {'time':>7}")
+        for copy_matching in (True, False):
+            mode = "copy" if copy_matching else "reencode"
+            incremental, reference, append_s, rebuild_s = run_mode(directory, clips, copy_matching)
+            for label, (fps, frames, video, audio), seconds in (("appended", incremental, append_s),
+                                                                 ("full", reference, rebuild_s)):
+                print(f"{mode:>8} | {label:>11} | {fps:>6} | {frames:>6} | {video:>7.3f}s | {audio:>7.3f}s | {seconds:>6.2f}s")
+            problems = []
+            if incremental[0] != reference[0]:
+                problems.append(f"fps {incremental[0]} != {reference[0]}")
+            if incremental[1] != reference[1]:
+                problems.append(f"frames {incremental[1]} != {reference[1]}")
+            if abs(incremental[3] - incremental[2]) > 1.0 / args.fps:
+                problems.append(f"audio drifts from video by {incremental[3] - incremental[2]:+.3f}s")
+            if problems:
+                failed = True
+                print(f"{mode:>8} | FAIL: " + "; ".join(problems))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Бенчмарк выдачи номеров выходных файлов.
+
+Сравнивает старую схему (os.listdir всей папки на каждое сохранение) с output_counter
+на папках с 10k / 100k / 1M файлов. Заодно проверяет, что параллельные воркеры
+получают разные имена, а батч не занимает номера файлов, созданных в обход индекса.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_output_counter.py
+    python benchmarks/bench_output_counter.py --sizes 10000 100000 --dir /mnt/nas/tmp
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import _common  # noqa: F401  (пакет spolet_nodes)
+from spolet_nodes import output_counter  # noqa: E402
+
+PREFIX = "enhanced_video"
+EXT = "mp4"
+
+
+def legacy_len_counter(directory):
+    """Старый _get_output_path: len(listdir) + 1 (коллизии после удалений)"""
+    existing_files = [f for f in os.listdir(directory) if f.startswith(PREFIX)]
+    return len(existing_files) + 1
+
+
+def legacy_max_counter(directory):
+    """Старый save_images: разбор всех имен и максимум"""
+    prefix_len = len(PREFIX) + 1
+    max_num = 0
+    for f in os.listdir(directory):
+        if f.startswith(PREFIX) and f.lower().endswith(f".{EXT}"):
+            num_part = f[prefix_len:-(len(EXT) + 1)]
+            if num_part.isdigit():
+                max_num = max(max_num, int(num_part))
+    return max_num + 1
+
+
+def fill_directory(directory, count):
+    for i in range(1, count + 1):
+        fd = os.open(os.path.join(directory, output_counter.format_name(PREFIX, i, EXT)), os.O_CREAT | os.O_WRONLY, 0o666)
+        os.close(fd)
+
+
+def timed(fn, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1000.0
+
+
+def _worker_reserve(directory):
+    _, path = output_counter.reserve_file(directory, PREFIX, EXT)
+    return path
+
+
+def check_parallel(directory, workers=8, jobs=64):
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        paths = list(executor.map(_worker_reserve, [directory] * jobs))
+    return len(set(paths)) == len(paths)
+
+
+def check_external_writer(directory, batch=10):
+    """
+    Индекс говорит next=N, а кто-то в обход индекса создал N+2..N+6: батч из batch номеров
+    должен начаться после них (как при полном скане max + 1), а не перекрыть их
+    """
+    first = output_counter.reserve_counter(directory, PREFIX, EXT)
+    n = first + 1
+    external = range(n + 2, n + 7)
+    for i in external:
+        fd = os.open(os.path.join(directory, output_counter.format_name(PREFIX, i, EXT)), os.O_CREAT | os.O_WRONLY, 0o666)
+        os.close(fd)
+    start = output_counter.reserve_counter(directory, PREFIX, EXT, count=batch)
+    return start == external[-1] + 1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--dir", default=None, help="где создавать тестовые папки (по умолчанию системный temp)")
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'files':>10} | {'listdir len':>12} | {'listdir max':>12} | {'index cold':>11} | {'index warm':>11} | {'reserve_file':>12} | names")
+    for size in args.sizes:
+        directory = tempfile.mkdtemp(prefix=f"counter_bench_{size}_", dir=args.dir)
+        try:
+            fill_directory(directory, size)
+            repeats = max(1, args.repeats if size <= 100_000 else args.repeats // 10)
+
+            t_len = timed(lambda: legacy_len_counter(directory), repeats)
+            t_max = timed(lambda: legacy_max_counter(directory), repeats)
+
+            start = time.perf_counter()
+            output_counter.reserve_counter(directory, PREFIX, EXT)
+            t_cold = (time.perf_counter() - start) * 1000.0
+
+            t_warm = timed(lambda: output_counter.reserve_counter(directory, PREFIX, EXT), args.repeats * 10)
+            t_file = timed(lambda: output_counter.reserve_file(directory, PREFIX, EXT), args.repeats * 10)
+            parallel_ok = check_parallel(directory) and check_external_writer(directory)
+
+            print(f"{size:>10} | {t_len:>10.2f}ms | {t_max:>10.2f}ms | {t_cold:>9.2f}ms | {t_warm:>9.3f}ms | {t_file:>10.3f}ms | {'ok' if parallel_ok else 'COLLISION'}")
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import os
+import re
+import json
+import time
+import fnmatch
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .probe_cache import CACHE_DIR, probe_json
+from .path_policy import filter_allowed, allowed_roots, READ_ROOTS
+
+# Поиск клипов в папках для VideoConcatFFmpeg: рекурсивный обход, include/exclude маски и сортировка.
+# Результат обхода (манифест) кэшируется по mtime всех пройденных папок: новый/удаленный/переименованный файл
+# меняет mtime своей папки, поэтому повторный запуск делает stat по папкам, а не обход всех файлов.
+# Манифест хранится в памяти и JSON-файлом в .cache (переживает перезапуск ComfyUI).
+# Файл, перезаписанный на месте, mtime папки не меняет — для mtime-сортировки берется mtime на момент обхода.
+SORT_MODES = ["name", "natural", "mtime", "duration"]
+VIDEO_EXTENSIONS = {".mp4", ".mkv", ".mov", ".avi", ".webm"}
+MANIFEST_DIR = os.path.join(CACHE_DIR, "clip_manifests")
+MEMORY_MANIFESTS = 64
+MANIFEST_VERSION = 1
+
+_manifests = OrderedDict()  # key -> manifest
+_lock = threading.Lock()
+
+
+def split_patterns(text):
+    """Маски через запятую, точку с запятой или с новой строки"""
+    if not text:
+        return []
+    return [p.strip() for p in re.split(r"[,;\r\n]+", text) if p.strip()]
+
+
+def _matches(rel, patterns):
+    """Маска сравнивается с путем от корня папки (через /) и с именем файла: "shot_*/*.mp4" или "*_preview*" """
+    name = rel.rsplit("/", 1)[-1]
+    return any(fnmatch.fnmatch(rel, p) or fnmatch.fnmatch(name, p) for p in patterns)
+
+
+def natural_key(text):
+    """clip_2 < clip_10: числа сравниваются как числа"""
+    return [int(t) if t.isdigit() else t.lower() for t in re.split(r"(\d+)", text)]
+
+
+def _walk(root, recursive, include, exclude, extensions):
+    """(файлы [(rel, mtime_ns)], папки {путь: mtime_ns}); скрытые папки и файлы пропускаются, symlink-папки не обходятся"""
+    files, dirs = [], {}
+    pending = [""]
+    while pending:
+        rel_dir = pending.pop()
+        directory = os.path.join(root, rel_dir) if rel_dir else root
+        try:
+            dirs[directory] = os.stat(directory).st_mtime_ns
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except OSError as e:
+            print(f"[VideoConcat] Cannot scan {directory}: {e}")
+            continue
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive: pending.append(rel)
+                    continue
+                if os.path.splitext(entry.name)[1].lower() not in extensions:
+                    continue
+                if include and not _matches(rel, include):
+                    continue
+                if exclude and _matches(rel, exclude):
+                    continue
+                files.append((rel, entry.stat().st_mtime_ns))
+            except OSError:
+                continue
+    return files, dirs
+
+
+def _full_path(root, rel):
+    return os.path.join(root, *rel.split("/"))
+
+
+def _manifest_key(root, recursive, include, exclude, extensions):
+    # Корни path_policy в ключе: после перенастройки папок ComfyUI проверка безопасности проходит заново
+    roots = [str(r) for r in allowed_roots(READ_ROOTS)]
+    raw = json.dumps([MANIFEST_VERSION, root, recursive, include, exclude, sorted(extensions), roots])
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _is_fresh(manifest):
+    try:
+        return all(os.stat(d).st_mtime_ns == m for d, m in manifest["dirs"].items())
+    except OSError:
+        return False
+
+
+def _load_manifest(key):
+    with _lock:
+        manifest = _manifests.get(key)
+        if manifest is not None:
+            _manifests.move_to_end(key)
+            return manifest
+    try:
+        with open(os.path.join(MANIFEST_DIR, key + ".json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _remember(key, manifest):
+    with _lock:
+        _manifests[key] = manifest
+        _manifests.move_to_end(key)
+        while len(_manifests) > MEMORY_MANIFESTS:
+            _manifests.popitem(last=False)
+
+
+def _store_manifest(key, manifest):
+    _remember(key, manifest)
+    try:
+        os.makedirs(MANIFEST_DIR, exist_ok=True)
+        path = os.path.join(MANIFEST_DIR, key + ".json")
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"[VideoConcat] Clip manifest not saved: {e}")
+
+
+def _durations(paths, workers=0):
+    """Длительности через probe_cache (повторно — без ffprobe); 0 для нечитаемых"""
+    def duration(path):
+        try: return float(((probe_json(path) or {}).get("format") or {}).get("duration", 0) or 0)
+        except: return 0.0
+    if workers <= 0:
+        workers = min(8, os.cpu_count() or 1)
+    if workers == 1 or len(paths) < 2:
+        return [duration(p) for p in paths]
+    with ThreadPoolExecutor(max_workers=min(workers, len(paths))) as executor:
+        return list(executor.map(duration, paths))
+
+
+def discover_clips(directory, recursive=False, include="", exclude="", sort="name", extensions=VIDEO_EXTENSIONS,
+                   workers=0):
+    """
+    Разрешенные (path_policy) клипы в directory: абсолютные пути в порядке sort.
+    include / exclude — glob-маски (строка или список), sort — из SORT_MODES; name — как раньше (sorted по имени).
+    """
+    root = os.path.abspath(directory)
+    include = split_patterns(include) if isinstance(include, str) else list(include or [])
+    exclude = split_patterns(exclude) if isinstance(exclude, str) else list(exclude or [])
+    key = _manifest_key(root, bool(recursive), include, exclude, extensions)
+
+    manifest = _load_manifest(key)
+    if manifest is not None and _is_fresh(manifest):
+        _remember(key, manifest)
+        print(f"[VideoConcat] Clip manifest hit: {root} ({len(manifest['files'])} clips)")
+    else:
+        start = time.perf_counter()
+        files, dirs = _walk(root, recursive, include, exclude, extensions)
+        allowed = set(filter_allowed([_full_path(root, rel) for rel, _ in files], READ_ROOTS))
+        files = [[rel, mtime] for rel, mtime in files if _full_path(root, rel) in allowed]
+        manifest = {"root": root, "dirs": dirs, "files": files}
+        _store_manifest(key, manifest)
+        print(f"[VideoConcat] Scanned {root}: {len(files)} clips in {len(dirs)} folders, {time.perf_counter() - start:.2f}s")
+
+    files = manifest["files"]
+    if sort == "natural":
+        files = sorted(files, key=lambda f: natural_key(f[0]))
+    elif sort == "mtime":
+        files = sorted(files, key=lambda f: (f[1], natural_key(f[0])))
+    else:
+        files = sorted(files, key=lambda f: f[0])
+    paths = [_full_path(root, rel) for rel, _ in files]
+    if sort == "duration":
+        durations = _durations(paths, workers)
+        paths = [p for _, p in sorted(zip(durations, paths), key=lambda t: t[0])]
+    return paths
@@ -0,0 +1,219 @@
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Подпапки для браузера папок (list_dirs API).
+# Отсортированный список папки кэшируется на LIST_TTL секунд и сбрасывается раньше, если сменился mtime папки
+# (создание/удаление/переименование вложенных записей). Клиент получает страницу offset/limit, а не всю папку.
+#
+# Вся работа с файловой системой (resolve, stat, scandir) идет в отдельном ограниченном пуле, а не в event loop
+# PromptServer'а: на медленном NFS/SMB один запрос иначе останавливает весь сервер, включая прогресс по websocket.
+# Если скан не уложился в LIST_TIMEOUT, клиент получает то, что найдено к этому моменту (partial), а скан
+# доходит до конца в фоне и попадает в кэш для следующего запроса.
+LIST_TTL = 10.0
+CACHE_ENTRIES = 256
+MAX_LIMIT = 5000
+LIST_WORKERS = 4        # потоков для файловой системы
+MAX_CONCURRENT = 8      # одновременных запросов list_dirs, остальные ждут очереди
+LIST_TIMEOUT = 5.0      # секунд на скан до ответа частичным списком (и на ожидание очереди)
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_executor = ThreadPoolExecutor(max_workers=LIST_WORKERS, thread_name_prefix="list_dirs")
+
+
+class ListingTimeout(Exception):
+    """Файловая система не ответила за LIST_TIMEOUT"""
+
+
+class ListingBusy(ListingTimeout):
+    """Очередь запросов list_dirs не освободилась за LIST_TIMEOUT"""
+
+
+def scan_subdirs(path, found=None):
+    """Отсортированные имена видимых подпапок path; found (list) пополняется по ходу скана — для частичного ответа"""
+    names = [] if found is None else found
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.name.startswith('.'):
+                continue
+            try:
+                if entry.is_dir():
+                    names.append(entry.name)
+            except OSError:
+                continue
+    return sorted(names)
+
+
+class DirListingCache:
+    def __init__(self, ttl=LIST_TTL, max_entries=CACHE_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # path -> (mtime_ns, scanned_at, names)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def lookup(self, path, mtime_ns):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == mtime_ns and now - entry[1] < self.ttl:
+                self._entries.move_to_end(path)
+                self.stats["hits"] += 1
+                return entry[2]
+            self.stats["misses"] += 1
+            return None
+
+    def store(self, path, mtime_ns, names):
+        with self._lock:
+            self._entries[path] = (mtime_ns, time.monotonic(), names)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, path, found=None):
+        mtime_ns = os.stat(path).st_mtime_ns
+        names = self.lookup(path, mtime_ns)
+        if names is None:
+            names = scan_subdirs(path, found)
+            self.store(path, mtime_ns, names)
+        return names
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class LatencyHistogram:
+    """Гистограмма времени ответа endpoint'а (мс) с накопительными счетчиками"""
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * (len(self.buckets) + 1)  # последний — больше самой большой границы
+            self.total = 0
+            self.sum_ms = 0.0
+            self.max_ms = 0.0
+            self.events = {"partial": 0, "timeout": 0, "busy": 0}
+
+    def record(self, ms, event=None):
+        i = next((k for k, bound in enumerate(self.buckets) if ms <= bound), len(self.buckets))
+        with self._lock:
+            self.counts[i] += 1
+            self.total += 1
+            self.sum_ms += ms
+            self.max_ms = max(self.max_ms, ms)
+            if event in self.events:
+                self.events[event] += 1
+
+    def snapshot(self):
+        with self._lock:
+            labels = [f"<={b}" for b in self.buckets] + [f">{self.buckets[-1]}"]
+            return {
+                "buckets_ms": dict(zip(labels, self.counts)),
+                "count": self.total,
+                "avg_ms": round(self.sum_ms / self.total, 2) if self.total else 0.0,
+                "max_ms": round(self.max_ms, 2),
+                **self.events,
+            }
+
+
+_cache = DirListingCache()
+_latency = LatencyHistogram()
+_inflight = {}  # path -> (future, found): одновременные запросы одной папки ждут один скан
+_inflight_lock = threading.Lock()
+_semaphores = {}  # event loop -> asyncio.Semaphore
+
+
+def get_cache():
+    return _cache
+
+
+def get_latency():
+    return _latency
+
+
+def page(names, offset=0, limit=0, prefix=""):
+    """
+    Страница из отсортированного списка: (имена, сколько всего подходит под prefix).
+    prefix сравнивается без учета регистра; limit <= 0 — все, начиная с offset.
+    """
+    if prefix:
+        prefix = prefix.lower()
+        names = [n for n in names if n.lower().startswith(prefix)]
+    total = len(names)
+    offset = max(0, offset)
+    items = names[offset:offset + limit] if limit > 0 else names[offset:]
+    return items, total
+
+
+def list_page(path, offset=0, limit=0, prefix=""):
+    """Синхронный вариант: страница подпапок path из кэша или свежего скана"""
+    return page(_cache.get(path), offset, limit, prefix)
+
+
+def _semaphore():
+    loop = asyncio.get_running_loop()
+    sem = _semaphores.get(loop)
+    if sem is None:
+        sem = _semaphores[loop] = asyncio.Semaphore(MAX_CONCURRENT)
+    return sem
+
+
+async def run_blocking(fn, *args, timeout=None):
+    """fn(*args) в пуле list_dirs; ListingTimeout, если файловая система не ответила за timeout"""
+    timeout = LIST_TIMEOUT if timeout is None else timeout
+    future = asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        raise ListingTimeout(f"Filesystem did not respond in {timeout:g}s")
+
+
+def _start_scan(path):
+    with _inflight_lock:
+        job = _inflight.get(path)
+        if job is None:
+            found = []
+            future = _executor.submit(_cache.get, path, found)
+            job = _inflight[path] = (future, found)
+            future.add_done_callback(lambda _f: _forget_scan(path, _f))
+        return job
+
+
+def _forget_scan(path, future):
+    with _inflight_lock:
+        if _inflight.get(path, (None,))[0] is future:
+            del _inflight[path]
+
+
+async def list_page_async(path, offset=0, limit=0, prefix="", timeout=None):
+    """
+    (имена, total, partial) для страницы подпапок path, не блокируя event loop.
+    Скан не уложился в timeout — страница из уже найденного (partial=True), скан продолжается в фоне.
+    """
+    timeout = LIST_TIMEOUT if timeout is None else timeout
+    loop = asyncio.get_running_loop()
+    sem = _semaphore()
+    try:
+        await asyncio.wait_for(sem.acquire(), timeout)
+    except asyncio.TimeoutError:
+        raise ListingBusy("Too many folder listings in progress")
+    try:
+        future, found = _start_scan(path)
+        try:
+            names = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+            partial = False
+        except asyncio.TimeoutError:
+            names = sorted(list(found))
+            partial = True
+        # Фильтр и срез большого списка — тоже не в event loop (пул по умолчанию: он не занят медленной ФС)
+        items, total = await loop.run_in_executor(None, page, names, offset, limit, prefix)
+        return items, total, partial
+    finally:
+        sem.release()
@@ -0,0 +1,191 @@
+import functools
+from .ffmpeg_runner import run_ffmpeg, FFmpegError
+
+# Единое место для аргументов видеоэнкодеров ffmpeg (EnhancedVideoPreview, VideoConcatFFmpeg, smart_concat).
+# Именованные профили, потоки, -tune и разовое определение того, какие энкодеры есть в локальной сборке ffmpeg.
+PROFILES = ["speed", "balanced", "archival"]
+TUNES = ["none", "film", "animation", "grain", "stillimage", "fastdecode", "zerolatency"]
+BACKENDS = ["cpu", "auto"]
+
+# Семейство кодека (как в списках нод) -> энкодеры по приоритету
+CPU_ENCODERS = {
+    "h264": ["libx264"],
+    "h265": ["libx265"],
+    "vp8": ["libvpx"],
+    "vp9": ["libvpx-vp9"],
+    "av1": ["libsvtav1", "libaom-av1"],
+}
+HW_ENCODERS = {
+    "h264": ["h264_nvenc", "h264_qsv", "h264_amf", "h264_videotoolbox"],
+    "h265": ["hevc_nvenc", "hevc_qsv", "hevc_amf", "hevc_videotoolbox"],
+    "av1": ["av1_nvenc", "av1_qsv", "av1_amf"],
+}
+CODEC_ALIASES = {"auto": "h264", "hevc": "h265", "x264": "h264", "x265": "h265"}
+
+# Аргументы, без которых энкодер работает не в том режиме (vpx/aom без -b:v 0 — не CRF)
+BASE_ARGS = {
+    "libvpx-vp9": ["-b:v", "0", "-row-mt", "1"],
+    "libaom-av1": ["-b:v", "0", "-row-mt", "1"],
+    "h264_nvenc": ["-rc", "vbr", "-b:v", "0"],
+    "hevc_nvenc": ["-rc", "vbr", "-b:v", "0"],
+    "av1_nvenc": ["-rc", "vbr", "-b:v", "0"],
+    "h264_amf": ["-rc", "cqp"],
+    "hevc_amf": ["-rc", "cqp"],
+    "av1_amf": ["-rc", "cqp"],
+}
+
+_x26x = {
+    "speed": ["-preset", "veryfast", "-crf", "23"],
+    "balanced": ["-preset", "medium", "-crf", "20"],
+    "archival": ["-preset", "slow", "-crf", "16"],
+}
+_nvenc = {
+    "speed": ["-preset", "p1", "-cq", "25"],
+    "balanced": ["-preset", "p4", "-cq", "21"],
+    "archival": ["-preset", "p7", "-cq", "17"],
+}
+_qsv = {
+    "speed": ["-preset", "veryfast", "-global_quality", "25"],
+    "balanced": ["-preset", "medium", "-global_quality", "21"],
+    "archival": ["-preset", "veryslow", "-global_quality", "17"],
+}
+_amf = {
+    "speed": ["-quality", "speed", "-qp_i", "25", "-qp_p", "25"],
+    "balanced": ["-quality", "balanced", "-qp_i", "21", "-qp_p", "21"],
+    "archival": ["-quality", "quality", "-qp_i", "17", "-qp_p", "17"],
+}
+_videotoolbox = {
+    "speed": ["-q:v", "50", "-realtime", "1"],
+    "balanced": ["-q:v", "65"],
+    "archival": ["-q:v", "80"],
+}
+ENCODER_PROFILES = {
+    "libx264": _x26x,
+    "libx265": {
+        "speed": ["-preset", "veryfast", "-crf", "26"],
+        "balanced": ["-preset", "medium", "-crf", "23"],
+        "archival": ["-preset", "slow", "-crf", "19"],
+    },
+    "libvpx-vp9": {
+        "speed": ["-deadline", "realtime", "-cpu-used", "8", "-crf", "36"],
+        "balanced": ["-deadline", "good", "-cpu-used", "4", "-crf", "31"],
+        "archival": ["-deadline", "good", "-cpu-used", "1", "-crf", "24"],
+    },
+    "libsvtav1": {
+        "speed": ["-preset", "10", "-crf", "35"],
+        "balanced": ["-preset", "8", "-crf", "30"],
+        "archival": ["-preset", "4", "-crf", "24"],
+    },
+    "libaom-av1": {
+        "speed": ["-cpu-used", "8", "-crf", "35"],
+        "balanced": ["-cpu-used", "6", "-crf", "30"],
+        "archival": ["-cpu-used", "4", "-crf", "24"],
+    },
+    "h264_nvenc": _nvenc, "hevc_nvenc": _nvenc, "av1_nvenc": _nvenc,
+    "h264_qsv": _qsv, "hevc_qsv": _qsv, "av1_qsv": _qsv,
+    "h264_amf": _amf, "hevc_amf": _amf, "av1_amf": _amf,
+    "h264_videotoolbox": _videotoolbox, "hevc_videotoolbox": _videotoolbox,
+}
+
+# Чем задается качество (значение crf ноды) и какие энкодеры понимают пресеты x264 и -tune
+QUALITY_FLAGS = {"libx264": "-crf", "libx265": "-crf", "libvpx-vp9": "-crf", "libvpx": "-crf",
+                 "libsvtav1": "-crf", "libaom-av1": "-crf",
+                 "h264_nvenc": "-cq", "hevc_nvenc": "-cq", "av1_nvenc": "-cq",
+                 "h264_qsv": "-global_quality", "hevc_qsv": "-global_quality", "av1_qsv": "-global_quality"}
+X26X_PRESET_ENCODERS = {"libx264", "libx265", "h264_qsv", "hevc_qsv"}
+ENCODER_TUNES = {
+    "libx264": {"film", "animation", "grain", "stillimage", "fastdecode", "zerolatency"},
+    "libx265": {"animation", "grain", "fastdecode", "zerolatency"},
+}
+# qsv не принимает yuv420p напрямую
+HW_PIX_FMTS = {"h264_qsv": "nv12", "hevc_qsv": "nv12", "av1_qsv": "nv12"}
+
+
+@functools.lru_cache(maxsize=1)
+def available_encoders():
+    """Видеоэнкодеры локальной сборки ffmpeg (ffmpeg -encoders); определяется один раз на процесс"""
+    # Отмена (InterruptProcessingException) не перехватывается — иначе lru_cache запомнил бы пустой список
+    try:
+        res = run_ffmpeg(["ffmpeg", "-hide_banner", "-encoders"], capture_stdout=True, timeout=15)
+    except (OSError, FFmpegError) as e:
+        print(f"[EncoderProfiles] Cannot list ffmpeg encoders: {e}")
+        return frozenset()
+    names = set()
+    for line in res.stdout.decode("utf-8", errors="replace").splitlines():
+        # " V....D libx264  ..." — 6 символов флагов, затем имя; строки легенды ("V..... = Video") пропускаются
+        parts = line.split()
+        if len(parts) >= 2 and len(parts[0]) == 6 and parts[0][0] == "V" and parts[1] != "=":
+            names.add(parts[1])
+    return frozenset(names)
+
+
+@functools.lru_cache(maxsize=None)
+def encoder_works(name):
+    """
+    Энкодер есть в сборке и реально запускается. Аппаратные (nvenc/qsv/amf/videotoolbox) есть в списке
+    даже без подходящей видеокарты, поэтому для них — пробное кодирование одного кадра (один раз на процесс).
+    """
+    if name not in available_encoders():
+        return False
+    if not any(name.endswith(hw) for hw in ("_nvenc", "_qsv", "_amf", "_videotoolbox")):
+        return True
+    cmd = ["ffmpeg", "-v", "error", "-f", "lavfi", "-i", "color=black:s=256x256:d=0.1",
+           "-frames:v", "1", "-pix_fmt", HW_PIX_FMTS.get(name, "yuv420p"), "-c:v", name, "-f", "null", "-"]
+    try:
+        res = run_ffmpeg(cmd, check=False, timeout=20)
+    except (OSError, FFmpegError) as e:
+        print(f"[EncoderProfiles] {name} probe failed: {e}")
+        return False
+    if res.returncode != 0:
+        print(f"[EncoderProfiles] {name} is not usable here: {res.stderr[-300:].strip()}")
+    return res.returncode == 0
+
+
+def resolve_encoder(codec="h264", backend="cpu"):
+    """
+    Имя энкодера для кодека из списка ноды. backend="auto" — аппаратный энкодер, если он работает,
+    иначе CPU. Неизвестный кодек считается именем энкодера и передается как есть.
+    """
+    family = CODEC_ALIASES.get(codec, codec)
+    if family not in CPU_ENCODERS:
+        return codec
+    if backend == "auto":
+        for name in HW_ENCODERS.get(family, []):
+            if encoder_works(name):
+                return name
+    available = available_encoders()
+    for name in CPU_ENCODERS[family]:
+        if not available or name in available:
+            return name
+    print(f"[EncoderProfiles] No {family} encoder in this ffmpeg build, using libx264")
+    return "libx264"
+
+
+def _set_option(args, flag, value):
+    if flag in args:
+        args[args.index(flag) + 1] = value
+    else:
+        args += [flag, value]
+
+
+def encoder_args(codec="h264", profile=None, crf=None, preset=None, pix_fmt=None, threads=0, tune=None, backend="cpu"):
+    """
+    Аргументы ffmpeg для видеопотока: -c:v, режим, профиль, переопределения и -pix_fmt.
+    profile=None — только обязательные аргументы энкодера (поведение по умолчанию самого энкодера);
+    crf / preset заданы явно — перекрывают значения профиля; preset применяется только к пресетам x264-типа.
+    """
+    encoder = resolve_encoder(codec, backend)
+    args = ["-c:v", encoder] + list(BASE_ARGS.get(encoder, []))
+    if profile:
+        args += ENCODER_PROFILES.get(encoder, {}).get(profile, [])
+    if preset and encoder in X26X_PRESET_ENCODERS:
+        _set_option(args, "-preset", str(preset))
+    if crf is not None and encoder in QUALITY_FLAGS:
+        _set_option(args, QUALITY_FLAGS[encoder], str(crf))
+    if tune and tune != "none" and tune in ENCODER_TUNES.get(encoder, ()):
+        args += ["-tune", tune]
+    if threads and threads > 0:
+        args += ["-threads", str(threads)]
+    if pix_fmt:
+        args += ["-pix_fmt", HW_PIX_FMTS.get(encoder, pix_fmt) if pix_fmt == "yuv420p" else pix_fmt]
+    return args
@@ -7,9 +7,18 @@ import subprocess
 import json
 import time
 import shutil
-from PIL import Image as PILImage
 from comfy.utils import ProgressBar
 import re
+import queue
+import threading
+from .output_counter import reserve_file, release_file
+from .frame_buffers import iter_uint8_chunks
+from .probe_cache import probe_json
+from .smart_concat import smart_concat
+from .incremental_concat import IncrementalConcat
+from .encoder_profiles import encoder_args, PROFILES, TUNES, BACKENDS
+from .ffmpeg_runner import run_ffmpeg, progress_callback, check_interrupt, StderrTail, FFmpegError
+from .path_policy import is_allowed, filter_allowed, root as path_root, READ_ROOTS
 
 try:
     from videohelpersuite.nodes import VHS_FILENAMES
@@ -17,48 +26,42 @@ try:
 except Exception:
     VHS_AVAILABLE = False
 
+# Потоковая отдача кадров в ffmpeg: кадров в чанке и чанков в очереди писателя
+STREAM_CHUNK_SIZE = 8
+STREAM_QUEUE_SIZE = 2
+
+# Last_Frames из готового файла: кадров сверх n в окне декодирования и сколько раз расширять окно
+LAST_FRAMES_MARGIN = 4
+LAST_FRAMES_ATTEMPTS = 3
+
+# Веса яркости для brightness_histogram (BT.601)
+LUMA_WEIGHTS = torch.tensor([0.299, 0.587, 0.114])
+
+# Аудиокодек для муксинга звука прямо при кодировании (второй вход ffmpeg).
+# gif / webp звуковую дорожку не поддерживают вообще.
+AUDIO_CODECS = {
+    "mp4": ['-c:a', 'aac', '-b:a', '192k'],
+    "webm": ['-c:a', 'libopus', '-b:a', '160k'],
+}
+
 
 # --- SECURITY HELPERS ---
 
 def is_path_safe_input(path_str):
     """
     Проверяет, можно ли ЧИТАТЬ из этого пути (Input/Output/Temp).
-    Защита от Symlinks и Path Traversal.
+    Защита от Symlinks и Path Traversal (общая политика path_policy, корни кэшируются).
     """
-    try:
-        if not path_str: return False
-        # Ограничение длины пути
-        if len(path_str) > 1024: return False
-        
-        path = Path(path_str).resolve()
-        
-        allowed_roots = [
-            Path(folder_paths.get_input_directory()).resolve(),
-            Path(folder_paths.get_output_directory()).resolve(),
-            Path(folder_paths.get_temp_directory()).resolve()
-        ]
-        
-        for root in allowed_roots:
-            try:
-                # Python 3.9+
-                if hasattr(path, "is_relative_to"):
-                    if path.is_relative_to(root): return True
-                else:
-                    # Python 3.8
-                    if str(path).startswith(str(root)): return True
-            except: continue
-            
-        return False
-    except: return False
+    return is_allowed(path_str, READ_ROOTS)
 
 def get_safe_output_dir(custom_path, save_to_temp=False):
     """
     Возвращает безопасный путь для ЗАПИСИ (только Output или Temp).
     """
     if save_to_temp:
-        return Path(folder_paths.get_temp_directory()).resolve(), "temp", "ComfyUI_Temp"
+        return path_root("temp"), "temp", "ComfyUI_Temp"
     
-    root_out = Path(folder_paths.get_output_directory()).resolve()
+    root_out = path_root("output")
     
     if not custom_path or custom_path.strip() == "":
         return root_out, "output", ""
@@ -104,29 +107,28 @@ def _get_output_path(filename_prefix, extension, save_to_temp=False, custom_path
     full_output_dir_path, file_type, subfolder_base = get_safe_output_dir(custom_path, save_to_temp)
     full_output_dir = str(full_output_dir_path)
 
+    # Очистка имени файла
+    clean_prefix = re.sub(r'[^\w\-\.]', '_', filename_prefix)
+
+    # Номер из общего индекса папки (output_counter) вместо os.listdir на каждом запуске.
+    # Имя сразу занимается пустым файлом (O_EXCL): параллельные воркеры очереди не получат
+    # одно и то же имя, а ffmpeg -y не перезапишет существующее видео.
     try:
         os.makedirs(full_output_dir, exist_ok=True)
+        counter, full_path = reserve_file(full_output_dir, clean_prefix, extension)
     except Exception as e:
-        print(f"[EnhancedVideoSave] Error creating directory: {e}. Fallback to temp.")
+        if save_to_temp:
+            raise
+        print(f"[EnhancedVideoSave] Error preparing output file: {e}. Fallback to temp.")
         return _get_output_path(filename_prefix, extension, save_to_temp=True)
-    
-    # Очистка имени файла
-    clean_prefix = re.sub(r'[^\w\-\.]', '_', filename_prefix)
-    
-    try:
-        existing_files = [f for f in os.listdir(full_output_dir) if f.startswith(clean_prefix)]
-        counter = len(existing_files) + 1
-    except:
-        counter = 1
 
-    filename = f"{clean_prefix}_{counter:05d}.{extension}"
-    full_path = os.path.join(full_output_dir, filename)
+    filename = os.path.basename(full_path)
     
     # Расчет subfolder для UI
     subfolder = subfolder_base
     if not save_to_temp:
         try:
-            root_out = Path(folder_paths.get_output_directory()).resolve()
+            root_out = path_root("output")
             if full_output_dir_path == root_out:
                 subfolder = ""
             else:
@@ -143,56 +145,74 @@ def _get_output_path(filename_prefix, extension, save_to_temp=False, custom_path
     return full_path, subfolder, filename, file_type, full_output_dir
 
 
-def _tensor_to_numpy(image_batch):
-    if isinstance(image_batch, torch.Tensor):
-        image_batch = image_batch.cpu().numpy()
-    if image_batch.dtype != np.uint8:
-        image_batch = (image_batch * 255).clip(0, 255).astype(np.uint8)
-    return image_batch
+def _frame_histogram(frame, mode="luma"):
+    """
+    Гистограммы [K, 256] одного кадра [H, W, C] (K = 1 для яркости, 3 для RGB) — целиком на стороне torch.
+    Значения квантуются в uint8, как при сохранении; корзины — как у np.histogram(bins=256, range=(0, 255))
+    (с точностью до округления float32 на границах корзин).
+    """
+    if frame.dtype != torch.uint8:
+        frame = frame.float().mul(255).clamp_(0, 255).to(torch.uint8)
+    C = frame.shape[-1]
+
+    if mode == "rgb" and C >= 3:
+        # Для целых уровней 0..255 корзина совпадает с самим уровнем — bincount прямо по uint8
+        return torch.stack([torch.bincount(frame[..., k].flatten(), minlength=256) for k in range(3)]).float()
+
+    values = frame[..., :3].float() @ LUMA_WEIGHTS.to(frame.device) if C >= 3 else frame[..., 0].float()
+    bins = (values.flatten() * (256.0 / 255.0)).long().clamp_(0, 255)
+    return torch.bincount(bins, minlength=256).view(1, 256).float()
+
+
+def _histogram_counts(images, mode="luma", frames="first"):
+    """frames: first — только первый кадр (как раньше), mean / max — среднее / максимум гистограмм всех кадров"""
+    images = torch.as_tensor(images)
+    if frames == "first":
+        images = images[:1]
+    # По кадру за раз: память не растет с размером батча
+    result = None
+    for frame in images:
+        counts = _frame_histogram(frame, mode)
+        if result is None:
+            result = counts
+        elif frames == "max":
+            result = torch.maximum(result, counts)
+        else:
+            result += counts
+    return result if frames == "max" else result / images.shape[0]
 
 
-def _generate_brightness_histogram(images_np):
-    if images_np is None or images_np.size == 0:
+def _generate_brightness_histogram(images, mode="luma", scale="linear", frames="first"):
+    """Картинка гистограммы [1, 100, 256, 3]: столбики рисуются одной маской-сравнением, без цикла по корзинам"""
+    if images is None or images.shape[0] == 0:
         return torch.zeros((1, 100, 256, 3), dtype=torch.float32)
 
-    if images_np.shape[0] > 1:
-        img_for_hist = images_np[0:1]
-    else:
-        img_for_hist = images_np
-
-    B, H, W, C = img_for_hist.shape
-    if C == 4:
-        gray = 0.299 * img_for_hist[..., 0] + 0.587 * img_for_hist[..., 1] + 0.114 * img_for_hist[..., 2]
-    elif C == 3:
-        gray = 0.299 * img_for_hist[..., 0] + 0.587 * img_for_hist[..., 1] + 0.114 * img_for_hist[..., 2]
-    else:
-        gray = img_for_hist[..., 0]
+    hist = _histogram_counts(images, mode, frames).cpu()
+    if scale == "log":
+        hist = torch.log1p(hist)
+    peak = hist.max()
+    if peak > 0:
+        hist = hist / peak
 
-    hist, _ = np.histogram(gray.ravel(), bins=256, range=(0, 255), density=False)
-    hist = hist.astype(np.float32)
-    if hist.max() > 0:
-        hist = hist / hist.max()
+    heights = (hist * 95).long()                                        # [K, 256]
+    rows = torch.arange(100).view(1, 100, 1)
+    mask = (rows >= 95 - heights.unsqueeze(1)) & (rows < 95)            # [K, 100, 256]
 
-    hist_img = np.zeros((100, 256, 3), dtype=np.uint8)
-    for i in range(256):
-        height = int(hist[i] * 95)
-        hist_img[95 - height:95, i] = [255, 165, 0]
-    
-    out_tensor = hist_img.astype(np.float32) / 255.0
-    return torch.from_numpy(out_tensor[None, ...])
+    if mask.shape[0] == 3:
+        # Каналы складываются: пересечения R+G дают желтый, все три — белый
+        hist_img = mask.movedim(0, -1).float()
+    else:
+        hist_img = mask[0].unsqueeze(-1) * torch.tensor([255, 165, 0], dtype=torch.float32) / 255.0
+    return hist_img.unsqueeze(0)
 
 
 def _extract_video_info(video_path):
     try:
-        cmd = [
-            'ffprobe', '-v', 'quiet', '-print_format', 'json',
-            '-show_format', '-show_streams', video_path
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-        if result.returncode != 0:
+        # ffprobe запускается только для новых/измененных файлов, дальше — из probe_cache
+        data = probe_json(video_path)
+        if not data:
             return {}
 
-        data = json.loads(result.stdout)
         fmt = data.get("format", {})
         streams = data.get("streams", [])
 
@@ -254,12 +274,66 @@ def _extract_video_info(video_path):
         return {}
 
 
-def _stream_video_to_ffmpeg(images, output_path, fps, format, codec, preset, crf, pix_fmt, loop_vid):
-    images = _tensor_to_numpy(images)
-    B, H, W, C = images.shape
+class _TailCapture:
+    """Обертка над IMAGE_STREAM: пропускает чанки дальше и запоминает последние n кадров (для Last_Frames)"""
+    def __init__(self, stream, n):
+        self.stream = stream
+        self.n = n
+        self.frame_shape = stream.frame_shape
+        self.tail = []
+
+    def __len__(self):
+        return len(self.stream)
+
+    def __iter__(self):
+        self.tail = []
+        kept = 0
+        for chunk in self.stream:
+            if self.n > 0 and chunk.shape[0] > 0:
+                self.tail.append(chunk[-self.n:])
+                kept += self.tail[-1].shape[0]
+                while kept - self.tail[0].shape[0] >= self.n:
+                    kept -= self.tail.pop(0).shape[0]
+            yield chunk
+
+    def frames(self):
+        if not self.tail:
+            return None
+        return torch.cat(self.tail, dim=0)[-self.n:]
+
+
+def _video_encoder_args(codec, preset, crf, pix_fmt, encoder=None):
+    """
+    Аргументы видеоэнкодера через encoder_profiles.
+    encoder — {"profile", "threads", "tune", "backend"} с опциональных входов ноды; профиль задает свои preset/crf,
+    без профиля (custom) — preset/crf ноды, как раньше.
+    """
+    encoder = encoder or {}
+    profile = encoder.get("profile")
+    return encoder_args(codec, profile,
+                        crf=None if profile else crf, preset=None if profile else preset,
+                        pix_fmt=pix_fmt if pix_fmt != "auto" else "yuv420p",
+                        threads=encoder.get("threads", 0), tune=encoder.get("tune"),
+                        backend=encoder.get("backend", "cpu"))
+
+
+def _conform_options(preset, crf, encoder=None):
+    """Те же настройки энкодера, что у _video_encoder_args, в виде video_options для smart_concat.conform_command"""
+    encoder = encoder or {}
+    profile = encoder.get("profile")
+    return {"profile": profile, "crf": None if profile else crf, "preset": None if profile else preset,
+            "tune": encoder.get("tune"), "threads": encoder.get("threads", 0)}
+
+
+def _stream_video_to_ffmpeg(images, output_path, fps, format, codec, preset, crf, pix_fmt, loop_vid, audio_path=None, encoder=None):
+    if isinstance(images, (torch.Tensor, np.ndarray)):
+        B, H, W, C = images.shape
+    else:
+        # IMAGE_STREAM (VideoBatchCrossfadeStream): размеры известны заранее, кадры приходят чанками
+        B = len(images)
+        H, W, C = images.frame_shape
 
     if C == 4 and format == "mp4":
-        images = np.ascontiguousarray(images[..., :3])
         C = 3
     
     input_args = [
@@ -273,6 +347,12 @@ def _stream_video_to_ffmpeg(images, output_path, fps, format, codec, preset, crf
         '-i', '-' 
     ]
 
+    # Звук подключаем вторым входом и муксим в том же процессе — без temp-файла и второго прохода
+    audio_args = []
+    if audio_path and format in AUDIO_CODECS:
+        input_args += ['-i', audio_path]
+        audio_args = ['-map', '0:v:0', '-map', '1:a:0'] + AUDIO_CODECS[format] + ['-shortest']
+
     output_args = []
     
     if format == "gif":
@@ -291,24 +371,9 @@ def _stream_video_to_ffmpeg(images, output_path, fps, format, codec, preset, crf
             output_path
         ]
     elif format == "webm":
-        vcodec = "libvpx-vp9"
-        output_args = [
-            '-c:v', vcodec, 
-            '-pix_fmt', pix_fmt if pix_fmt != "auto" else "yuv420p", 
-            '-b:v', '0', 
-            '-crf', str(crf),
-            output_path
-        ]
+        output_args = _video_encoder_args("vp9", preset, crf, pix_fmt, encoder) + audio_args + [output_path]
     else: # mp4
-        vcodec = "libx264" if codec in ("auto", "h264") else ("libx265" if codec == "h265" else codec)
-        selected_pix_fmt = pix_fmt if pix_fmt != "auto" else "yuv420p"
-        output_args = [
-            '-c:v', vcodec, 
-            '-pix_fmt', selected_pix_fmt, 
-            '-preset', preset, 
-            '-crf', str(crf), 
-            output_path
-        ]
+        output_args = _video_encoder_args(codec, preset, crf, pix_fmt, encoder) + audio_args + [output_path]
 
     cmd = ['ffmpeg'] + input_args + output_args
 
@@ -317,38 +382,72 @@ def _stream_video_to_ffmpeg(images, output_path, fps, format, codec, preset, crf
             cmd, 
             stdin=subprocess.PIPE, 
             stdout=subprocess.DEVNULL, 
-            stderr=subprocess.DEVNULL 
+            stderr=subprocess.PIPE
         )
     except FileNotFoundError:
         print("[EnhancedVideoSave] FFmpeg not found!")
         return False
+    stderr_tail = StderrTail(process.stderr)
 
     pbar = ProgressBar(B)
 
-    for i in range(B):
-        frame_bytes = images[i].tobytes()
-        try:
-            process.stdin.write(frame_bytes)
-            pbar.update(1)
-        except BrokenPipeError:
-            print(f"[EnhancedVideoSave] ❌ FFmpeg pipe broken at frame {i}")
-            break
-        except Exception as e:
-            print(f"[EnhancedVideoSave] Error sending frame: {e}")
-            break
+    # Конвертация следующего чанка идет параллельно с тем, как ffmpeg читает текущий:
+    # запись в pipe отпускает GIL, поэтому пишем из отдельного потока через короткую очередь.
+    # Буферов на 2 больше длины очереди: один пишется, один заполняется, остальные ждут в очереди.
+    write_queue = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+    writer_state = {"sent": 0, "error": None}
+
+    def _writer():
+        while True:
+            frames = write_queue.get()
+            if frames is None:
+                return
+            if writer_state["error"] is not None:
+                continue  # ffmpeg уже упал — просто разгребаем очередь
+            try:
+                # memoryview на непрерывный uint8-буфер: без tobytes() и промежуточных копий
+                process.stdin.write(memoryview(frames).cast("B"))
+                writer_state["sent"] += frames.shape[0]
+                pbar.update(frames.shape[0])
+            except Exception as e:
+                writer_state["error"] = e
+
+    writer = threading.Thread(target=_writer, name="EnhancedVideoSave-writer", daemon=True)
+    writer.start()
+    try:
+        for frames in iter_uint8_chunks(images, chunk_size=STREAM_CHUNK_SIZE, buffers=STREAM_QUEUE_SIZE + 2, channels=C):
+            if writer_state["error"] is not None:
+                break
+            check_interrupt(process, cleanup=[output_path])
+            write_queue.put(frames)
+    finally:
+        write_queue.put(None)
+        writer.join()
 
     if process.stdin:
-        process.stdin.close()
-    
+        try: process.stdin.close()
+        except BrokenPipeError: pass
+
     process.wait()
 
+    error = writer_state["error"]
+    if error is not None and process.returncode == 0 and audio_args:
+        # -shortest: звук короче видео, ffmpeg сам закончил чтение раньше
+        print(f"[EnhancedVideoSave] Video trimmed to audio length at frame {writer_state['sent']}")
+    elif isinstance(error, BrokenPipeError):
+        print(f"[EnhancedVideoSave] ❌ FFmpeg pipe broken at frame {writer_state['sent']}")
+    elif error is not None:
+        print(f"[EnhancedVideoSave] Error sending frame: {error}")
+
     if process.returncode != 0:
+        print(f"[EnhancedVideoSave] FFmpeg exited with code {process.returncode}: {stderr_tail.text()[-1000:].strip()}")
         return False
     
     return True
 
 
-def _concat_videos_ffmpeg(video_paths_list, output_path, preset, crf, pix_fmt, fps):
+def _concat_videos_ffmpeg(video_paths_list, output_path, preset, crf, pix_fmt, fps, smart=False, encoder=None,
+                          trim_to_video=False):
     list_path = output_path + ".txt"
     try:
         valid_paths = []
@@ -366,6 +465,12 @@ def _concat_videos_ffmpeg(video_paths_list, output_path, preset, crf, pix_fmt, f
         frame_duration = 1.0 / max(fps, 0.01)
         image_extensions = {".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tiff"}
 
+        # smart copy: только видео, совместимые клипы копируются без перекодирования
+        if smart and not any(os.path.splitext(p)[1].lower() in image_extensions for p in valid_paths):
+            if smart_concat(valid_paths, output_path, tag="[EnhancedVideoSave]",
+                            video_options=_conform_options(preset, crf, encoder), trim_to_video=trim_to_video):
+                return True
+
         with open(list_path, "w", encoding="utf-8") as f:
             for path in valid_paths:
                 safe_path = path.replace("'", "'\\''")
@@ -384,88 +489,99 @@ def _concat_videos_ffmpeg(video_paths_list, output_path, preset, crf, pix_fmt, f
                      safe_path = last_path.replace("'", "'\\''")
                      f.write(f"file '{safe_path}'\n")
 
-        selected_pix_fmt = pix_fmt if pix_fmt != "auto" else "yuv420p"
-        
         cmd = [
             'ffmpeg', '-y',
             '-loglevel', 'error',
             '-f', 'concat',
             '-safe', '0',
             '-i', list_path,
-            '-c:v', 'libx264',
-            '-pix_fmt', selected_pix_fmt,
-            '-preset', preset,
-            '-crf', str(crf),
-            '-c:a', 'aac',
-            output_path
         ]
+        # webm: libx264/aac в него не муксятся — vp9/opus, как при кодировании кадров
+        is_webm = output_path.lower().endswith(".webm")
+        cmd += _video_encoder_args("vp9" if is_webm else "h264", preset, crf, pix_fmt, encoder)
+        cmd += AUDIO_CODECS["webm" if is_webm else "mp4"][:2] + [output_path]
         
-        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        # Длительность для прогресса: видео — по ffprobe (из probe_cache), картинки — по кадру
+        duration = 0.0
+        for path in valid_paths:
+            if os.path.splitext(path)[1].lower() in image_extensions:
+                duration += frame_duration
+            else:
+                try: duration += float(((probe_json(path) or {}).get("format") or {}).get("duration", 0))
+                except (TypeError, ValueError): pass
+
+        run_ffmpeg(cmd, duration=duration, on_progress=progress_callback(ProgressBar(100)), cleanup=[output_path])
         return True
-    except subprocess.CalledProcessError as e:
+    except FFmpegError as e:
         print(f"[EnhancedVideoSave] Concat error: {e}")
         return False
     finally:
         if os.path.exists(list_path):
             os.remove(list_path)
 
-def _merge_audio(video_path, audio_path, output_path):
-    cmd = [
-        'ffmpeg', '-y', '-loglevel', 'error',
-        '-i', video_path,
-        '-i', audio_path,
-        '-c:v', 'copy',
-        '-c:a', 'aac', '-b:a', '192k',
-        '-shortest',
-        output_path
-    ]
-    subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+def _video_frame_geometry(video_path):
+    """(width, height, nb_frames) первого видеопотока после автоповорота ffmpeg; nb_frames = None, если неизвестно"""
+    data = probe_json(video_path) or {}
+    stream = next((st for st in data.get("streams", []) if st.get("codec_type") == "video"), None)
+    if stream is None:
+        return None
+    w, h = int(stream.get("width", 0)), int(stream.get("height", 0))
+    rotation = stream.get("tags", {}).get("rotate")
+    for side in stream.get("side_data_list", []):
+        if "rotation" in side: rotation = side["rotation"]
+    try:
+        if int(float(rotation)) % 180 != 0: w, h = h, w
+    except (TypeError, ValueError):
+        pass
+    try:
+        nb_frames = int(stream.get("nb_frames"))
+    except (TypeError, ValueError):
+        nb_frames = None
+    return w, h, (nb_frames if nb_frames and nb_frames > 0 else None)
 
 
 def _extract_last_n_frames(video_path, n, fps):
+    """
+    Последние n кадров файла как float-тензор [n, H, W, 3].
+    ffmpeg декодирует окно с конца (-sseof) чуть больше n кадров и отдает rawvideo rgb24 известного размера;
+    из буфера берутся ровно последние n кадров. Если окна не хватило (VFR, неточный fps) — окно удваивается.
+    """
     if n <= 0:
         return torch.zeros((1, 512, 512, 3), dtype=torch.float32)
         
     try:
         if fps <= 0: fps = 1
-        duration_needed = (n / fps) * 1.5 
-        if duration_needed < 1.0: duration_needed = 1.0
-
-        cmd = [
-            'ffmpeg', '-y', '-loglevel', 'error',
-            '-sseof', f'-{duration_needed:.3f}',
-            '-i', video_path,
-            '-f', 'image2pipe',
-            '-vcodec', 'png',
-            '-'
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, check=True)
-        
-        from io import BytesIO
-        data = result.stdout
-        frames = []
-        png_signature = b'\x89PNG\r\n\x1a\n'
-        parts = data.split(png_signature)
-        
-        for part in parts:
-            if not part: continue
-            img_data = png_signature + part
-            try:
-                img = PILImage.open(BytesIO(img_data)).convert("RGB")
-                img_np = np.array(img).astype(np.float32) / 255.0
-                frames.append(torch.from_numpy(img_np))
-            except Exception:
-                pass
-
-        if not frames:
-             return torch.zeros((1, 512, 512, 3), dtype=torch.float32)
-
-        frames_tensor = torch.stack(frames)
-        if frames_tensor.shape[0] > n:
-            frames_tensor = frames_tensor[-n:]
-            
-        return frames_tensor
+        geometry = _video_frame_geometry(video_path)
+        if geometry is None or geometry[0] <= 0 or geometry[1] <= 0:
+            return torch.zeros((1, 512, 512, 3), dtype=torch.float32)
+        W, H, nb_frames = geometry
+        if nb_frames: n = min(n, nb_frames)
+        frame_size = W * H * 3
+
+        window = (n + LAST_FRAMES_MARGIN) / fps
+        data, count = b"", 0
+        for _ in range(LAST_FRAMES_ATTEMPTS):
+            # Кадров в файле не больше, чем просим, — читаем его целиком, без seek
+            whole = nb_frames is not None and nb_frames <= n + LAST_FRAMES_MARGIN
+            cmd = ['ffmpeg', '-v', 'error']
+            if not whole: cmd += ['-sseof', f'-{window:.3f}']
+            cmd += ['-i', video_path, '-map', '0:v:0', '-fps_mode', 'passthrough',
+                    '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-']
+            data = run_ffmpeg(cmd, capture_stdout=True).stdout
+            count = len(data) // frame_size
+            if count >= n or whole or (nb_frames is not None and count >= nb_frames):
+                break
+            window *= 2
+
+        m = min(n, count)
+        if m == 0:
+            return torch.zeros((1, 512, 512, 3), dtype=torch.float32)
+
+        # Последние m кадров буфера -> один заранее выделенный float-тензор (uint8 -> float32 прямо при копировании)
+        tail = np.frombuffer(data, dtype=np.uint8, count=m * frame_size, offset=(count - m) * frame_size)
+        frames_tensor = torch.empty((m, H, W, 3), dtype=torch.float32)
+        frames_tensor.numpy()[...] = tail.reshape(m, H, W, 3)
+        return frames_tensor.div_(255.0)
 
     except Exception as e:
         print(f"[EnhancedVideoSave] Error extracting last frames: {e}")
@@ -504,8 +620,25 @@ class EnhancedVideoPreview:
             },
             "optional": {
                 "images": ("IMAGE",),
+                # Поток кадров из VideoBatchCrossfadeStream — кодируется чанками, без сборки в один тензор
+                "image_stream": ("IMAGE_STREAM",),
                 "audio": ("VHS_AUDIO",),
                 "video_paths": ("STRING", {"forceInput": True, "multiline": True}),
+                # Склейка video_paths: re-encode — h264 (в webm — vp9) с настройками ноды,
+                # smart copy — совместимые клипы копируются как есть, перекодируются только отличающиеся
+                "concat_strategy": (["re-encode", "smart copy"], {"default": "re-encode"}),
+                # Один постоянный файл <filename_prefix>.<format>: новые клипы дописываются к нему, старые не перекодируются
+                "incremental_concat": ("BOOLEAN", {"default": False}),
+                # Профиль энкодера (encoder_profiles): custom — preset/crf ноды; speed/balanced/archival — свои preset/crf
+                "encoder_profile": (["custom (preset/crf)"] + PROFILES, {"default": "custom (preset/crf)"}),
+                "encoder_threads": ("INT", {"default": 0, "min": 0, "max": 128, "step": 1}),  # 0 — решает энкодер
+                "tune": (TUNES, {"default": "none"}),
+                # auto — аппаратный энкодер (nvenc/qsv/amf/videotoolbox), если он есть и запускается
+                "encoder_backend": (BACKENDS, {"default": "cpu"}),
+                # brightness_histogram: яркость или R/G/B, шкала, и по каким кадрам Last_Frames считать
+                "histogram_mode": (["luma", "rgb"], {"default": "luma"}),
+                "histogram_scale": (["linear", "log"], {"default": "linear"}),
+                "histogram_frames": (["first", "mean", "max"], {"default": "first"}),
             }
         }
 
@@ -536,7 +669,10 @@ class EnhancedVideoPreview:
 
     def preview(self, save_video_on_disk, save_path, filename_prefix,
                 fps, format, codec, pix_fmt, preset, crf, 
-                last_frames_count, autoplay, mute, loop, images=None, audio=None, video_paths=None):
+                last_frames_count, autoplay, mute, loop, images=None, audio=None, video_paths=None,
+                image_stream=None, concat_strategy="re-encode", encoder_profile="custom (preset/crf)",
+                encoder_threads=0, tune="none", encoder_backend="cpu",
+                histogram_mode="luma", histogram_scale="linear", histogram_frames="first", incremental_concat=False):
         
         ext_map = {"mp4": "mp4", "gif": "gif", "webm": "webm", "webp": "webp"}
         ext = ext_map.get(format, "mp4")
@@ -549,14 +685,18 @@ class EnhancedVideoPreview:
                              save_to_temp=save_to_temp, 
                              custom_path=save_path)
 
+        encoder = {
+            "profile": encoder_profile if encoder_profile in PROFILES else None,
+            "threads": encoder_threads, "tune": tune, "backend": encoder_backend,
+        }
+
         # 2. GENERATION
         output_frames = None 
+        info_temp = None
 
-        if images is not None:
+        if images is not None or image_stream is not None:
             print(f"[EnhancedVideoSave] Mode: Images -> Video (Disk: {save_video_on_disk})")
             
-            temp_video_path = final_output_path
-            
             audio_path = None
             if audio is not None:
                 try:
@@ -568,19 +708,29 @@ class EnhancedVideoPreview:
                     if not os.path.exists(audio_path): audio_path = None
                 except: audio_path = None
 
-            if audio_path:
-                temp_video_path = final_output_path.replace(f".{ext}", f"_temp.{ext}")
-
-            success = _stream_video_to_ffmpeg(images, temp_video_path, fps, format, codec, preset, crf, pix_fmt, loop)
-            if not success: raise RuntimeError("Encoding failed")
+            if audio_path and format not in AUDIO_CODECS:
+                print(f"[EnhancedVideoSave] {format} has no audio track, audio ignored")
+                audio_path = None
 
-            if audio_path:
-                _merge_audio(temp_video_path, audio_path, final_output_path)
-                if os.path.exists(temp_video_path) and temp_video_path != final_output_path:
-                    os.remove(temp_video_path)
+            if images is not None:
+                source = images
+            else:
+                # Хвост для Last_Frames собираем на лету, пока поток уходит в ffmpeg
+                source = _TailCapture(image_stream, last_frames_count)
+
+            success = _stream_video_to_ffmpeg(source, final_output_path, fps, format, codec, preset, crf, pix_fmt, loop, audio_path=audio_path, encoder=encoder)
+            if not success and audio_path:
+                # Звук не читается ffmpeg'ом — раньше в этом случае видео все равно сохранялось
+                print("[EnhancedVideoSave] Encoding with audio failed, retrying without audio")
+                success = _stream_video_to_ffmpeg(source, final_output_path, fps, format, codec, preset, crf, pix_fmt, loop, encoder=encoder)
+            if not success:
+                release_file(final_output_path)
+                raise RuntimeError("Encoding failed")
             
             if last_frames_count > 0:
-                if images.shape[0] > last_frames_count:
+                if images is None:
+                    output_frames = source.frames()
+                elif images.shape[0] > last_frames_count:
                     output_frames = images[-last_frames_count:]
                 else:
                     output_frames = images
@@ -598,40 +748,61 @@ class EnhancedVideoPreview:
                     valid_extensions = {".mp4", ".mkv", ".mov", ".avi", ".webm", ".png", ".jpg", ".jpeg", ".webp"}
                     try:
                         files_in_dir = sorted(os.listdir(raw_text))
-                        for f in files_in_dir:
-                            ext = os.path.splitext(f)[1].lower()
-                            if ext in valid_extensions:
-                                full_f = os.path.join(raw_text, f)
-                                # Параноидальная проверка каждого файла
-                                if is_path_safe_input(full_f):
-                                    path_list.append(full_f)
+                        candidates = [os.path.join(raw_text, f) for f in files_in_dir
+                                      if os.path.splitext(f)[1].lower() in valid_extensions]
+                        # Параноидальная проверка каждого файла (пачкой: корни и папка резолвятся один раз)
+                        path_list.extend(filter_allowed(candidates, READ_ROOTS))
                     except Exception as e:
                         print(f"[EnhancedVideoSave] Error scanning directory: {e}")
                 else:
                     # Список файлов (старая логика для текстового ввода путей)
                     # Но теперь она тоже проверяет безопасность
                     normalized_text = raw_text.replace(',', '\n').replace(';', '\n').replace('\r', '\n')
-                    for line in normalized_text.split('\n'):
-                        clean_line = line.strip().strip('"').strip("'")
-                        if clean_line and os.path.exists(clean_line) and is_path_safe_input(clean_line):
-                            path_list.append(clean_line)
+                    candidates = [line.strip().strip('"').strip("'") for line in normalized_text.split('\n')]
+                    path_list.extend(filter_allowed([c for c in candidates if c and os.path.exists(c)], READ_ROOTS))
             else:
                  # Если это просто список файлов в тексте (multiline string)
                  normalized_text = raw_text.replace(',', '\n').replace(';', '\n').replace('\r', '\n')
-                 lines = normalized_text.split('\n')
-                 for line in lines:
-                     clean_line = line.strip().strip('"').strip("'")
-                     if clean_line and os.path.exists(clean_line) and is_path_safe_input(clean_line):
-                         path_list.append(clean_line)
+                 candidates = [line.strip().strip('"').strip("'") for line in normalized_text.split('\n')]
+                 path_list.extend(filter_allowed([c for c in candidates if c and os.path.exists(c)], READ_ROOTS))
                  
                  if not path_list:
                      print(f"[EnhancedVideoSave] Security Block or Invalid Path: {raw_text}")
             
+            # Зарезервированный под результат файл может оказаться в той же папке — не склеиваем его сам с собой
+            skip = {os.path.abspath(final_output_path)}
+            job = None
+            if incremental_concat and format not in ("mp4", "webm"):
+                print(f"[EnhancedVideoSave] Incremental concat needs mp4 or webm, {format} is built from scratch")
+            elif incremental_concat:
+                # Вместо нового номера — постоянное имя, к которому дописываются новые клипы
+                release_file(final_output_path)
+                stable_name = re.sub(r'[^\w\-\.]', '_', filename_prefix) + f".{ext}"
+                job = IncrementalConcat(os.path.join(internal_dir_path, stable_name), [], {}, tag="[EnhancedVideoSave]")
+                final_output_path, filename = job.output_path, stable_name
+                skip |= job.work_paths()
+            path_list = [p for p in path_list if os.path.abspath(p) not in skip]
+
             if not path_list:
+                release_file(final_output_path)
                 raise ValueError(f"No valid allowed files found in path: {raw_text}")
 
-            success = _concat_videos_ffmpeg(path_list, final_output_path, preset, crf, pix_fmt, fps)
-            if not success: raise RuntimeError("Concatenation failed")
+            smart = concat_strategy == "smart copy"
+            if job is not None:
+                job = IncrementalConcat(final_output_path, path_list, {
+                    "format": format, "codec": codec, "pix_fmt": pix_fmt, "preset": preset, "crf": crf, "fps": fps,
+                    "concat_strategy": concat_strategy, "encoder": encoder,
+                }, tag="[EnhancedVideoSave]")
+                success = job.update(True, _conform_options(preset, crf, encoder), copy_matching=smart) or (
+                    _concat_videos_ffmpeg(path_list, job.build_path, preset, crf, pix_fmt, fps, smart=smart, encoder=encoder,
+                                          trim_to_video=True)
+                    and job.commit())
+            else:
+                success = _concat_videos_ffmpeg(path_list, final_output_path, preset, crf, pix_fmt, fps,
+                                                smart=smart, encoder=encoder)
+            if not success:
+                release_file(final_output_path)
+                raise RuntimeError("Concatenation failed")
             
             info_temp = _extract_video_info(final_output_path)
             real_fps = info_temp.get("fps", fps)
@@ -641,17 +812,18 @@ class EnhancedVideoPreview:
                 output_frames = _extract_last_n_frames(final_output_path, last_frames_count, real_fps)
             
         else:
-            raise ValueError("Input Error: Either 'images' or 'video_paths' must be provided.")
+            release_file(final_output_path)
+            raise ValueError("Input Error: Either 'images', 'image_stream' or 'video_paths' must be provided.")
 
-        # Сбор информации
-        info = _extract_video_info(final_output_path)
+        # Сбор информации (в режиме склейки файл уже разобран выше)
+        info = info_temp if info_temp is not None else _extract_video_info(final_output_path)
         if not info:
             info = {
                 "duration_sec": 0, "total_frames": 0,
                 "width": 0, "height": 0, "gps": None, "fps": 0
             }
         
-        hist_image = _generate_brightness_histogram(_tensor_to_numpy(output_frames) if output_frames is not None else None)
+        hist_image = _generate_brightness_histogram(output_frames, histogram_mode, histogram_scale, histogram_frames)
 
         # UI Payload
         ui_payload = {
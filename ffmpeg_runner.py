@@ -0,0 +1,166 @@
+import os
+import time
+import threading
+import subprocess
+from collections import deque
+
+try:
+    import comfy.model_management as model_management
+except Exception:
+    model_management = None
+
+# Запуск ffmpeg без слепого ожидания: прогресс из -progress pipe:1 в ProgressBar, прерывание по кнопке Cancel
+# (процесс убивается сразу, а не после окончания кодирования) и хвост stderr для текста ошибки вместо DEVNULL.
+STDERR_LINES = 200
+STDERR_REPORT_CHARS = 1500
+POLL_INTERVAL = 0.1
+KILL_TIMEOUT = 3.0
+# На SIGTERM ffmpeg дописывает файл (у x264 с lookahead это до секунды и больше); результат при отмене
+# все равно удаляется, поэтому ждем недолго и добиваем
+TERMINATE_GRACE = 0.5
+
+
+class FFmpegError(RuntimeError):
+    """ffmpeg завершился с ошибкой; stderr — последние строки его вывода"""
+    def __init__(self, cmd, returncode, stderr):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.stderr = stderr
+        super().__init__(f"{os.path.basename(cmd[0])} exited with code {returncode}: {stderr[-STDERR_REPORT_CHARS:].strip()}")
+
+
+class StderrTail:
+    """Читает stderr процесса в отдельном потоке и хранит последние STDERR_LINES строк (pipe не переполняется)"""
+    def __init__(self, stream, lines=STDERR_LINES):
+        self.lines = deque(maxlen=lines)
+        self._thread = threading.Thread(target=self._read, args=(stream,), daemon=True)
+        self._thread.start()
+
+    def _read(self, stream):
+        try:
+            for raw in iter(stream.readline, b""):
+                self.lines.append(raw.decode("utf-8", errors="replace").rstrip())
+        except (OSError, ValueError):
+            pass
+
+    def text(self, timeout=KILL_TIMEOUT):
+        self._thread.join(timeout)
+        return "\n".join(self.lines)
+
+
+def interrupted():
+    """Нажата ли отмена в ComfyUI"""
+    return model_management is not None and model_management.processing_interrupted()
+
+
+def kill_process(process):
+    """Сначала SIGTERM, если за TERMINATE_GRACE не вышел — kill; процесс всегда дожидается (без зомби)"""
+    if process.poll() is not None:
+        return
+    try:
+        process.terminate()
+        process.wait(TERMINATE_GRACE)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+    except OSError:
+        pass
+
+
+def remove_files(paths):
+    for path in paths or []:
+        try:
+            if os.path.isfile(path): os.remove(path)
+        except OSError:
+            pass
+
+
+def check_interrupt(process=None, cleanup=None):
+    """При отмене убивает process, удаляет недописанные файлы cleanup и поднимает InterruptProcessingException ComfyUI"""
+    if interrupted():
+        if process is not None:
+            kill_process(process)
+        remove_files(cleanup)
+        model_management.throw_exception_if_processing_interrupted()
+
+
+def progress_callback(pbar, start=0, end=100):
+    """on_progress для run_ffmpeg: доля 0..1 -> pbar.update_absolute в диапазоне [start, end]"""
+    return lambda fraction: pbar.update_absolute(start + int((end - start) * fraction))
+
+
+def _read_progress(stream, duration, on_progress):
+    """Разбор -progress: блоки key=value, out_time_us — позиция выхода в микросекундах"""
+    last = -1.0
+    for raw in iter(stream.readline, b""):
+        key, _, value = raw.decode("ascii", errors="ignore").strip().partition("=")
+        if key == "out_time_us" and value.isdigit():
+            fraction = min(1.0, int(value) / 1e6 / duration)
+        elif key == "progress" and value == "end":
+            fraction = 1.0
+        else:
+            continue
+        if fraction - last >= 0.005 or fraction == 1.0:
+            last = fraction
+            try:
+                on_progress(fraction)
+            except Exception:
+                pass
+
+
+def run_ffmpeg(cmd, duration=None, on_progress=None, capture_stdout=False, check=True, timeout=None,
+               cleanup=None, stop_event=None):
+    """
+    Запуск ffmpeg (или ffprobe) с ожиданием, которое реагирует на отмену.
+    duration + on_progress — прогресс из -progress pipe:1 (только если stdout не занят выводом, capture_stdout=False).
+    capture_stdout — stdout целиком в result.stdout (bytes), например для rawvideo.
+    cleanup — файлы, которые удаляются, если процесс пришлось убить (отмена, timeout, stop_event).
+    stop_event (threading.Event) — остановка снаружи: для пула процессов, где флаг отмены ComfyUI
+    сбрасывается первым же исключением и остальные процессы его уже не увидят.
+    Возвращает CompletedProcess (stderr — хвост текста); при ошибке и check=True — FFmpegError.
+    """
+    check_interrupt()  # после Cancel новые процессы не запускаются
+    cmd = list(cmd)
+    with_progress = bool(on_progress and duration and duration > 0 and not capture_stdout)
+    if with_progress:
+        cmd = cmd[:1] + ["-progress", "pipe:1", "-nostats"] + cmd[1:]
+
+    process = subprocess.Popen(
+        cmd, stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE if (capture_stdout or with_progress) else subprocess.DEVNULL,
+        stderr=subprocess.PIPE
+    )
+    tail = StderrTail(process.stderr)
+
+    chunks = []
+    reader = None
+    if capture_stdout:
+        reader = threading.Thread(target=lambda: chunks.extend(iter(lambda: process.stdout.read(1 << 20), b"")), daemon=True)
+    elif with_progress:
+        reader = threading.Thread(target=_read_progress, args=(process.stdout, duration, on_progress), daemon=True)
+    if reader is not None:
+        reader.start()
+
+    start = time.monotonic()
+    while True:
+        try:
+            process.wait(POLL_INTERVAL)
+            break
+        except subprocess.TimeoutExpired:
+            pass
+        check_interrupt(process, cleanup)
+        if stop_event is not None and stop_event.is_set():
+            kill_process(process)
+            remove_files(cleanup)
+            raise FFmpegError(cmd, process.returncode, "stopped\n" + tail.text())
+        if timeout is not None and time.monotonic() - start > timeout:
+            kill_process(process)
+            remove_files(cleanup)
+            raise FFmpegError(cmd, process.returncode, f"timed out after {timeout}s\n" + tail.text())
+
+    if reader is not None:
+        reader.join()
+    stderr = tail.text()
+    if check and process.returncode != 0:
+        raise FFmpegError(cmd, process.returncode, stderr)
+    return subprocess.CompletedProcess(cmd, process.returncode, b"".join(chunks) if capture_stdout else None, stderr)
@@ -0,0 +1,62 @@
+import torch
+import numpy as np
+
+
+def iter_uint8_chunks(images, chunk_size=16, buffers=2, channels=None):
+    """
+    Порционная конвертация IMAGE [B, H, W, C] (float 0..1, torch или numpy) в uint8.
+    То же, что (images * 255).clip(0, 255).astype(np.uint8), но без полных float/uint8 копий батча:
+    работаем срезами по chunk_size кадров и переиспользуем заранее выделенные буферы.
+
+    Отдаются непрерывные numpy-массивы [n, H, W, C], которые смотрят в буферы. Буферы идут
+    по кругу, поэтому чанк k перезаписывается при выдаче чанка k + buffers — потребитель должен
+    успеть его обработать (или скопировать).
+
+    images может быть и итерируемым потоком таких батчей (IMAGE_STREAM) — буферы тогда общие
+    на весь поток, нумерация чанков сквозная.
+
+    channels — оставить только первые N каналов (например, RGBA -> RGB для mp4).
+    """
+    single = isinstance(images, (torch.Tensor, np.ndarray))
+    sources = [images] if single else images
+    chunk_size = max(1, int(chunk_size))
+    if single and images.shape[0] > 0:
+        chunk_size = min(chunk_size, images.shape[0])
+    buffers = max(1, int(buffers))
+
+    u8_bufs = None
+    f32_buf = None
+    k = 0
+
+    for source in sources:
+        B, H, W, C = source.shape
+        C = min(C, channels) if channels else C
+        if u8_bufs is None:
+            u8_bufs = [torch.empty((chunk_size, H, W, C), dtype=torch.uint8) for _ in range(buffers)]
+
+        for start in range(0, B, chunk_size):
+            stop = min(start + chunk_size, B)
+            n = stop - start
+            out = u8_bufs[k % buffers][:n]
+            k += 1
+
+            src = source[start:stop, ..., :C]
+            if isinstance(src, np.ndarray):
+                src = torch.from_numpy(np.ascontiguousarray(src))
+
+            if src.dtype == torch.uint8:
+                out.copy_(src)
+            elif src.device.type != "cpu":
+                # На GPU считаем прямо там и переносим уже uint8 (в 4 раза меньше данных)
+                out.copy_(torch.mul(src, 255).clamp_(0, 255).to(torch.uint8))
+            else:
+                if f32_buf is None:
+                    f32_buf = torch.empty((chunk_size, H, W, C), dtype=torch.float32)
+                tmp = f32_buf[:n]
+                tmp.copy_(src)
+                tmp.mul_(255)
+                tmp.clamp_(0, 255)
+                # float -> uint8 отбрасывает дробную часть, как astype(np.uint8)
+                out.copy_(tmp)
+
+            yield out.numpy()
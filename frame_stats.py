@@ -0,0 +1,112 @@
+import numpy as np
+from .ffmpeg_runner import run_ffmpeg
+
+# Статистика цвета по кадрам клипа для цветокоррекции при склейке.
+# ffmpeg сразу отдает уменьшенный кадр в rawvideo rgb24 известного размера — без PNG-кодирования,
+# декодирования в PIL и отдельной конвертации в HSV.
+STATS_WIDTH = 320
+STATS_HEIGHT = 180
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114])
+SAT_PERCENTILE = 90
+SAT_MIN_VALUE = 25  # темные пиксели (V <= 25) в насыщенности не участвуют
+EXTRACT_TIMEOUT = 60
+# Сколько секунд читать с каждой точки: без ограничения каждый вход декодируется до конца файла
+SAMPLE_WINDOW = 2.0
+# До этой точки несколько кадров дешевле взять одним проходом декодера, чем отдельными -ss
+SINGLE_PASS_MAX_TIME = 30.0
+
+
+def sample_times(duration, count=1):
+    """
+    Моменты для выборки кадров. Один кадр — как раньше, на 20% длительности (но не раньше 0.5 с);
+    несколько — равномерно по клипу, по центрам отрезков.
+    """
+    if count <= 1:
+        seek_time = max(0.5, duration * 0.2)
+        return [seek_time if seek_time <= duration else 0.0]
+    if duration <= 0:
+        return [0.0]
+    return [duration * (i + 0.5) / count for i in range(count)]
+
+
+def _seek_cmd(path, times, width, height):
+    """По входу с -ss на каждый момент, с каждого по одному кадру, склейка через concat"""
+    cmd = ["ffmpeg", "-v", "error"]
+    for t in times:
+        cmd += ["-ss", f"{t:.3f}", "-t", str(SAMPLE_WINDOW), "-i", path]
+    chains = []
+    for i in range(len(times)):
+        chains.append(f"[{i}:v]trim=end_frame=1,scale={width}:{height}:flags=area,format=rgb24,setsar=1[s{i}]")
+    labels = "".join(f"[s{i}]" for i in range(len(times)))
+    graph = ";".join(chains) + f";{labels}concat=n={len(times)}:v=1:a=0[out]"
+    return cmd + ["-filter_complex", graph, "-map", "[out]", "-fps_mode", "passthrough", "-f", "rawvideo", "-pix_fmt", "rgb24", "-"]
+
+
+def _single_pass_cmd(path, times, width, height):
+    """Один проход декодера до последнего момента, select берет первый кадр после каждой точки (times — равномерная сетка)"""
+    step = times[1] - times[0]
+    select = f"gte(t,{times[0]:.3f})*(isnan(prev_selected_t)+gte(t-prev_selected_t,{step * 0.999:.3f}))"
+    return [
+        "ffmpeg", "-v", "error", "-t", f"{times[-1] + SAMPLE_WINDOW:.3f}", "-i", path,
+        "-vf", f"select='{select}',scale={width}:{height}:flags=area,format=rgb24",
+        "-fps_mode", "passthrough", "-frames:v", str(len(times)),
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "-"
+    ]
+
+
+def read_rgb_frames(path, times, width=STATS_WIDTH, height=STATS_HEIGHT):
+    """
+    Кадры в моменты times одним вызовом ffmpeg: масштаб width x height, rawvideo rgb24 в stdout.
+    Возвращает uint8 [N, height, width, 3] или None.
+
+    Каждый -ss декодирует от предыдущего ключевого кадра, поэтому на коротких клипах (обычно один GOP)
+    K точек выходят дороже одного прохода по файлу — там кадры берутся за один проход.
+    """
+    if len(times) > 1 and times[-1] <= SINGLE_PASS_MAX_TIME:
+        cmd = _single_pass_cmd(path, times, width, height)
+    else:
+        cmd = _seek_cmd(path, times, width, height)
+
+    res = run_ffmpeg(cmd, capture_stdout=True, check=False, timeout=EXTRACT_TIMEOUT)
+    frame_size = width * height * 3
+    n = len(res.stdout) // frame_size
+    if n == 0:
+        print(f"[VideoConcat] No frames decoded from {path}: {res.stderr[-300:].strip()}")
+        return None
+    return np.frombuffer(res.stdout, dtype=np.uint8, count=n * frame_size).reshape(n, height, width, 3)
+
+
+def _percentile_from_counts(counts, q):
+    """np.percentile (линейная интерполяция) для uint8-значений по гистограмме — O(n) без сортировки"""
+    total = int(counts.sum())
+    rank = q / 100.0 * (total - 1)
+    lo, frac = int(rank), rank - int(rank)
+    cum = np.cumsum(counts)
+    v_lo = int(np.searchsorted(cum, lo, side="right"))
+    v_hi = int(np.searchsorted(cum, min(lo + 1, total - 1), side="right"))
+    return v_lo + (v_hi - v_lo) * frac
+
+
+def rgb_stats(frames):
+    """
+    Средние R/G/B, яркость (среднее и std) и 90-й перцентиль насыщенности по всем пикселям frames (uint8 [..., 3]).
+    Насыщенность и V — как в PIL convert('HSV'): S = (max - min) * 255 // max, V = max.
+    """
+    pixels = frames.reshape(-1, 3)
+    means = pixels.mean(axis=0)
+    luma = pixels @ LUMA_WEIGHTS
+
+    mx = pixels.max(axis=1)
+    mn = pixels.min(axis=1)
+    valid = mx > SAT_MIN_VALUE
+    sat_avg = 0.0
+    if np.any(valid):
+        mx_v = mx[valid].astype(np.uint16)
+        sats = (mx_v - mn[valid]) * 255 // mx_v
+        sat_avg = float(_percentile_from_counts(np.bincount(sats, minlength=256), SAT_PERCENTILE))
+
+    return {
+        "r_avg": float(means[0]), "g_avg": float(means[1]), "b_avg": float(means[2]),
+        "luma_avg": float(luma.mean()), "luma_std": float(luma.std()),
+        "sat_avg": sat_avg,
+    }
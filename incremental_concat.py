@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+from .probe_cache import file_signature
+from .smart_concat import stream_signature, video_end, conform_command, describe_mismatch, write_concat_list
+from .ffmpeg_runner import run_ffmpeg, remove_files
+
+# Инкрементальная склейка для папок, в которые генерация дописывает клипы.
+# Рядом с результатом лежит манифест (<файл>.concat.json): из каких входов (путь, размер, mtime) он собран,
+# с какими настройками, размер/mtime самого результата, а также формат потоков (сигнатура smart_concat) и конец видео
+# полной сборки. Если старые входы — неизмененное начало нового списка, перекодируются только новые клипы
+# (в сохраненный формат, с настройками энкодера ноды), и они дописываются к результату через concat demuxer -c copy.
+# Цена обновления зависит от хвоста, а не от длины всей истории (старое видео только копируется, без перекодирования).
+# Результат заменяется атомарно (os.replace).
+# Формат берется из манифеста, а не из ffprobe результата: после склеек -c copy r_frame_rate у него может "уплыть",
+# и новые клипы перекодировались бы в неправильный fps. Каждый кусок обрезается по длине своего видео (outpoint),
+# поэтому звук, который длиннее картинки, не сдвигает стыки и не оставляет дыр в видео.
+# Любое расхождение — изменились/пропали старые входы, другие настройки, результат правили руками — полная пересборка.
+SIDECAR_SUFFIX = ".concat.json"
+MANIFEST_VERSION = 2
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tiff"}
+
+
+def sidecar_path(output_path):
+    return output_path + SIDECAR_SUFFIX
+
+
+def _record(path):
+    signature = file_signature(path)
+    return list(signature) if signature is not None else None
+
+
+class IncrementalConcat:
+    """
+    Использование:
+        job = IncrementalConcat(output_path, paths, settings)
+        if not job.update(appendable, video_options, copy_matching):
+            собрать все paths в job.build_path обычным способом
+            job.commit()
+    """
+    def __init__(self, output_path, paths, settings, tag="[IncrementalConcat]"):
+        self.output_path = os.path.abspath(output_path)
+        self.paths = list(paths)
+        self.settings = settings
+        self.tag = tag
+        directory, name = os.path.split(self.output_path)
+        stem, self.ext = os.path.splitext(name)
+        # Скрытое имя с тем же расширением (ffmpeg выбирает контейнер по нему), в той же папке — os.replace атомарен
+        self.build_path = os.path.join(directory, f".{stem}.rebuild{self.ext}")
+        self.append_path = os.path.join(directory, f".{stem}.append{self.ext}")
+        self._records = None
+        self._manifest = None
+
+    def work_paths(self):
+        """Файлы, которые не должны попасть во входы (результат и его временные версии)"""
+        return {self.output_path, self.build_path, self.append_path}
+
+    def load_manifest(self):
+        try:
+            with open(sidecar_path(self.output_path), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            return manifest if manifest.get("version") == MANIFEST_VERSION else None
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    def save_manifest(self, records, target, end):
+        """target — сигнатура потоков результата (stream_signature), end — конец его видео (video_end)"""
+        st = os.stat(self.output_path)
+        manifest = {"version": MANIFEST_VERSION, "settings": self.settings, "inputs": records,
+                    "output": [st.st_size, st.st_mtime_ns], "target": list(target), "video_end": end}
+        path = sidecar_path(self.output_path)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, path)
+
+    def plan(self):
+        """("unchanged" | "append" | "rebuild", хвост новых путей, записи всех входов)"""
+        records = [_record(p) for p in self.paths]
+        manifest = self._manifest = self.load_manifest()
+        if manifest is None or any(r is None for r in records):
+            return "rebuild", self.paths, records
+        try:
+            st = os.stat(self.output_path)
+        except OSError:
+            return "rebuild", self.paths, records
+        if manifest.get("settings") != self.settings or manifest.get("output") != [st.st_size, st.st_mtime_ns]:
+            return "rebuild", self.paths, records
+        done = manifest.get("inputs") or []
+        if len(done) > len(records) or records[:len(done)] != done:
+            return "rebuild", self.paths, records
+        if len(done) == len(records):
+            return "unchanged", [], records
+        return "append", self.paths[len(done):], records
+
+    def update(self, appendable=True, video_options=None, copy_matching=False):
+        """
+        True — результат актуален (ничего нового или хвост дописан), собирать не нужно.
+        False — нужна полная сборка в build_path и затем commit().
+        appendable=False — склейка, которую нельзя продолжить куском (переходы, цветокоррекция по всему списку).
+        video_options — настройки энкодера ноды для новых клипов (см. conform_command).
+        copy_matching=True — режимы Copy/Smart: клип, уже совпадающий по формату, дописывается без перекодирования;
+        при перекодирующих режимах каждый новый клип проходит через энкодер, как и при полной сборке.
+        """
+        remove_files([self.build_path, self.append_path])  # остатки прерванного запуска
+        status, tail, records = self.plan()
+        self._records = records
+        if status == "unchanged":
+            print(f"{self.tag} Incremental: {os.path.basename(self.output_path)} is up to date ({len(records)} inputs)")
+            return True
+        if status == "append":
+            if not appendable:
+                print(f"{self.tag} Incremental: these settings cannot be appended to, full rebuild")
+            elif self.append(tail, video_options, copy_matching):
+                return True
+        return False
+
+    def commit(self):
+        """Полная сборка готова: build_path становится результатом, манифест — по текущим входам"""
+        if not os.path.isfile(self.build_path) or os.path.getsize(self.build_path) == 0:
+            remove_files([self.build_path])
+            return False
+        # Формат и длина — по свежей полной сборке, пока в ней нет стыков -c copy
+        target = stream_signature(self.build_path)
+        end = video_end(self.build_path)
+        os.replace(self.build_path, self.output_path)
+        records = self._records or [_record(p) for p in self.paths]
+        if target is not None and end and all(r is not None for r in records):
+            self.save_manifest(records, target, end)
+        else:
+            # Без формата продолжить нельзя — следующий запуск соберет заново
+            remove_files([sidecar_path(self.output_path)])
+        print(f"{self.tag} Incremental: rebuilt {os.path.basename(self.output_path)} from {len(self.paths)} inputs")
+        return True
+
+    def append(self, tail, video_options=None, copy_matching=False):
+        """Новые клипы -> сохраненный формат результата, затем результат + они через -c copy; манифест обновляется"""
+        if any(os.path.splitext(p)[1].lower() in IMAGE_EXTENSIONS for p in tail):
+            print(f"{self.tag} Incremental: images in new inputs, full rebuild")
+            return False
+        manifest = self._manifest or {}
+        target, end = manifest.get("target"), manifest.get("video_end")
+        if not target or not end:
+            return False
+        target = tuple(target)
+
+        start = time.perf_counter()
+        work_dir = tempfile.mkdtemp(prefix=".incremental_", dir=os.path.dirname(self.output_path))
+        try:
+            parts, outpoints = [self.output_path], [end]
+            for i, path in enumerate(tail):
+                sig = stream_signature(path)
+                if sig is None:
+                    print(f"{self.tag} Incremental: cannot probe {path}, full rebuild")
+                    return False
+                if copy_matching and sig == target:
+                    part = path
+                else:
+                    part = os.path.join(work_dir, f"tail_{i:05d}{self.ext}")
+                    cmd = conform_command(path, part, target, sig[6] is not None, video_options=video_options)
+                    if cmd is None:
+                        print(f"{self.tag} Incremental: no encoder for {target[0]}, full rebuild")
+                        return False
+                    reason = describe_mismatch(sig, target) if sig != target else "node encoder settings"
+                    print(f"{self.tag} Encoding new clip {os.path.basename(path)}: {reason}")
+                    res = run_ffmpeg(cmd, check=False, cleanup=[part])
+                    if res.returncode != 0:
+                        print(f"{self.tag} Incremental: encoding {path} failed: {res.stderr[-300:]}")
+                        return False
+                part_end = video_end(part)
+                if part_end is None:
+                    print(f"{self.tag} Incremental: unknown video duration of {path}, full rebuild")
+                    return False
+                parts.append(part)
+                outpoints.append(part_end)
+
+            list_path = os.path.join(work_dir, "list.txt")
+            # outpoint = конец видео куска: лишний хвост звука отрезается, следующий клип встает встык к картинке
+            write_concat_list(list_path, parts, outpoints)
+            cmd = ["ffmpeg", "-y", "-v", "error", "-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy"]
+            if self.ext in (".mp4", ".mov"):
+                cmd += ["-movflags", "+faststart"]
+            res = run_ffmpeg(cmd + [self.append_path], check=False, cleanup=[self.append_path])
+            if res.returncode != 0:
+                remove_files([self.append_path])
+                print(f"{self.tag} Incremental: stream copy append failed: {res.stderr[-300:]}")
+                return False
+            os.replace(self.append_path, self.output_path)
+            # Формат остается сохраненным; конец видео — по новому файлу (ffprobe читает только заголовок)
+            end = video_end(self.output_path)
+            if end is None:
+                remove_files([sidecar_path(self.output_path)])
+            else:
+                self.save_manifest(self._records, target, end)
+            print(f"{self.tag} Incremental: appended {len(tail)} clip(s) in {time.perf_counter() - start:.2f}s")
+            return True
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
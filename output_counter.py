@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import threading
+
+# Небольшой индекс рядом с файлами: следующий номер для каждой пары (префикс, расширение).
+# Вместо os.listdir всей папки на каждом сохранении — чтение пары сотен байт.
+# Индекс и блокировка лежат в скрытой подпапке: их запись не меняет mtime самой папки,
+# поэтому по mtime папки видно, появлялись ли в ней новые файлы.
+INDEX_DIR = ".spolet"
+INDEX_NAME = "counters.json"
+LOCK_NAME = "counters.lock"
+
+LOCK_TIMEOUT = 10.0   # сек ожидания чужой блокировки
+LOCK_STALE = 30.0     # блокировка старше этого считается брошенной (упавший процесс)
+# На SMB/FAT mtime грубый: изменение в пределах этого окна может не сдвинуть mtime
+MTIME_GRANULARITY_NS = 2_000_000_000
+
+_process_lock = threading.Lock()
+# directory -> (mtime_ns файла индекса, данные индекса)
+_index_cache = {}
+
+
+def format_name(prefix, counter, ext, separator="_", width=5):
+    return f"{prefix}{separator}{counter:0{width}d}.{ext}"
+
+
+def _dir_mtime_ns(directory):
+    try:
+        return os.stat(directory).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def _scan_next(directory, prefix, ext, separator):
+    """Холодный старт: один проход по папке, следующий номер после максимального"""
+    head = f"{prefix}{separator}"
+    tail = f".{ext}".lower()
+    max_num = 0
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                name = entry.name
+                if not name.startswith(head) or not name.lower().endswith(tail):
+                    continue
+                num_part = name[len(head):len(name) - len(tail)]
+                if num_part.isdigit():
+                    max_num = max(max_num, int(num_part))
+    except OSError:
+        pass
+    return max_num + 1
+
+
+def _skip_taken(directory, prefix, ext, separator, width, n, count=1):
+    """
+    Папку меняли в обход индекса (другая нода, ручное копирование): первый номер диапазона [n, n + count),
+    в котором свободны все count имен. Свободный кандидат ищется галопом + бинпоиском — O(log k) stat'ов,
+    затем проверяется остаток диапазона; занятое имя внутри него сдвигает n за себя (иначе батч
+    save_images перезаписал бы чужие файлы).
+    """
+    def taken(i):
+        return os.path.exists(os.path.join(directory, format_name(prefix, i, ext, separator, width)))
+
+    while True:
+        if taken(n):
+            lo, step = n, 1
+            while taken(n + step):
+                lo = n + step
+                step *= 2
+            hi = n + step
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                if taken(mid): lo = mid
+                else: hi = mid
+            n = hi
+        # С конца диапазона: сразу за самое дальнее занятое имя
+        busy = next((i for i in range(n + count - 1, n, -1) if taken(i)), None)
+        if busy is None:
+            return n
+        n = busy + 1
+
+
+def _acquire_dir_lock(directory):
+    """Межпроцессная блокировка через атомарное создание файла (O_CREAT | O_EXCL)"""
+    lock_path = os.path.join(directory, INDEX_DIR, LOCK_NAME)
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+            os.write(fd, str(os.getpid()).encode())
+            os.close(fd)
+            return lock_path
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > LOCK_STALE:
+                    os.remove(lock_path)
+                    continue
+            except OSError:
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Counter index is locked: {lock_path}")
+            time.sleep(0.01)
+
+
+def _load_index(directory):
+    index_path = os.path.join(directory, INDEX_DIR, INDEX_NAME)
+    try:
+        mtime = os.stat(index_path).st_mtime_ns
+    except OSError:
+        return {}
+    cached = _index_cache.get(directory)
+    if cached and cached[0] == mtime:
+        return dict(cached[1])
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, dict): data = {}
+    except Exception:
+        data = {}
+    _index_cache[directory] = (mtime, data)
+    return dict(data)
+
+
+def _save_index(directory, data):
+    index_path = os.path.join(directory, INDEX_DIR, INDEX_NAME)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, index_path)
+    try:
+        _index_cache[directory] = (os.stat(index_path).st_mtime_ns, data)
+    except OSError:
+        _index_cache.pop(directory, None)
+
+
+def reserve_counter(directory, prefix, ext, separator="_", count=1, width=5):
+    """
+    Резервирует count последовательных номеров для файлов
+    {prefix}{separator}{N:0width}.{ext} в directory и возвращает первый.
+
+    Следующий номер хранится в индексе INDEX_DIR/INDEX_NAME. Если mtime папки не менялся
+    с прошлой выдачи — номер берется как есть, иначе проверяется парой stat'ов. Полный листинг
+    папки бывает только при первом обращении к ключу. Параллельные писатели (другие потоки
+    и процессы ComfyUI) сериализуются блокировкой INDEX_DIR/LOCK_NAME.
+    """
+    directory = os.path.realpath(directory)
+    ext = ext.lower()
+    count = max(1, int(count))
+    key = f"{prefix}{separator}*.{ext}"
+
+    with _process_lock:
+        try:
+            os.makedirs(os.path.join(directory, INDEX_DIR), exist_ok=True)
+            lock_path = _acquire_dir_lock(directory)
+        except (OSError, TimeoutError) as e:
+            # Папка только для чтения или блокировку не дождались — старое поведение без индекса
+            print(f"[OutputCounter] Index unavailable ({e}), scanning directory")
+            n = _scan_next(directory, prefix, ext, separator)
+            return _skip_taken(directory, prefix, ext, separator, width, n, count)
+
+        try:
+            index = _load_index(directory)
+            entry = index.get(key)
+            dir_mtime = _dir_mtime_ns(directory)
+            if not isinstance(entry, dict) or not isinstance(entry.get("next"), int):
+                n = _scan_next(directory, prefix, ext, separator)
+            else:
+                n = entry["next"]
+                recent = time.time_ns() - dir_mtime < MTIME_GRANULARITY_NS
+                if entry.get("dir_mtime_ns") != dir_mtime or recent:
+                    n = _skip_taken(directory, prefix, ext, separator, width, n, count)
+
+            index[key] = {"next": n + count, "dir_mtime_ns": dir_mtime}
+            try:
+                _save_index(directory, index)
+            except OSError as e:
+                print(f"[OutputCounter] Cannot write index: {e}")
+            return n
+        finally:
+            try: os.remove(lock_path)
+            except OSError: pass
+
+
+def reserve_file(directory, prefix, ext, separator="_", width=5, attempts=100):
+    """
+    Резервирует номер и сразу атомарно создает пустой файл с этим именем (O_CREAT | O_EXCL).
+    Даже если кто-то пишет в папку в обход индекса, два воркера очереди не получат одно имя,
+    а ffmpeg -y не перезапишет чужой файл. Возвращает (номер, полный путь).
+    """
+    for _ in range(attempts):
+        n = reserve_counter(directory, prefix, ext, separator, count=1, width=width)
+        path = os.path.join(directory, format_name(prefix, n, ext.lower(), separator, width))
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+            os.close(fd)
+            return n, path
+        except FileExistsError:
+            continue
+    raise FileExistsError(f"Cannot reserve a free name for {prefix}{separator}*.{ext} in {directory}")
+
+
+def release_file(path):
+    """Удаляет заглушку от reserve_file, если в нее так ничего и не записали"""
+    try:
+        if os.path.isfile(path) and os.path.getsize(path) == 0:
+            os.remove(path)
+    except OSError:
+        pass
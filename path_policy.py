@@ -0,0 +1,101 @@
+import os
+import threading
+from pathlib import Path
+
+import folder_paths
+
+# Какие пути ноды и API браузера папок могут читать и куда писать (защита от Path Traversal и symlink-ов наружу).
+# Корни (input/output/temp) резолвятся один раз и кэшируются по строкам из folder_paths: если ComfyUI
+# перенастроил папку (--output-directory, set_output_directory), строка меняется и корень резолвится заново.
+# Если сам корень — symlink, который перенаправили на лету, нужен invalidate().
+MAX_PATH_LENGTH = 1024
+READ_ROOTS = ("input", "output", "temp")
+WRITE_ROOTS = ("output", "temp")
+
+_DIRECTORY_GETTERS = {
+    "input": "get_input_directory",
+    "output": "get_output_directory",
+    "temp": "get_temp_directory",
+}
+
+_roots = {}  # (вид, настроенный путь) -> Path после resolve()
+_lock = threading.Lock()
+
+
+def invalidate():
+    """Сбросить закэшированные корни"""
+    with _lock:
+        _roots.clear()
+
+
+def root(kind):
+    """Резолвнутый корень: "input", "output" или "temp" """
+    configured = getattr(folder_paths, _DIRECTORY_GETTERS[kind])()
+    key = (kind, configured)
+    resolved = _roots.get(key)
+    if resolved is None:
+        resolved = Path(configured).resolve()
+        with _lock:
+            # старые значения того же вида больше не нужны
+            for stale in [k for k in _roots if k[0] == kind]:
+                del _roots[stale]
+            _roots[key] = resolved
+    return resolved
+
+
+def allowed_roots(kinds=READ_ROOTS):
+    return [root(kind) for kind in kinds]
+
+
+def _inside(resolved, roots):
+    for allowed in roots:
+        try:
+            # Python 3.9+
+            if hasattr(resolved, "is_relative_to"):
+                if resolved.is_relative_to(allowed): return True
+            else:
+                # Python 3.8
+                if resolved == allowed or str(resolved).startswith(str(allowed) + os.sep): return True
+        except: continue
+    return False
+
+
+def is_allowed(path_str, kinds=READ_ROOTS):
+    """Путь (после resolve: symlink-и и ..) лежит внутри одного из корней kinds"""
+    try:
+        if not path_str or len(str(path_str)) > MAX_PATH_LENGTH: return False
+        return _inside(Path(path_str).resolve(), allowed_roots(kinds))
+    except Exception:
+        return False
+
+
+def filter_allowed(paths, kinds=READ_ROOTS):
+    """
+    Пути из paths, которые разрешены (порядок сохраняется) — для списков файлов и сканов папок.
+    Корни резолвятся один раз на вызов; родительская папка — один раз на папку, а файл, который не symlink,
+    дальше не резолвится (realpath(папка/имя) == realpath(папка)/имя), то есть на файл — один lstat вместо
+    цепочки по всем компонентам пути.
+    """
+    try:
+        roots = allowed_roots(kinds)
+    except Exception:
+        return []
+    parents = {}
+    result = []
+    for path_str in paths:
+        try:
+            path_str = str(path_str)
+            if not path_str or len(path_str) > MAX_PATH_LENGTH: continue
+            head, name = os.path.split(path_str)
+            if name in ("", ".", "..") or os.path.islink(path_str):
+                resolved = Path(path_str).resolve()
+            else:
+                parent = parents.get(head)
+                if parent is None:
+                    parent = parents[head] = Path(head or ".").resolve()
+                resolved = parent / name
+            if _inside(resolved, roots):
+                result.append(path_str)
+        except Exception:
+            continue
+    return result
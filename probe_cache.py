@@ -0,0 +1,168 @@
+import os
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from .ffmpeg_runner import run_ffmpeg, FFmpegError
+
+# Кэш результатов ffprobe и анализа кадров.
+# Ключ — (путь, размер, mtime_ns): пока файл не менялся, повторный анализ не запускает ни одного процесса.
+# Два уровня: LRU в памяти процесса и SQLite на диске (переживает перезапуск ComfyUI).
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+DB_NAME = "probe_cache.sqlite"
+MEMORY_ENTRIES = 4096
+PROBE_TIMEOUT = 30
+
+
+def file_signature(path):
+    """(realpath, size, mtime_ns) или None, если файла нет"""
+    try:
+        real = os.path.realpath(path)
+        st = os.stat(real)
+        return real, st.st_size, st.st_mtime_ns
+    except OSError:
+        return None
+
+
+class ProbeCache:
+    def __init__(self, db_path=None, memory_entries=MEMORY_ENTRIES):
+        self.db_path = db_path or os.path.join(CACHE_DIR, DB_NAME)
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_failed = False
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    def _connect(self):
+        """Ленивое подключение к SQLite; если папка только для чтения — работаем только в памяти"""
+        if self._db is None and not self._db_failed:
+            try:
+                os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+                db = sqlite3.connect(self.db_path, timeout=5.0, check_same_thread=False)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS probes ("
+                    "path TEXT, kind TEXT, size INTEGER, mtime_ns INTEGER, value TEXT, "
+                    "PRIMARY KEY (path, kind))"
+                )
+                db.commit()
+                self._db = db
+            except Exception as e:
+                print(f"[ProbeCache] Disk cache disabled: {e}")
+                self._db_failed = True
+        return self._db
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, kind, signature):
+        path, size, mtime_ns = signature
+        key = (kind, path, size, mtime_ns)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return self._memory[key]
+
+            db = self._connect()
+            if db is not None:
+                try:
+                    row = db.execute(
+                        "SELECT value FROM probes WHERE path = ? AND kind = ? AND size = ? AND mtime_ns = ?",
+                        (path, kind, size, mtime_ns)
+                    ).fetchone()
+                except sqlite3.Error:
+                    row = None
+                if row is not None:
+                    try:
+                        value = json.loads(row[0])
+                    except ValueError:
+                        value = None
+                    if value is not None:
+                        self._remember(key, value)
+                        self.stats["disk_hits"] += 1
+                        return value
+
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, kind, signature, value):
+        path, size, mtime_ns = signature
+        with self._lock:
+            self._remember((kind, path, size, mtime_ns), value)
+            db = self._connect()
+            if db is None:
+                return
+            try:
+                # Старая запись для этого пути (другие size/mtime) заменяется
+                db.execute(
+                    "INSERT OR REPLACE INTO probes (path, kind, size, mtime_ns, value) VALUES (?, ?, ?, ?, ?)",
+                    (path, kind, size, mtime_ns, json.dumps(value))
+                )
+                db.commit()
+            except (sqlite3.Error, TypeError, ValueError) as e:
+                print(f"[ProbeCache] Cannot store {kind} for {path}: {e}")
+
+    def cached(self, kind, path, compute):
+        """
+        Значение kind для файла path: из кэша или compute(path).
+        None из compute не кэшируется (ошибку пробы стоит повторить в следующий раз).
+        """
+        signature = file_signature(path)
+        if signature is None:
+            return compute(path)
+        value = self.get(kind, signature)
+        if value is not None:
+            return value
+        value = compute(path)
+        if value is not None:
+            self.put(kind, signature, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            db = self._connect()
+            if db is not None:
+                try:
+                    db.execute("DELETE FROM probes")
+                    db.commit()
+                except sqlite3.Error:
+                    pass
+
+
+_cache = ProbeCache()
+
+
+def get_cache():
+    return _cache
+
+
+def cache_stats():
+    return dict(_cache.stats)
+
+
+def _run_ffprobe(path):
+    """ffprobe через run_ffmpeg: отменяется кнопкой Cancel, причина ошибки — из хвоста stderr"""
+    cmd = [
+        'ffprobe', '-v', 'error', '-print_format', 'json',
+        '-show_format', '-show_streams', path
+    ]
+    try:
+        result = run_ffmpeg(cmd, capture_stdout=True, check=False, timeout=PROBE_TIMEOUT)
+    except (OSError, FFmpegError) as e:
+        print(f"[ProbeCache] ffprobe failed for {path}: {e}")
+        return None
+    if result.returncode != 0:
+        print(f"[ProbeCache] ffprobe failed for {path}: {result.stderr[-300:].strip()}")
+        return None
+    return json.loads(result.stdout)
+
+
+def probe_json(path):
+    """Полный вывод ffprobe (-show_format -show_streams) как dict; None, если файл не читается"""
+    return _cache.cached("ffprobe", path, _run_ffprobe)
@@ -2,16 +2,33 @@ import os
 import json
 import folder_paths
 from PIL import Image, PngImagePlugin
-import numpy as np
 from pathlib import Path
 import datetime
 import re
+from concurrent.futures import ThreadPoolExecutor
+import comfy.utils
+from .frame_buffers import iter_uint8_chunks
+from .output_counter import reserve_counter
+
+
+def _save_frame(img_array, full_path, ext, metadata, compress_level):
+    """Кодирование и запись одного кадра"""
+    img = Image.fromarray(img_array)
+    if ext == "png":
+        img.save(full_path, pnginfo=metadata, compress_level=compress_level)
+    else:
+        if img.mode == 'RGBA': img = img.convert('RGB')
+        img.save(full_path, quality=100)
+    return full_path
+
 
 class SaveImagesPreviewPassthrough:
     def __init__(self):
         self.output_dir = folder_paths.get_output_directory()
         self.type = "output"
         self.compress_level = 4
+        # Сколько кадров за раз переводим в uint8 (ограничивает пик памяти при сохранении)
+        self.chunk_size = 16
 
     @classmethod
     def INPUT_TYPES(cls):
@@ -26,6 +43,12 @@ class SaveImagesPreviewPassthrough:
                 "hide_preview": ("BOOLEAN", {"default": False}),
                 "delimiter": (["comma", "dot", "hyphen", "underline", "newline"], {"default": "comma"}),
             },
+            "optional": {
+                # Параллельное кодирование PNG/JPEG: 0 = по числу ядер, 1 = последовательно
+                "save_workers": ("INT", {"default": 0, "min": 0, "max": 128, "step": 1}),
+                # Куда писать prompt/workflow: в каждый PNG, только в первый кадр или в один .json на батч
+                "embed_workflow": (["all frames", "first frame", "sidecar json"], {"default": "all frames"}),
+            },
             "hidden": {"prompt": "PROMPT", "extra_pnginfo": "EXTRA_PNGINFO"},
         }
 
@@ -64,8 +87,70 @@ class SaveImagesPreviewPassthrough:
         except:
             return str(root_output)
 
+    def build_pnginfo(self, prompt, extra_pnginfo):
+        metadata = PngImagePlugin.PngInfo()
+        if prompt: metadata.add_text("prompt", json.dumps(prompt))
+        if extra_pnginfo:
+            for x in extra_pnginfo: metadata.add_text(x, json.dumps(extra_pnginfo[x]))
+        return metadata
+
+    def write_sidecar_json(self, path, prompt, extra_pnginfo):
+        """Один .json с prompt/workflow на весь батч (рядом с первым кадром)"""
+        data = {}
+        if prompt: data["prompt"] = prompt
+        if extra_pnginfo:
+            for x in extra_pnginfo: data[x] = extra_pnginfo[x]
+        if not data:
+            return
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+        except Exception as e:
+            print(f"[SaveImagesPreview] Cannot write metadata json: {e}")
+
+    def write_frames(self, images, jobs, save_workers):
+        """
+        Запись кадров через пул потоков с прогрессом по каждому кадру.
+        Кадры приходят порциями из iter_uint8_chunks, поэтому дополнительная память
+        ограничена размером чанка, а не всего батча.
+        """
+        pbar = comfy.utils.ProgressBar(len(jobs))
+        workers = save_workers if save_workers > 0 else (os.cpu_count() or 1)
+        workers = min(workers, len(jobs))
+        chunk_size = max(self.chunk_size, workers * 2)
+        chunks = iter_uint8_chunks(images, chunk_size, buffers=2)
+
+        if workers <= 1:
+            idx = 0
+            for chunk in chunks:
+                for frame in chunk:
+                    _save_frame(frame, *jobs[idx])
+                    pbar.update(1)
+                    idx += 1
+            return
+
+        # PIL отпускает GIL при сжатии zlib/JPEG, поэтому хватает потоков. Пул процессов здесь не используется:
+        # каждая задача пиклила бы кадр и PngInfo, а spawn-воркеры внутри сервера ComfyUI заново импортируют torch/CUDA
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            prev = []
+            idx = 0
+            for chunk in chunks:
+                cur = []
+                for frame in chunk:
+                    cur.append(executor.submit(_save_frame, frame, *jobs[idx]))
+                    idx += 1
+                # Следующий чанк пишется в буфер предыдущего — дожидаемся его кадров
+                for f in prev:
+                    f.result()
+                    pbar.update(1)
+                prev = cur
+            for f in prev:
+                f.result()
+                pbar.update(1)
+
     def save_images(self, images, filename_prefix, output_path, create_date_folder, file_format, 
-                   filename_separator, hide_preview, delimiter, prompt=None, extra_pnginfo=None):
+                   filename_separator, hide_preview, delimiter, save_workers=0,
+                   embed_workflow="all frames", prompt=None, extra_pnginfo=None):
         
         batch_count = len(images)
 
@@ -93,65 +178,55 @@ class SaveImagesPreviewPassthrough:
         delimiter_map = {"comma": ",", "dot": ".", "hyphen": "-", "underline": "_", "newline": "\n"}
         actual_delimiter = delimiter_map.get(delimiter, ",")
 
-        counter = 1
-        if os.path.exists(final_output_dir):
-            try:
-                existing = [f for f in os.listdir(final_output_dir) if f.startswith(clean_prefix) and f.lower().endswith(f".{ext}")]
-                if existing:
-                    prefix_len = len(clean_prefix) + len(filename_separator)
-                    max_num = 0
-                    for f in existing:
-                        try:
-                            num_part = f[prefix_len : -(len(ext)+1)]
-                            if num_part.isdigit():
-                                max_num = max(max_num, int(num_part))
-                        except: continue
-                    counter = max_num + 1
-            except: pass
+        # 4. Counter: номер из индекса папки вместо os.listdir на каждом запуске
+        try:
+            counter = reserve_counter(final_output_dir, clean_prefix, ext, filename_separator, count=batch_count)
+        except Exception as e:
+            print(f"[SaveImagesPreview] Counter error: {e}")
+            counter = 1
 
         # 5. Saving
         results = []
         all_saved_paths = []
-        images_np = (images.cpu().numpy() * 255).clip(0, 255).astype(np.uint8)
-
-        for img_array in images_np:
-            img = Image.fromarray(img_array)
-            metadata = None
-            if ext == "png":
-                metadata = PngImagePlugin.PngInfo()
-                if prompt: metadata.add_text("prompt", json.dumps(prompt))
-                if extra_pnginfo:
-                    for x in extra_pnginfo: metadata.add_text(x, json.dumps(extra_pnginfo[x]))
-
-            filename = f"{clean_prefix}{filename_separator}{counter:05d}.{ext}"
-            full_path = os.path.join(final_output_dir, filename)
-            
-            if ext == "png":
-                img.save(full_path, pnginfo=metadata, compress_level=self.compress_level)
-            else:
-                if img.mode == 'RGBA': img = img.convert('RGB')
-                img.save(full_path, quality=100)
 
-            all_saved_paths.append(full_path)
+        subfolder = ""
+        try:
+            p_root = Path(self.output_dir).resolve()
+            p_final = Path(final_output_dir).resolve()
             
-            subfolder = ""
             try:
-                p_root = Path(self.output_dir).resolve()
-                p_final = Path(final_output_dir).resolve()
-                
-                try:
-                    if hasattr(p_final, 'is_relative_to') and p_final.is_relative_to(p_root):
-                        subfolder = str(p_final.relative_to(p_root))
-                    elif str(p_final).startswith(str(p_root)):
-                        subfolder = os.path.relpath(final_output_dir, self.output_dir)
-                except: pass
-                
-                if subfolder == ".": subfolder = ""
+                if hasattr(p_final, 'is_relative_to') and p_final.is_relative_to(p_root):
+                    subfolder = str(p_final.relative_to(p_root))
+                elif str(p_final).startswith(str(p_root)):
+                    subfolder = os.path.relpath(final_output_dir, self.output_dir)
             except: pass
+            
+            if subfolder == ".": subfolder = ""
+        except: pass
+
+        # Имена назначаются заранее по счетчику, поэтому порядок не зависит от того,
+        # какой воркер закончит первым
+        # Метаданные сериализуются один раз на батч, а не json.dumps на каждый кадр
+        metadata = None
+        if ext == "png" and embed_workflow != "sidecar json":
+            metadata = self.build_pnginfo(prompt, extra_pnginfo)
+
+        jobs = []
+        for i in range(batch_count):
+            filename = f"{clean_prefix}{filename_separator}{counter:05d}.{ext}"
+            full_path = os.path.join(final_output_dir, filename)
+            frame_metadata = metadata if (i == 0 or embed_workflow == "all frames") else None
+            jobs.append((full_path, ext, frame_metadata, self.compress_level))
 
+            all_saved_paths.append(full_path)
             results.append({"filename": filename, "subfolder": subfolder, "type": self.type})
             counter += 1
 
+        if embed_workflow == "sidecar json" and jobs:
+            self.write_sidecar_json(os.path.splitext(jobs[0][0])[0] + ".json", prompt, extra_pnginfo)
+
+        self.write_frames(images, jobs, save_workers)
+
         # 6. Return
         single_path_str = all_saved_paths[-1] if all_saved_paths else ""
         folder_path_str = final_output_dir
@@ -0,0 +1,247 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from .probe_cache import probe_json
+from .encoder_profiles import encoder_args, available_encoders, CPU_ENCODERS
+from .ffmpeg_runner import run_ffmpeg, FFmpegError
+
+# Склейка без перекодирования, когда это возможно.
+# Клипы сравниваются по параметрам потоков (ffprobe, из probe_cache); совпадающие с форматом большинства
+# идут в concat demuxer как есть, перекодируются только отличающиеся — сразу в формат большинства.
+SIGNATURE_FIELDS = ("codec", "width", "height", "pix_fmt", "fps", "time_base",
+                    "audio_codec", "sample_rate", "channels")
+
+# Кодек из ffprobe -> семейство encoder_profiles; остальные -> энкодер ffmpeg напрямую
+VIDEO_FAMILIES = {"h264": "h264", "hevc": "h265", "vp9": "vp9", "vp8": "vp8", "av1": "av1"}
+VIDEO_ENCODERS = {"mpeg4": "mpeg4", "prores": "prores_ks"}
+AUDIO_ENCODERS = {"aac": "aac", "opus": "libopus", "mp3": "libmp3lame", "vorbis": "libvorbis",
+                  "pcm_s16le": "pcm_s16le", "flac": "flac"}
+
+# Что контейнер принимает без перекодирования (None — что угодно)
+CONTAINER_CODECS = {
+    ".mp4": ({"h264", "hevc", "av1", "mpeg4"}, {"aac", "mp3", "opus", "flac"}),
+    ".mov": ({"h264", "hevc", "mpeg4", "prores"}, {"aac", "mp3", "pcm_s16le", "flac"}),
+    ".webm": ({"vp8", "vp9", "av1"}, {"opus", "vorbis"}),
+    ".mkv": (None, None),
+}
+
+
+def write_concat_list(list_path, paths, outpoints=None):
+    """
+    Список для concat demuxer'а (пути с прямыми слешами, кавычки экранированы).
+    outpoints — конец каждого файла в секундах (outpoint): следующий файл начнется ровно с этого места.
+    """
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for i, p in enumerate(paths):
+            p = p.replace('\\', '/').replace("'", "'\\''")
+            f.write(f"file '{p}'\n")
+            if outpoints and outpoints[i]:
+                f.write(f"outpoint {outpoints[i]:.6f}\n")
+
+
+def stream_signature(path):
+    """Параметры первого видео- и аудиопотока, от которых зависит склейка через -c copy; None — не видео"""
+    data = probe_json(path)
+    if not data:
+        return None
+    streams = data.get("streams", [])
+    v = next((s for s in streams if s.get("codec_type") == "video"), None)
+    if v is None:
+        return None
+    a = next((s for s in streams if s.get("codec_type") == "audio"), None)
+    return (
+        v.get("codec_name"), int(v.get("width", 0)), int(v.get("height", 0)), v.get("pix_fmt"),
+        v.get("r_frame_rate"), v.get("time_base"),
+        a.get("codec_name") if a else None,
+        str(a.get("sample_rate")) if a else None,
+        int(a.get("channels", 0)) if a else None,
+    )
+
+
+def _parse_duration(value):
+    """"12.5" или "00:00:12.500000000" (тег DURATION в mkv/webm) -> секунды; None, если не разобрать"""
+    try:
+        if isinstance(value, str) and ":" in value:
+            h, m, s = value.split(":")
+            return int(h) * 3600 + int(m) * 60 + float(s)
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _video_stream(path):
+    data = probe_json(path) or {}
+    return next((s for s in data.get("streams", []) if s.get("codec_type") == "video"), None)
+
+
+def video_duration(path):
+    """Длина первого видеопотока в секундах (probe_cache); None, если ffprobe ее не знает"""
+    v = _video_stream(path)
+    if v is None:
+        return None
+    duration = _parse_duration(v.get("duration")) or _parse_duration((v.get("tags") or {}).get("DURATION"))
+    return duration if duration and duration > 0 else None
+
+
+def video_end(path):
+    """
+    Метка времени конца видео (start_time + длина) — outpoint для concat demuxer'а.
+    После склейки -c copy видео может начинаться не с нуля (задержка энкодера AAC), и длины мало.
+    """
+    duration = video_duration(path)
+    if duration is None:
+        return None
+    return (_parse_duration(_video_stream(path).get("start_time")) or 0.0) + duration
+
+
+def plan_concat(paths):
+    """
+    (целевая сигнатура, индексы клипов для перекодирования, сигнатуры всех клипов).
+    Цель — самая частая сигнатура (при равенстве — та, что встретилась раньше). (None, None, sigs), если хоть один файл не разобрать.
+    """
+    sigs = [stream_signature(p) for p in paths]
+    if not sigs or any(s is None for s in sigs):
+        return None, None, sigs
+    target = Counter(sigs).most_common(1)[0][0]
+    return target, [i for i, s in enumerate(sigs) if s != target], sigs
+
+
+def describe_mismatch(sig, target):
+    return ", ".join(f"{name} {a}->{b}" for name, a, b in zip(SIGNATURE_FIELDS, sig, target) if a != b)
+
+
+def conform_command(src, dst, target, has_audio, threads=0, video_options=None):
+    """
+    ffmpeg-команда, приводящая src к сигнатуре target; None — для кодека нет энкодера (в том числе в локальной сборке ffmpeg).
+    video_options — profile / crf / preset / tune / threads для encoder_args, чтобы перекодированный кусок был
+    в качестве остального файла; threads из video_options (если > 0) важнее переданного threads.
+    """
+    codec, width, height, pix_fmt, fps, time_base, audio_codec, sample_rate, channels = target
+    if audio_codec and audio_codec not in AUDIO_ENCODERS:
+        return None
+    if codec in VIDEO_FAMILIES:
+        options = dict(video_options or {})
+        threads = options.pop("threads", 0) or threads
+        video_args = encoder_args(VIDEO_FAMILIES[codec], pix_fmt=pix_fmt, threads=threads, **options)
+        if video_args[1] not in CPU_ENCODERS[VIDEO_FAMILIES[codec]]:
+            return None  # resolve_encoder подменил отсутствующий энкодер на libx264 — кодек уже не тот
+    elif codec in VIDEO_ENCODERS:
+        video_args = ["-c:v", VIDEO_ENCODERS[codec], "-pix_fmt", pix_fmt] + (["-threads", str(threads)] if threads else [])
+    else:
+        return None
+    available = available_encoders()
+    if available and video_args[1] not in available:
+        return None
+
+    cmd = ["ffmpeg", "-y", "-v", "error", "-i", src]
+    if audio_codec and not has_audio:
+        # У клипа нет звука, а у остальных есть — подкладываем тишину той же раскладки
+        layout = "mono" if channels == 1 else "stereo"
+        cmd += ["-f", "lavfi", "-i", f"anullsrc=r={sample_rate}:cl={layout}"]
+
+    cmd += ["-vf", f"scale={width}:{height},setsar=1,fps={fps}", "-map", "0:v:0"] + video_args + ["-fps_mode", "cfr"]
+    # Длина куска = длина его видео: звук обрезается или добивается тишиной, чтобы на стыке дорожки не разъезжались.
+    # -shortest тут не годится: из-за буферизации энкодера звука он теряет последний кадр видео
+    duration = video_duration(src)
+    if os.path.splitext(dst)[1].lower() in (".mp4", ".mov") and time_base and "/" in time_base:
+        cmd += ["-video_track_timescale", time_base.split("/")[1]]
+
+    if audio_codec:
+        cmd += ["-map", "0:a:0" if has_audio else "1:a:0", "-c:a", AUDIO_ENCODERS[audio_codec],
+                "-ar", sample_rate, "-ac", str(channels)]
+        if duration is None:
+            cmd += ["-shortest"]
+        elif has_audio:
+            cmd += ["-af", "apad"]
+    else:
+        cmd += ["-an"]
+    if duration is not None:
+        cmd += ["-t", f"{duration:.6f}"]
+    return cmd + [dst]
+
+
+def smart_concat(paths, output_path, workers=0, tag="[SmartConcat]", video_options=None, trim_to_video=False):
+    """
+    Склейка paths в output_path: -c copy, если все клипы совместимы; иначе сначала перекодируются
+    только отличающиеся (параллельно, с настройками ноды video_options — см. conform_command), потом все вместе склеиваются через -c copy.
+    trim_to_video=True — каждый кусок кончается вместе со своим видео (outpoint = video_end), как при инкрементальном
+    дописывании: звук длиннее картинки не оставляет дыр в видео на стыках.
+    False — копированием не получится (кодек не лезет в контейнер, файл не разобрать) — вызывающий делает полное перекодирование.
+    """
+    target, mismatched, sigs = plan_concat(paths)
+    if target is None:
+        print(f"{tag} Smart concat: some inputs could not be probed, falling back to re-encode")
+        return False
+
+    ext = os.path.splitext(output_path)[1].lower()
+    allowed_video, allowed_audio = CONTAINER_CODECS.get(ext, (set(), set()))
+    if (allowed_video is not None and target[0] not in allowed_video) or \
+            (allowed_audio is not None and target[6] and target[6] not in allowed_audio):
+        print(f"{tag} Smart concat: {target[0]}/{target[6]} cannot be copied into {ext}, falling back to re-encode")
+        return False
+
+    work_dir = tempfile.mkdtemp(prefix=".smart_concat_", dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        parts = list(paths)
+        if mismatched:
+            cpu = os.cpu_count() or 1
+            workers = max(1, min(workers if workers > 0 else cpu, len(mismatched)))
+            jobs = []
+            for i in mismatched:
+                dst = os.path.join(work_dir, f"conform_{i:05d}{ext}")
+                cmd = conform_command(paths[i], dst, target, sigs[i][6] is not None, max(1, cpu // workers), video_options)
+                if cmd is None:
+                    print(f"{tag} Smart concat: no encoder for {target[0]}, falling back to re-encode")
+                    return False
+                print(f"{tag} Re-encoding {os.path.basename(paths[i])}: {describe_mismatch(sigs[i], target)}")
+                jobs.append((i, cmd, dst))
+
+            # Первая ошибка или отмена останавливает остальные процессы пула
+            stop = threading.Event()
+
+            def run(job):
+                if stop.is_set():
+                    return None
+                try:
+                    res = run_ffmpeg(job[1], check=False, stop_event=stop)
+                except FFmpegError as e:
+                    return e  # остановлен из-за ошибки в другом процессе; у исключения те же returncode / stderr
+                except Exception:
+                    stop.set()  # отмена — остальные процессы тоже убиваются
+                    raise
+                if res.returncode != 0: stop.set()
+                return res
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                try:
+                    results = list(executor.map(run, jobs))
+                finally:
+                    stop.set()
+            for (i, cmd, dst), res in zip(jobs, results):
+                if res is None:
+                    continue  # не запускался: уже есть ошибка, о ней сообщит ее собственный результат
+                if res.returncode != 0:
+                    print(f"{tag} Re-encode failed for {paths[i]}: {res.stderr[-300:]}")
+                    return False
+                parts[i] = dst
+            print(f"{tag} Re-encoded {len(jobs)}/{len(paths)} clips in {time.perf_counter() - start:.2f}s")
+        else:
+            print(f"{tag} All {len(paths)} clips match, stream copy")
+
+        list_path = os.path.join(work_dir, "list.txt")
+        write_concat_list(list_path, parts, [video_end(p) for p in parts] if trim_to_video else None)
+        cmd = ["ffmpeg", "-y", "-v", "error", "-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy"]
+        if ext in (".mp4", ".mov"):
+            cmd += ["-movflags", "+faststart"]
+        res = run_ffmpeg(cmd + [output_path], check=False, cleanup=[output_path])
+        if res.returncode != 0:
+            print(f"{tag} Stream copy concat failed: {res.stderr[-300:]}")
+            return False
+        return True
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
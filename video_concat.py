@@ -1,14 +1,27 @@
 import os
-import subprocess
 import folder_paths
 import random
 import datetime
 import math
-import numpy as np
-from PIL import Image
 import comfy.utils
 from pathlib import Path
 import re
+import time
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .probe_cache import get_cache, file_signature, probe_json
+from .frame_stats import sample_times, read_rgb_frames, rgb_stats
+from .smart_concat import smart_concat, write_concat_list, video_end
+from .encoder_profiles import encoder_args, PROFILES
+from .ffmpeg_runner import run_ffmpeg, progress_callback
+from .path_policy import is_allowed, READ_ROOTS
+from .clip_discovery import discover_clips, SORT_MODES
+from .incremental_concat import IncrementalConcat
+
+# Кусок короче этого не кодируем отдельно (клип почти целиком уходит в переходы)
+SEGMENT_MIN_DURATION = 0.1
 
 class VideoConcatFFmpeg:
     def __init__(self):
@@ -29,6 +42,7 @@ class VideoConcatFFmpeg:
                     [
                         "Auto (Re-encode H.264)", 
                         "Copy (Fastest, No Effects)", 
+                        "Smart (Stream-copy if compatible)", 
                     ], 
                     {"default": "Auto (Re-encode H.264)"}
                 ),
@@ -52,11 +66,31 @@ class VideoConcatFFmpeg:
                     {"default": "None"}
                 ),
                 "match_strength": ("FLOAT", {"default": 0.5, "min": 0.1, "max": 1.0, "step": 0.1}),
+            },
+            "optional": {
+                # Потоков для анализа клипов (ffprobe + декод кадра); 0 = авто
+                "analysis_workers": ("INT", {"default": 0, "min": 0, "max": 32, "step": 1}),
+                # Сколько кадров брать для статистики цвета: 1 = кадр на 20% длительности, больше — равномерно по клипу
+                "stats_frames": ("INT", {"default": 1, "min": 1, "max": 16, "step": 1}),
+                # Single graph — один filter_complex на все клипы; Parallel segments — каждый клип и каждое окно
+                # перехода кодируются отдельным ffmpeg параллельно, затем склейка concat demuxer'ом без перекодирования видео
+                "encode_strategy": (["Single graph", "Parallel segments"], {"default": "Single graph"}),
+                "encode_workers": ("INT", {"default": 0, "min": 0, "max": 32, "step": 1}),
+                # Профиль libx264 (encoder_profiles): default — настройки энкодера по умолчанию, как раньше
+                "encoder_profile": (["default"] + PROFILES, {"default": "default"}),
+                "encoder_threads": ("INT", {"default": 0, "min": 0, "max": 128, "step": 1}),  # 0 — авто
+                # Поиск клипов в VideoDir_path_*: подпапки, glob-маски (через запятую) и порядок склейки
+                "dir_recursive": ("BOOLEAN", {"default": False}),
+                "dir_include": ("STRING", {"default": ""}),
+                "dir_exclude": ("STRING", {"default": ""}),
+                "dir_sort": (SORT_MODES, {"default": "name"}),
+                # Один постоянный файл <output_name>.mp4: новые клипы дописываются к нему, старые не перекодируются
+                "incremental": ("BOOLEAN", {"default": False}),
             }
         }
 
-    RETURN_TYPES = ("STRING",)
-    RETURN_NAMES = ("output_file_path",)
+    RETURN_TYPES = ("STRING", "STRING")
+    RETURN_NAMES = ("output_file_path", "clip_list")
     FUNCTION = "concatenate_videos"
     OUTPUT_NODE = True
     CATEGORY = "video"
@@ -64,22 +98,7 @@ class VideoConcatFFmpeg:
     # --- SECURITY HELPERS ---
     def is_input_path_allowed(self, path_str: str) -> bool:
         """Проверяет, можно ли ЧИТАТЬ из этого пути"""
-        try:
-            if len(path_str) > self.max_path_len: return False
-            path = Path(path_str).resolve()
-            allowed_roots = [
-                Path(folder_paths.get_input_directory()).resolve(),
-                Path(folder_paths.get_output_directory()).resolve(),
-                Path(folder_paths.get_temp_directory()).resolve()
-            ]
-            for allowed in allowed_roots:
-                if hasattr(path, "is_relative_to"):
-                    if path.is_relative_to(allowed): return True
-                else:
-                    if str(path).startswith(str(allowed)): return True
-            return False
-        except:
-            return False
+        return is_allowed(path_str, READ_ROOTS)
 
     def sanitize_output_path(self, user_path: str) -> str:
         """Очищает путь для ЗАПИСИ (только в output)"""
@@ -127,50 +146,297 @@ class VideoConcatFFmpeg:
             print(f"[VideoConcat] Path error: {e}. Using root.")
             return str(root_output)
 
-    def analyze_frame_stats(self, path):
-        # (Код без изменений)
+    def analyze_frame_stats(self, path, sample_frames=1):
+        """Статистика кадров для цветокоррекции. Для неизмененных файлов (путь, размер, mtime) — из probe_cache, без ffprobe/ffmpeg"""
+        sample_frames = max(1, int(sample_frames))
+        cache_kind = f"frame_stats:{sample_frames}"
+        signature = file_signature(path)
+        cache = get_cache()
+        if signature is not None:
+            cached = cache.get(cache_kind, signature)
+            if cached is not None:
+                return dict(cached)
+
         stats = {"duration": 0.0, "has_audio": False, "r_avg": 0.0, "g_avg": 0.0, "b_avg": 0.0, "luma_avg": 0.0, "luma_std": 0.0, "sat_avg": 0.0, "valid": False}
         try:
-            cmd_probe = ["ffprobe", "-v", "error", "-show_entries", "format=duration:stream=codec_type", "-of", "json", path]
-            res = subprocess.run(cmd_probe, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            if res.returncode == 0:
-                import json
-                data = json.loads(res.stdout)
+            data = probe_json(path)
+            if data:
                 try: stats["duration"] = float(data["format"]["duration"])
                 except: pass
                 for s in data.get("streams", []):
                     if s.get("codec_type") == "audio":
                         stats["has_audio"] = True
                         break
-            seek_time = max(0.5, stats["duration"] * 0.2)
-            if seek_time > stats["duration"]: seek_time = 0.0
-            cmd_extract = ["ffmpeg", "-ss", str(seek_time), "-i", path, "-vframes", "1", "-f", "image2pipe", "-vcodec", "png", "-"]
-            process = subprocess.Popen(cmd_extract, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            stdout_data, _ = process.communicate()
-            if stdout_data:
-                import io
-                image = Image.open(io.BytesIO(stdout_data)).convert("RGB")
-                np_img = np.array(image)
-                means = np_img.mean(axis=(0,1)) 
-                stats["r_avg"] = means[0]; stats["g_avg"] = means[1]; stats["b_avg"] = means[2]
-                luma = 0.299 * np_img[:,:,0] + 0.587 * np_img[:,:,1] + 0.114 * np_img[:,:,2]
-                stats["luma_avg"] = luma.mean(); stats["luma_std"] = luma.std()
-                hsv_img = np.array(image.convert('HSV'))
-                v_chan = hsv_img[:,:,2]
-                s_chan = hsv_img[:,:,1]
-                valid_mask = v_chan > 25
-                if np.any(valid_mask):
-                    valid_sats = s_chan[valid_mask]
-                    stats["sat_avg"] = np.percentile(valid_sats, 90)
-                else: stats["sat_avg"] = 0.0
+            frames = read_rgb_frames(path, sample_times(stats["duration"], sample_frames))
+            if frames is not None:
+                stats.update(rgb_stats(frames))
                 stats["valid"] = True
         except Exception as e:
             print(f"[VideoConcat] Analysis Error {path}: {e}")
-        return stats
+
+        # Неудачный анализ не кэшируем — в следующий раз попробуем снова
+        if stats["valid"] and signature is not None:
+            cache.put(cache_kind, signature, stats)
+        return dict(stats)
+
+    def analyze_clips(self, video_files, workers=0, sample_frames=1):
+        """
+        analyze_frame_stats для всех клипов в пуле потоков: работа упирается в подпроцессы ffprobe/ffmpeg,
+        GIL не мешает. Результаты в порядке video_files.
+        """
+        if workers <= 0:
+            workers = min(8, os.cpu_count() or 1)
+        workers = max(1, min(workers, len(video_files)))
+
+        def timed(path):
+            start = time.perf_counter()
+            info = self.analyze_frame_stats(path, sample_frames)
+            print(f"[VideoConcat] Analyzed {os.path.basename(path)} in {time.perf_counter() - start:.2f}s")
+            return info
+
+        start = time.perf_counter()
+        if workers == 1:
+            results = [timed(v) for v in video_files]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(timed, video_files))
+        print(f"[VideoConcat] Analysis of {len(video_files)} clips: {time.perf_counter() - start:.2f}s ({workers} workers)")
+        return results
+
+    def write_concat_list(self, list_path, paths, outpoints=None):
+        write_concat_list(list_path, paths, outpoints)
+
+    def total_duration(self, paths):
+        """Суммарная длительность по ffprobe (из probe_cache) — для прогресса кодирования"""
+        total = 0.0
+        for p in paths:
+            try: total += float(((probe_json(p) or {}).get("format") or {}).get("duration", 0))
+            except (TypeError, ValueError): pass
+        return total
+
+    def clip_filter_chain(self, cur, ref, is_ref, apply, match_strength):
+        """Цепочка фильтров клипа: подгонка eq/colorbalance под референс + приведение формата"""
+        filters = []
+        if any(apply.values()) and not is_ref and cur["valid"]:
+            eq_params = []
+            cb_params = [] 
+            if apply["bright"]:
+                diff = (ref["luma_avg"] - cur["luma_avg"]) / 255.0 * match_strength
+                diff = max(-0.3, min(0.3, diff))
+                if abs(diff) > 0.005: eq_params.append(f"brightness={diff:.3f}")
+            if apply["contr"]:
+                c_std = max(5.0, cur["luma_std"])
+                r_std = max(5.0, ref["luma_std"])
+                contrast = 1.0 + (r_std / c_std - 1.0) * match_strength
+                contrast = max(0.85, min(1.4, contrast))
+                if abs(contrast - 1.0) > 0.02: eq_params.append(f"contrast={contrast:.3f}")
+            if apply["sat"]:
+                c_sat = max(5.0, cur["sat_avg"])
+                r_sat = max(5.0, ref["sat_avg"])
+                sat = 1.0 + (r_sat / c_sat - 1.0) * match_strength
+                if sat < 1.0: sat = max(0.9, sat) 
+                else: sat = min(1.6, sat)
+                if abs(sat - 1.0) > 0.02: eq_params.append(f"saturation={sat:.3f}")
+            if apply["gamma"]:
+                target_gamma = ref["luma_avg"] / max(5.0, cur["luma_avg"])
+                gamma = 1.0 + (target_gamma - 1.0) * (match_strength * 0.5)
+                gamma = max(0.85, min(1.25, gamma))
+                if abs(gamma - 1.0) > 0.05: eq_params.append(f"gamma={gamma:.3f}")
+            if apply["wb"]:
+                def get_bal(ref_c, cur_c):
+                    diff = (ref_c - cur_c) / 255.0 * match_strength
+                    return max(-0.3, min(0.3, diff))
+                r_bal = get_bal(ref["r_avg"], cur["r_avg"])
+                g_bal = get_bal(ref["g_avg"], cur["g_avg"])
+                b_bal = get_bal(ref["b_avg"], cur["b_avg"])
+                if abs(r_bal)>0.01 or abs(g_bal)>0.01 or abs(b_bal)>0.01:
+                    cb_params.extend([f"rm={r_bal:.3f}", f"gm={g_bal:.3f}", f"bm={b_bal:.3f}"])
+            if eq_params: filters.append(f"eq={':'.join(eq_params)}")
+            if cb_params: filters.append(f"colorbalance={':'.join(cb_params)}")
+        filters.append("format=yuv420p,setsar=1") 
+        return ",".join(filters)
+
+    def plan_segments(self, files_data, do_crossfade, transition_delay):
+        """
+        Раскладка на независимые куски: тело каждого клипа без участков перехода и окна переходов
+        (хвост клипа i + начало клипа i+1). Суммарная длина та же, что у цепочки xfade.
+        None — если клипы короче окон или длительность неизвестна (тогда только Single graph).
+        """
+        T = transition_delay if do_crossfade else 0.0
+        n = len(files_data)
+        segments = []
+        for i, cur in enumerate(files_data):
+            head = T if i > 0 else 0.0
+            tail = T if i < n - 1 else 0.0
+            if cur["duration"] <= 0 or cur["duration"] - head - tail < SEGMENT_MIN_DURATION:
+                return None
+            segments.append(("body", i, head, cur["duration"] - head - tail))
+            if tail > 0:
+                segments.append(("xfade", i, cur["duration"] - T, T))
+        return segments
+
+    def encode_segments(self, files_data, chains, final_output_path, target_dir, segments,
+                        transition_delay, has_audio, workers, pbar, video_args=None):
+        """
+        Parallel segments: тела клипов (с цветокоррекцией) и короткие окна xfade кодируются
+        отдельными ffmpeg-процессами с одинаковыми параметрами, затем склеиваются concat demuxer'ом
+        (видео -c copy, звук кодируется в AAC один раз).
+        Процессы запускаются из пула потоков — сами потоки только ждут ffmpeg.
+        """
+        cpu = os.cpu_count() or 1
+        if workers <= 0:
+            workers = cpu
+        workers = max(1, min(workers, len(segments)))
+        threads = max(1, cpu // workers)
+
+        probe = probe_json(files_data[0]["path"]) or {}
+        video_stream = next((st for st in probe.get("streams", []) if st.get("codec_type") == "video"), {})
+        rate = video_stream.get("r_frame_rate") or "25/1"
+        try:
+            num, den = map(float, rate.split("/"))
+            fps = num / den
+        except:
+            fps = 0.0
+        if fps <= 0:
+            rate, fps = "25/1", 25.0
+
+        # Одинаковые параметры у всех кусков — иначе concat -c copy не склеит.
+        # Звук в кусках — PCM в .mov: у AAC на каждом стыке была бы пауза от priming'а энкодера,
+        # поэтому в AAC он кодируется один раз при финальной склейке (видео при этом копируется)
+        out_args = list(video_args or encoder_args("h264", pix_fmt="yuv420p"))
+        if "-threads" not in out_args:
+            out_args += ["-threads", str(threads)]
+        out_args += ["-r", rate, "-fps_mode", "cfr", "-video_track_timescale", "90000"]
+        if has_audio:
+            out_args += ["-c:a", "pcm_s16le", "-ar", "48000", "-ac", "2"]
+        else:
+            out_args += ["-an"]
+
+        work_dir = tempfile.mkdtemp(prefix=".concat_segments_", dir=target_dir)
+        try:
+            jobs = []
+            position = 0.0
+            for k, (kind, i, start, length) in enumerate(segments):
+                # Число кадров считаем по общей временной шкале, чтобы округления по кускам не накапливались
+                frames = round((position + length) * fps) - round(position * fps)
+                position += length
+                # -ss ровно на границе кадра неоднозначен (первый кадр может задублироваться) — встаем на четверть кадра раньше
+                seek = max(0.0, (round(start * fps) - 0.25) / fps)
+                window = f"{length + 2.0 / fps:.3f}"
+                seg_path = os.path.join(work_dir, f"seg_{k:05d}.mov")
+                src = files_data[i]["path"]
+                cmd = ["ffmpeg", "-y", "-v", "error"]
+                if kind == "body":
+                    cmd += ["-ss", f"{seek:.3f}", "-t", window, "-i", src,
+                            "-vf", f"{chains[i]},fps={rate}", "-map", "0:v:0"]
+                    if has_audio: cmd += ["-map", "0:a:0"]
+                else:
+                    nxt = files_data[i + 1]["path"]
+                    graph = (f"[0:v]{chains[i]},fps={rate}[va];[1:v]{chains[i + 1]},fps={rate}[vb];"
+                             f"[va][vb]xfade=transition=fade:duration={transition_delay}:offset=0[v]")
+                    cmd += ["-ss", f"{seek:.3f}", "-t", window, "-i", src,
+                            "-t", window, "-i", nxt]
+                    if has_audio:
+                        graph += (f";[0:a]atrim=duration={length:.3f}[aa];[1:a]atrim=duration={length:.3f}[ab];"
+                                  f"[aa][ab]acrossfade=d={transition_delay}:c1=tri:c2=tri[a]")
+                    cmd += ["-filter_complex", graph, "-map", "[v]"]
+                    if has_audio: cmd += ["-map", "[a]"]
+                limits = ["-frames:v", str(frames), "-t", f"{frames / fps:.6f}"]
+                jobs.append((cmd + out_args + limits + [seg_path], seg_path))
+
+            # Первая ошибка или отмена останавливает и остальные процессы пула;
+            # наружу уходит именно она, а не "stopped" от остановленных следом
+            stop = threading.Event()
+            errors = []
+
+            def run(job):
+                if stop.is_set():
+                    return None
+                try:
+                    run_ffmpeg(job[0], stop_event=stop)
+                except Exception as e:
+                    if not stop.is_set(): errors.append(e)
+                    stop.set()
+                    raise
+                return job[1]
+
+            start_time = time.perf_counter()
+            done = 0
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(run, job) for job in jobs]
+                try:
+                    for future in futures:
+                        future.result()
+                        done += 1
+                        pbar.update_absolute(5 + int(85 * done / len(jobs)))
+                except Exception as e:
+                    stop.set()
+                    raise errors[0] if errors else e
+            print(f"[VideoConcat] Encoded {len(jobs)} segments in {time.perf_counter() - start_time:.2f}s ({workers} workers x {threads} threads)")
+
+            list_path = os.path.join(work_dir, "list.txt")
+            self.write_concat_list(list_path, [job[1] for job in jobs])
+            cmd = ["ffmpeg", "-y", "-v", "error", "-f", "concat", "-safe", "0", "-i", list_path, "-c:v", "copy"]
+            cmd += ["-c:a", "aac"] if has_audio else ["-an"]
+            cmd += ["-movflags", "+faststart", final_output_path]
+            run_ffmpeg(cmd, cleanup=[final_output_path])
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def encode_single_graph(self, video_files, files_data, chains, final_output_path,
+                            do_crossfade, transition_delay, has_audio_global, video_args=None, pbar=None):
+        """Single graph: один filter_complex (цветокоррекция + xfade/concat) на все клипы и одно кодирование"""
+        inputs = []
+        for v in video_files: inputs.extend(["-i", v])
+        filter_str = ""
+        prepared_streams = []
+        for i in range(len(files_data)):
+            stream_name = f"v{i}_prep"
+            filter_str += f"[{i}:v]{chains[i]}[{stream_name}];"
+            prepared_streams.append(stream_name)
+        last_v = prepared_streams[0]
+        last_a = "0:a" if has_audio_global else None
+        current_offset = 0.0
+        if do_crossfade:
+            for i in range(1, len(files_data)):
+                prev_dur = files_data[i-1]["duration"]
+                current_offset += prev_dur - transition_delay
+                next_v = prepared_streams[i]
+                target_v = f"v_out_{i}"
+                filter_str += f"[{last_v}][{next_v}]xfade=transition=fade:duration={transition_delay}:offset={current_offset:.3f}[{target_v}];"
+                last_v = target_v
+                if has_audio_global:
+                    next_a = f"{i}:a"
+                    target_a = f"a_out_{i}"
+                    filter_str += f"[{last_a}][{next_a}]acrossfade=d={transition_delay}:c1=tri:c2=tri[{target_a}];"
+                    last_a = target_a
+        else:
+            concat_ins = ""
+            for i in range(len(prepared_streams)):
+                concat_ins += f"[{prepared_streams[i]}]"
+                if has_audio_global: concat_ins += f"[{i}:a]"
+            a_val = 1 if has_audio_global else 0
+            filter_str += f"{concat_ins}concat=n={len(prepared_streams)}:v=1:a={a_val}[v_out_final]"
+            if has_audio_global: filter_str += "[a_out_final]"
+            last_v = "v_out_final"
+            last_a = "a_out_final" if has_audio_global else None
+        filter_str = filter_str.rstrip(";")
+        cmd = ["ffmpeg", "-y"]
+        cmd.extend(inputs)
+        cmd.extend(["-filter_complex", filter_str, "-map", f"[{last_v}]"])
+        if has_audio_global and last_a: cmd.extend(["-map", f"[{last_a}]", "-c:a", "aac"])
+        cmd.extend(list(video_args or encoder_args("h264", pix_fmt="yuv420p")) + ["-fps_mode", "cfr", final_output_path])
+        duration = sum(d["duration"] for d in files_data)
+        if do_crossfade: duration -= transition_delay * (len(files_data) - 1)
+        run_ffmpeg(cmd, duration=duration, on_progress=progress_callback(pbar, 5, 95) if pbar else None,
+                   cleanup=[final_output_path])
 
     def concatenate_videos(self, num_VideoFile_paths, num_VideoDir_paths, output_name, output_path, 
                           ffmpeg_mode, concat_mode, transition_delay, 
-                          force_match_everything, color_match_mode, wb_gamma_mode, match_strength, **kwargs):
+                          force_match_everything, color_match_mode, wb_gamma_mode, match_strength,
+                          analysis_workers=0, stats_frames=1, encode_strategy="Single graph", encode_workers=0,
+                          encoder_profile="default", encoder_threads=0,
+                          dir_recursive=False, dir_include="", dir_exclude="", dir_sort="name", incremental=False, **kwargs):
         
         # 1. Output Security
         target_dir = self.sanitize_output_path(output_path)
@@ -181,11 +447,14 @@ class VideoConcatFFmpeg:
         else:
             filename = re.sub(r'[^\w\-\.]', '_', output_name.strip())
         
-        counter = 1
-        final_output_path = os.path.join(target_dir, f"{filename}_{counter:04d}.mp4")
-        while os.path.exists(final_output_path):
-            counter += 1
+        if incremental:
+            final_output_path = os.path.join(target_dir, f"{filename}.mp4")
+        else:
+            counter = 1
             final_output_path = os.path.join(target_dir, f"{filename}_{counter:04d}.mp4")
+            while os.path.exists(final_output_path):
+                counter += 1
+                final_output_path = os.path.join(target_dir, f"{filename}_{counter:04d}.mp4")
         
         # 2. Input Security Collection
         video_files = []
@@ -216,34 +485,63 @@ class VideoConcatFFmpeg:
                 if os.path.isdir(clean):
                     if self.is_input_path_allowed(clean):
                         try:
-                            dfs = []
-                            for f in os.listdir(clean):
-                                full_path = os.path.join(clean, f)
-                                if os.path.splitext(f)[1].lower() in valid_ext:
-                                    if self.is_input_path_allowed(full_path):
-                                        dfs.append(os.path.abspath(full_path))
-                            dfs.sort()
-                            video_files.extend(dfs)
-                        except: pass
+                            video_files.extend(discover_clips(clean, dir_recursive, dir_include, dir_exclude,
+                                                              dir_sort, valid_ext, analysis_workers))
+                        except Exception as e:
+                            print(f"[VideoConcat] Error scanning directory {clean}: {e}")
                     else:
                         print(f"[VideoConcat] Security Block (Dir): {clean}")
 
+        job = None
+        if incremental:
+            job = IncrementalConcat(final_output_path, [], {}, tag="[VideoConcat]")
+            # Результат может лежать в той же папке, что и входы — себя не склеиваем
+            skip = job.work_paths()
+            video_files = [v for v in video_files if os.path.abspath(v) not in skip]
+
         if not video_files:
-            return {"result": ("",)}
+            return {"result": ("", "")}
+        # Найденный список — вторым выходом, например в video_paths EnhancedVideoPreview
+        clip_list = "\n".join(video_files)
 
         # 3. Processing (Logic)
         pbar = comfy.utils.ProgressBar(100)
         pbar.update(5)
 
-        if "Copy" in ffmpeg_mode:
+        up_to_date = False
+        if job is not None:
+            job = IncrementalConcat(final_output_path, video_files, {
+                "ffmpeg_mode": ffmpeg_mode, "concat_mode": concat_mode, "transition_delay": transition_delay,
+                "force_match_everything": force_match_everything, "color_match_mode": color_match_mode,
+                "wb_gamma_mode": wb_gamma_mode, "match_strength": match_strength, "stats_frames": stats_frames,
+                "encoder_profile": encoder_profile,
+            }, tag="[VideoConcat]")
+            # Дописать кусок можно только при простой склейке: переход и цветокоррекция зависят от соседних клипов
+            appendable = ("Crossfade" not in concat_mode or transition_delay <= 0) and not force_match_everything \
+                and color_match_mode == "None" and wb_gamma_mode == "None"
+            # Новые клипы кодируются так же, как полная сборка; без перекодирования дописываются только в Copy/Smart
+            up_to_date = job.update(appendable,
+                                    {"profile": encoder_profile if encoder_profile in PROFILES else None, "threads": encoder_threads},
+                                    copy_matching="Copy" in ffmpeg_mode or "Smart" in ffmpeg_mode)
+            if not up_to_date:
+                final_output_path = job.build_path
+
+        # Полная сборка для инкрементальной склейки режет куски по концу видео (outpoint), как и дописывание,
+        # иначе результат зависел бы от того, собран он целиком или по частям. Обычная склейка — как раньше.
+        outpoints = [video_end(p) for p in video_files] if job is not None and not up_to_date else None
+
+        if up_to_date:
+            pass
+        elif "Copy" in ffmpeg_mode:
             print(f"[VideoConcat] Mode: Direct Copy")
             list_path = os.path.join(target_dir, f"list_{random.randint(0,999)}.txt")
-            with open(list_path, 'w', encoding='utf-8') as f:
-                for p in video_files: f.write(f"file '{p.replace('\\','/')}'\n")
+            self.write_concat_list(list_path, video_files, outpoints)
             
             cmd = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", final_output_path]
-            subprocess.run(cmd, check=True)
-            if os.path.exists(list_path): os.remove(list_path)
+            try:
+                run_ffmpeg(cmd, cleanup=[final_output_path])
+            finally:
+                if os.path.exists(list_path): os.remove(list_path)
         else:
             # Logic: Crossfade & Color Match
             do_crossfade = "Crossfade" in concat_mode and transition_delay > 0
@@ -263,21 +561,29 @@ class VideoConcatFFmpeg:
                 if "Gamma" in wg: apply_gamma = True
             
             any_effect = (apply_bright or apply_contr or apply_sat or apply_wb or apply_gamma)
+            video_args = encoder_args("h264", encoder_profile if encoder_profile in PROFILES else None,
+                                      pix_fmt="yuv420p", threads=encoder_threads)
+            conform_options = {"profile": encoder_profile if encoder_profile in PROFILES else None, "threads": encoder_threads}
             
             if not do_crossfade and not any_effect:
-                list_path = os.path.join(target_dir, f"list_{random.randint(0,999)}.txt")
-                with open(list_path, 'w', encoding='utf-8') as f:
-                    for p in video_files: f.write(f"file '{p.replace('\\','/')}'\n")
-                cmd = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_path,
-                       "-c:v", "libx264", "-pix_fmt", "yuv420p", final_output_path]
-                subprocess.run(cmd, check=True)
-                if os.path.exists(list_path): os.remove(list_path)
+                # Smart: совместимые клипы копируются, перекодируются только отличающиеся
+                smart_done = "Smart" in ffmpeg_mode and smart_concat(video_files, final_output_path, encode_workers, tag="[VideoConcat]",
+                                                                        video_options=conform_options,
+                                                                        trim_to_video=outpoints is not None)
+                if not smart_done:
+                    list_path = os.path.join(target_dir, f"list_{random.randint(0,999)}.txt")
+                    self.write_concat_list(list_path, video_files, outpoints)
+                    cmd = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_path] + video_args + [final_output_path]
+                    try:
+                        run_ffmpeg(cmd, duration=self.total_duration(video_files),
+                                   on_progress=progress_callback(pbar, 5, 95), cleanup=[final_output_path])
+                    finally:
+                        if os.path.exists(list_path): os.remove(list_path)
             else:
                 files_data = []
                 ref = {}
                 has_audio_global = True 
-                for idx, v in enumerate(video_files):
-                    info = self.analyze_frame_stats(v)
+                for idx, (v, info) in enumerate(zip(video_files, self.analyze_clips(video_files, analysis_workers, stats_frames))):
                     info["path"] = v
                     files_data.append(info)
                     if idx == 0:
@@ -286,87 +592,26 @@ class VideoConcatFFmpeg:
                         if ref["luma_avg"] < 15 or not ref["valid"]: apply_contr = False; apply_gamma = False
                     if not info["has_audio"]: has_audio_global = False
 
-                inputs = []
-                for v in video_files: inputs.extend(["-i", v])
-                filter_str = ""
-                prepared_streams = []
-                for i in range(len(files_data)):
-                    stream_name = f"v{i}_prep"
-                    cur = files_data[i]
-                    filters = []
-                    if any_effect and i > 0 and cur["valid"]:
-                        eq_params = []
-                        cb_params = [] 
-                        if apply_bright:
-                            diff = (ref["luma_avg"] - cur["luma_avg"]) / 255.0 * match_strength
-                            diff = max(-0.3, min(0.3, diff))
-                            if abs(diff) > 0.005: eq_params.append(f"brightness={diff:.3f}")
-                        if apply_contr:
-                            c_std = max(5.0, cur["luma_std"])
-                            r_std = max(5.0, ref["luma_std"])
-                            contrast = 1.0 + (r_std / c_std - 1.0) * match_strength
-                            contrast = max(0.85, min(1.4, contrast))
-                            if abs(contrast - 1.0) > 0.02: eq_params.append(f"contrast={contrast:.3f}")
-                        if apply_sat:
-                            c_sat = max(5.0, cur["sat_avg"])
-                            r_sat = max(5.0, ref["sat_avg"])
-                            sat = 1.0 + (r_sat / c_sat - 1.0) * match_strength
-                            if sat < 1.0: sat = max(0.9, sat) 
-                            else: sat = min(1.6, sat)
-                            if abs(sat - 1.0) > 0.02: eq_params.append(f"saturation={sat:.3f}")
-                        if apply_gamma:
-                            target_gamma = ref["luma_avg"] / max(5.0, cur["luma_avg"])
-                            gamma = 1.0 + (target_gamma - 1.0) * (match_strength * 0.5)
-                            gamma = max(0.85, min(1.25, gamma))
-                            if abs(gamma - 1.0) > 0.05: eq_params.append(f"gamma={gamma:.3f}")
-                        if apply_wb:
-                            def get_bal(ref_c, cur_c):
-                                diff = (ref_c - cur_c) / 255.0 * match_strength
-                                return max(-0.3, min(0.3, diff))
-                            r_bal = get_bal(ref["r_avg"], cur["r_avg"])
-                            g_bal = get_bal(ref["g_avg"], cur["g_avg"])
-                            b_bal = get_bal(ref["b_avg"], cur["b_avg"])
-                            if abs(r_bal)>0.01 or abs(g_bal)>0.01 or abs(b_bal)>0.01:
-                                cb_params.extend([f"rm={r_bal:.3f}", f"gm={g_bal:.3f}", f"bm={b_bal:.3f}"])
-                        if eq_params: filters.append(f"eq={':'.join(eq_params)}")
-                        if cb_params: filters.append(f"colorbalance={':'.join(cb_params)}")
-                    filters.append("format=yuv420p,setsar=1") 
-                    filter_chain = ",".join(filters)
-                    filter_str += f"[{i}:v]{filter_chain}[{stream_name}];"
-                    prepared_streams.append(stream_name)
-                last_v = prepared_streams[0]
-                last_a = "0:a" if has_audio_global else None
-                current_offset = 0.0
-                if do_crossfade:
-                    for i in range(1, len(files_data)):
-                        prev_dur = files_data[i-1]["duration"]
-                        current_offset += prev_dur - transition_delay
-                        next_v = prepared_streams[i]
-                        target_v = f"v_out_{i}"
-                        filter_str += f"[{last_v}][{next_v}]xfade=transition=fade:duration={transition_delay}:offset={current_offset:.3f}[{target_v}];"
-                        last_v = target_v
-                        if has_audio_global:
-                            next_a = f"{i}:a"
-                            target_a = f"a_out_{i}"
-                            filter_str += f"[{last_a}][{next_a}]acrossfade=d={transition_delay}:c1=tri:c2=tri[{target_a}];"
-                            last_a = target_a
+                apply = {"bright": apply_bright, "contr": apply_contr, "sat": apply_sat, "wb": apply_wb, "gamma": apply_gamma}
+                chains = [self.clip_filter_chain(files_data[i], ref, i == 0, apply, match_strength) for i in range(len(files_data))]
+
+                segments = None
+                if "Parallel" in encode_strategy:
+                    segments = self.plan_segments(files_data, do_crossfade, transition_delay)
+                    if segments is None:
+                        print("[VideoConcat] Clips too short for transition windows, using single graph")
+
+                if segments is not None:
+                    self.encode_segments(files_data, chains, final_output_path, target_dir, segments,
+                                         transition_delay, has_audio_global, encode_workers, pbar, video_args)
                 else:
-                    concat_ins = ""
-                    for i in range(len(prepared_streams)):
-                        concat_ins += f"[{prepared_streams[i]}]"
-                        if has_audio_global: concat_ins += f"[{i}:a]"
-                    a_val = 1 if has_audio_global else 0
-                    filter_str += f"{concat_ins}concat=n={len(prepared_streams)}:v=1:a={a_val}[v_out_final]"
-                    if has_audio_global: filter_str += "[a_out_final]"
-                    last_v = "v_out_final"
-                    last_a = "a_out_final" if has_audio_global else None
-                filter_str = filter_str.rstrip(";")
-                cmd = ["ffmpeg", "-y"]
-                cmd.extend(inputs)
-                cmd.extend(["-filter_complex", filter_str, "-map", f"[{last_v}]"])
-                if has_audio_global and last_a: cmd.extend(["-map", f"[{last_a}]", "-c:a", "aac"])
-                cmd.extend(["-c:v", "libx264", "-pix_fmt", "yuv420p", "-fps_mode", "cfr", final_output_path])
-                subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                    self.encode_single_graph(video_files, files_data, chains, final_output_path,
+                                             do_crossfade, transition_delay, has_audio_global, video_args, pbar)
+
+        if job is not None and not up_to_date:
+            if not job.commit():
+                raise RuntimeError(f"[VideoConcat] Incremental build produced no output: {job.output_path}")
+            final_output_path = job.output_path
 
         pbar.update(100)
         
@@ -380,5 +625,5 @@ class VideoConcatFFmpeg:
                     preview_results.append({"filename": n, "subfolder": f, "type": "output", "format": "video/mp4"})
             except: pass
 
-        if preview_results: return {"ui": {"images": preview_results}, "result": (final_output_path,)}
-        return {"result": (final_output_path,)}
+        if preview_results: return {"ui": {"images": preview_results}, "result": (final_output_path, clip_list)}
+        return {"result": (final_output_path, clip_list)}
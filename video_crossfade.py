@@ -1,5 +1,78 @@
 import torch
 import numpy as np
+import functools
+import comfy.model_management as model_management
+
+FADE_METHODS = ["linear", "ease_in_out", "ease_in", "ease_out", "smoothstep", "smootherstep", "cubic_bezier", "hard_cut"]
+FADE_MODES = ["uniform", "per_channel", "luma_weighted"]
+
+# Кривая CSS "ease" — значения по умолчанию для cubic_bezier
+DEFAULT_BEZIER = (0.25, 0.1, 0.25, 1.0)
+
+
+def _apply_curve(t, method, bezier):
+    """Кривая прозрачности для произвольного тензора времени t в [0, 1]"""
+    if method == "ease_in_out":
+        # Формула (1 - cos(t * pi)) / 2 — классическая S-образная кривая
+        return 0.5 * (1.0 - torch.cos(t * torch.pi))
+    elif method == "ease_in":
+        # Квадратичное ускорение (t^2)
+        return t * t
+    elif method == "ease_out":
+        # Квадратичное замедление (1 - (1-t)^2)
+        return 1.0 - (1.0 - t) * (1.0 - t)
+    elif method == "smoothstep":
+        # 3t^2 - 2t^3
+        return t * t * (3.0 - 2.0 * t)
+    elif method == "smootherstep":
+        # 6t^5 - 15t^4 + 10t^3 (нулевые первая и вторая производные на концах)
+        return t * t * t * (t * (t * 6.0 - 15.0) + 10.0)
+    elif method == "cubic_bezier":
+        # Как CSS cubic-bezier(x1, y1, x2, y2): P0=(0,0), P3=(1,1).
+        # x(s) монотонна при x1, x2 в [0, 1], поэтому s находим векторной бисекцией
+        x1, y1, x2, y2 = bezier
+        lo = torch.zeros_like(t)
+        hi = torch.ones_like(t)
+        for _ in range(40):
+            mid = (lo + hi) * 0.5
+            u = 1.0 - mid
+            x = 3.0 * u * u * mid * x1 + 3.0 * u * mid * mid * x2 + mid * mid * mid
+            below = x < t
+            lo = torch.where(below, mid, lo)
+            hi = torch.where(below, hi, mid)
+        s = (lo + hi) * 0.5
+        u = 1.0 - s
+        return 3.0 * u * u * s * y1 + 3.0 * u * s * s * y2 + s * s * s
+    else:
+        # linear и fallback
+        return t
+
+
+@functools.lru_cache(maxsize=128)
+def _alpha_table(steps, method, dtype, device, bezier, channels=0):
+    """
+    Кэшированная таблица alpha для окна нахлеста.
+    channels == 0 -> форма [steps, 1, 1, 1] (общая кривая),
+    channels > 0  -> форма [steps, 1, 1, C] (каналы R, G, B стартуют со сдвигом).
+    Таблица общая для всех вызовов — менять ее in-place нельзя.
+    """
+    # Считаем в float64 на CPU один раз, дальше только переносим
+    t = torch.linspace(0.0, 1.0, steps=steps, dtype=torch.float64)
+    if channels > 0:
+        shift = 0.15
+        cols = []
+        for c in range(channels):
+            if c < 3:
+                # R опережает, B отстает; на концах все каналы по-прежнему 0 и 1
+                tc = ((t - c * shift) / (1.0 - 2.0 * shift)).clamp(0.0, 1.0)
+            else:
+                tc = t  # альфа-канал идет по общей кривой
+            cols.append(_apply_curve(tc, method, bezier))
+        alpha = torch.stack(cols, dim=-1).view(steps, 1, 1, channels)
+    else:
+        alpha = _apply_curve(t, method, bezier).view(steps, 1, 1, 1)
+    return alpha.to(device=device, dtype=dtype).contiguous()
+
 
 class VideoBatchCrossfade:
     @classmethod
@@ -10,83 +83,181 @@ class VideoBatchCrossfade:
                 "overlap_frames": ("INT", {"default": 8, "min": 0, "max": 256, "step": 1}),
                 # Добавляем выпадающий список методов
                 "fade_method": (
-                    ["linear", "ease_in_out", "ease_in", "ease_out", "hard_cut"], 
+                    FADE_METHODS, 
                     {"default": "linear"}
                 ),
             },
-            "optional": {}
+            "optional": {
+                # uniform — весь кадр по одной кривой, per_channel — R/G/B со сдвигом,
+                # luma_weighted — светлые области нового батча проявляются раньше
+                "fade_mode": (FADE_MODES, {"default": "uniform"}),
+                # Контрольные точки для fade_method = cubic_bezier
+                "bezier_x1": ("FLOAT", {"default": DEFAULT_BEZIER[0], "min": 0.0, "max": 1.0, "step": 0.01}),
+                "bezier_y1": ("FLOAT", {"default": DEFAULT_BEZIER[1], "min": 0.0, "max": 1.0, "step": 0.01}),
+                "bezier_x2": ("FLOAT", {"default": DEFAULT_BEZIER[2], "min": 0.0, "max": 1.0, "step": 0.01}),
+                "bezier_y2": ("FLOAT", {"default": DEFAULT_BEZIER[3], "min": 0.0, "max": 1.0, "step": 0.01}),
+                # Сохранять dtype входных батчей (fp16/bf16) вместо апкаста всего видео в float32
+                "keep_input_dtype": ("BOOLEAN", {"default": False}),
+                # Где считать смешивание окна нахлеста: auto = там же, где лежат кадры
+                "compute_device": (["auto", "cpu", "gpu"], {"default": "auto"}),
+            }
         }
 
     RETURN_TYPES = ("IMAGE",)
     FUNCTION = "process_batches"
     CATEGORY = "video/postprocessing"
 
-    def get_alpha_curve(self, steps, method, device):
-        """Генерация кривой прозрачности (alpha)"""
-        # Линейное время от 0 до 1
-        t = torch.linspace(0.0, 1.0, steps=steps, dtype=torch.float32, device=device)
-        
-        if method == "linear":
-            return t
-        
-        elif method == "ease_in_out":
-            # Формула (1 - cos(t * pi)) / 2 — классическая S-образная кривая
-            return 0.5 * (1.0 - torch.cos(t * torch.pi))
-            
-        elif method == "ease_in":
-            # Квадратичное ускорение (t^2)
-            return t * t
-            
-        elif method == "ease_out":
-            # Квадратичное замедление (1 - (1-t)^2)
-            return 1.0 - (1.0 - t) * (1.0 - t)
-            
+    def get_alpha_curve(self, steps, method, device, dtype=torch.float32, bezier=DEFAULT_BEZIER, channels=0):
+        """Генерация кривой прозрачности (alpha), таблица кэшируется по (steps, method, dtype, device)"""
+        return _alpha_table(int(steps), method, dtype, torch.device(device), tuple(float(v) for v in bezier), channels)
+
+    def plan_crossfade(self, lengths, overlap_frames, method):
+        """План склейки: нахлест на каждом стыке и итоговое число кадров"""
+        overlaps = []
+        total = lengths[0] if lengths else 0
+        for n in lengths[1:]:
+            # Нахлест не может быть длиннее уже склеенного видео или следующего батча
+            ov = 0 if method == "hard_cut" else min(overlap_frames, total, n)
+            overlaps.append(ov)
+            total += n - ov
+        return overlaps, total
+
+    def check_shapes(self, batches):
+        first = batches[0]
+        for batch in batches[1:]:
+            if tuple(batch.shape[1:]) != tuple(first.shape[1:]):
+                raise ValueError(f"Batch shapes must match. Got {tuple(first.shape)} vs {tuple(batch.shape)}")
+        return first.shape
+
+    def output_dtype(self, first, keep_input_dtype):
+        return first.dtype if keep_input_dtype and first.is_floating_point() else torch.float32
+
+    def resolve_compute_device(self, compute_device, fallback):
+        """auto -> устройство кадров, gpu -> устройство ComfyUI (если GPU нет, останется CPU)"""
+        if compute_device == "cpu":
+            return torch.device("cpu")
+        if compute_device == "gpu":
+            return model_management.get_torch_device()
+        return fallback
+
+    def fade_weights(self, steps, method, fade_mode, bezier, overlap_b, compute_device):
+        """Веса смешивания для окна нахлеста (форма бродкастится на [steps, H, W, C])"""
+        if fade_mode == "per_channel":
+            return self.get_alpha_curve(steps, method, compute_device, bezier=bezier, channels=overlap_b.shape[-1])
+
+        alpha = self.get_alpha_curve(steps, method, compute_device, bezier=bezier)
+        if fade_mode == "luma_weighted" and overlap_b.shape[-1] >= 3:
+            # alpha^k, k = e^(1 - 2*luma): k < 1 для светлых пикселей (проявляются раньше),
+            # k > 1 для темных. При alpha = 0 и alpha = 1 вес остается 0 и 1.
+            coeffs = torch.tensor([0.299, 0.587, 0.114], dtype=torch.float32, device=compute_device)
+            luma = torch.matmul(overlap_b[..., :3], coeffs).unsqueeze(-1)
+            return alpha.pow(torch.exp(1.0 - 2.0 * luma.clamp_(0.0, 1.0)))
+        return alpha
+
+    def blend_window(self, window, overlap_b, method, fade_mode, bezier, compute_device):
+        """
+        Смешивание окна нахлеста in-place через torch.lerp (без временных (1-a)*A и a*B).
+        В float32 на compute_device поднимается только окно, остальные кадры не трогаются.
+        """
+        if window.dtype == torch.float32 and window.device == compute_device:
+            overlap_a = window
         else:
-            # Fallback на линейный
-            return t
+            overlap_a = window.to(device=compute_device, dtype=torch.float32)
+        overlap_b = overlap_b.to(device=compute_device, dtype=torch.float32)
 
-    def crossfade_two_batches(self, batch_a, batch_b, overlap_frames, method):
-        batch_a = batch_a.to(torch.float32)
-        batch_b = batch_b.to(torch.float32)
+        weights = self.fade_weights(window.shape[0], method, fade_mode, bezier, overlap_b, compute_device)
+        torch.lerp(overlap_a, overlap_b, weights, out=overlap_a)
+        if overlap_a is not window:
+            window.copy_(overlap_a)
 
-        B1, H, W, C = batch_a.shape
-        B2, H2, W2, C2 = batch_b.shape
+    def crossfade_batches(self, batches, overlap_frames, method, keep_input_dtype=False, compute_device="auto",
+                          fade_mode="uniform", bezier=DEFAULT_BEZIER):
+        """
+        Склейка N батчей за один проход.
+        Выходной тензор выделяется один раз, префиксы/суффиксы пишутся прямо в свои срезы,
+        смешивание идет только в окне нахлеста (вместо O(N^2) копирований через torch.cat).
+        """
+        first = batches[0]
+        _, H, W, C = self.check_shapes(batches)
+        overlaps, total = self.plan_crossfade([b.shape[0] for b in batches], overlap_frames, method)
 
-        if (H, W, C) != (H2, W2, C2):
-            raise ValueError(f"Batch shapes must match. Got {batch_a.shape} vs {batch_b.shape}")
+        # Проходные кадры сохраняют dtype и устройство первого батча
+        out_dtype = self.output_dtype(first, keep_input_dtype)
+        result = torch.empty((total, H, W, C), dtype=out_dtype, device=first.device)
+        device = self.resolve_compute_device(compute_device, result.device)
 
-        # Если выбран hard_cut, нахлест принудительно 0
-        if method == "hard_cut":
-            return torch.cat([batch_a, batch_b], dim=0)
+        cursor = first.shape[0]
+        result[:cursor] = first
 
-        real_overlap = min(overlap_frames, B1, B2)
+        for batch, ov in zip(batches[1:], overlaps):
+            if ov > 0:
+                # Смешиваем хвост уже записанного результата с началом следующего батча
+                self.blend_window(result[cursor - ov:cursor], batch[:ov], method, fade_mode, bezier, device)
 
-        if real_overlap == 0:
-            return torch.cat([batch_a, batch_b], dim=0)
+            tail = batch.shape[0] - ov
+            result[cursor:cursor + tail] = batch[ov:]
+            cursor += tail
 
-        # 1. Разделение
-        prefix_a = batch_a[:-real_overlap] if real_overlap < B1 else torch.empty(0, H, W, C, device=batch_a.device)
-        overlap_a = batch_a[-real_overlap:]
+        return result
 
-        overlap_b = batch_b[:real_overlap]
-        suffix_b = batch_b[real_overlap:] if real_overlap < B2 else torch.empty(0, H, W, C, device=batch_b.device)
+    def iter_crossfade(self, batches, overlap_frames, method, chunk_size=64, keep_input_dtype=False,
+                       compute_device="auto", fade_mode="uniform", bezier=DEFAULT_BEZIER):
+        """
+        Потоковая склейка: отдает кадры чанками по мере готовности.
+        Удерживается только хвост из overlap_frames кадров, который еще может попасть
+        в нахлест со следующим батчем, — итоговое видео целиком в памяти не собирается.
+        """
+        first = batches[0]
+        _, H, W, C = self.check_shapes(batches)
+        overlaps, _ = self.plan_crossfade([b.shape[0] for b in batches], overlap_frames, method)
 
-        # 2. Генерация Alpha по выбранному методу
-        alpha = self.get_alpha_curve(real_overlap, method, batch_a.device)
-        alpha = alpha.view(-1, 1, 1, 1) # reshape для бродкастинга [frames, 1, 1, 1]
+        out_dtype = self.output_dtype(first, keep_input_dtype)
+        out_device = first.device
+        device = self.resolve_compute_device(compute_device, out_device)
+        hold = 0 if method == "hard_cut" else overlap_frames
+        chunk_size = max(1, int(chunk_size))
 
-        # 3. Смешивание
-        blended = (1.0 - alpha) * overlap_a + alpha * overlap_b
+        # Удерживаемый хвост — всегда собственная копия, поэтому его можно смешивать in-place
+        window = torch.empty((0, H, W, C), dtype=out_dtype, device=out_device)
 
-        # 4. Сборка
-        parts = []
-        if prefix_a.shape[0] > 0: parts.append(prefix_a)
-        parts.append(blended)
-        if suffix_b.shape[0] > 0: parts.append(suffix_b)
+        for idx, batch in enumerate(batches):
+            ov = overlaps[idx - 1] if idx > 0 else 0
+            if ov > 0:
+                self.blend_window(window[-ov:], batch[:ov], method, fade_mode, bezier, device)
 
-        return torch.cat(parts, dim=0)
+            pieces = [window, batch[ov:]]
+            total = window.shape[0] + batch.shape[0] - ov
+            is_last = idx == len(batches) - 1
+            keep = 0 if is_last else min(hold, total)
+            emit = total - keep
 
-    def process_batches(self, Batches_count, overlap_frames, fade_method, **kwargs):
+            # 1. Отдаем все, что уже не изменится
+            offset = 0
+            for piece in pieces:
+                n = piece.shape[0]
+                stop = min(n, emit - offset)
+                for s in range(0, max(stop, 0), chunk_size):
+                    yield piece[s:min(s + chunk_size, stop)].to(device=out_device, dtype=out_dtype)
+                offset += n
+
+            # 2. Новый хвост для следующего нахлеста
+            tail_parts = []
+            offset = 0
+            for piece in pieces:
+                n = piece.shape[0]
+                start = max(0, emit - offset)
+                if start < n:
+                    tail_parts.append(piece[start:].to(device=out_device, dtype=out_dtype))
+                offset += n
+            if tail_parts:
+                window = torch.cat(tail_parts, dim=0)
+            else:
+                window = torch.empty((0, H, W, C), dtype=out_dtype, device=out_device)
+
+    def crossfade_two_batches(self, batch_a, batch_b, overlap_frames, method, **options):
+        return self.crossfade_batches([batch_a, batch_b], overlap_frames, method, **options)
+
+    def collect_batches(self, Batches_count, kwargs):
         batches_to_process = []
         
         # Сборка батчей
@@ -95,14 +266,70 @@ class VideoBatchCrossfade:
             image_batch = kwargs.get(key)
             if image_batch is not None:
                 batches_to_process.append(image_batch)
+        return batches_to_process
+
+    def collect_options(self, kwargs):
+        """Необязательные входы ноды -> параметры crossfade_batches / iter_crossfade"""
+        return {
+            "keep_input_dtype": kwargs.get("keep_input_dtype", False),
+            "compute_device": kwargs.get("compute_device", "auto"),
+            "fade_mode": kwargs.get("fade_mode", "uniform"),
+            "bezier": tuple(kwargs.get(k, d) for k, d in zip(("bezier_x1", "bezier_y1", "bezier_x2", "bezier_y2"), DEFAULT_BEZIER)),
+        }
+
+    def process_batches(self, Batches_count, overlap_frames, fade_method, **kwargs):
+        batches_to_process = self.collect_batches(Batches_count, kwargs)
 
         if not batches_to_process:
             return (torch.zeros((1, 512, 512, 3)),)
 
-        result = batches_to_process[0]
+        if len(batches_to_process) == 1:
+            return (batches_to_process[0],)
+
+        return (self.crossfade_batches(batches_to_process, overlap_frames, fade_method, **self.collect_options(kwargs)),)
+
+
+class CrossfadeStream:
+    """
+    Ленивый результат склейки (тип IMAGE_STREAM).
+    Каждая итерация заново проходит по батчам и отдает кадры чанками [n, H, W, C].
+    """
+    def __init__(self, node, batches, overlap_frames, method, chunk_size, **options):
+        self.node = node
+        self.batches = batches
+        self.overlap_frames = overlap_frames
+        self.method = method
+        self.chunk_size = chunk_size
+        self.options = options
+
+        _, H, W, C = node.check_shapes(batches)
+        self.frame_shape = (H, W, C)
+        _, self.frame_count = node.plan_crossfade([b.shape[0] for b in batches], overlap_frames, method)
 
-        # Последовательная склейка
-        for next_batch in batches_to_process[1:]:
-            result = self.crossfade_two_batches(result, next_batch, overlap_frames, fade_method)
+    def __len__(self):
+        return self.frame_count
+
+    def __iter__(self):
+        return self.node.iter_crossfade(self.batches, self.overlap_frames, self.method, self.chunk_size, **self.options)
+
+
+class VideoBatchCrossfadeStream(VideoBatchCrossfade):
+    """То же, что VideoBatchCrossfade, но без сборки одного большого IMAGE тензора"""
+    @classmethod
+    def INPUT_TYPES(s):
+        types = super().INPUT_TYPES()
+        types["required"]["chunk_size"] = ("INT", {"default": 64, "min": 1, "max": 1024, "step": 1})
+        return types
+
+    RETURN_TYPES = ("IMAGE_STREAM",)
+    RETURN_NAMES = ("image_stream",)
+    FUNCTION = "stream_batches"
+
+    def stream_batches(self, Batches_count, overlap_frames, fade_method, chunk_size=64, **kwargs):
+        batches_to_process = self.collect_batches(Batches_count, kwargs)
+
+        if not batches_to_process:
+            batches_to_process = [torch.zeros((1, 512, 512, 3))]
 
-        return (result,)
\ No newline at end of file
+        return (CrossfadeStream(self, batches_to_process, overlap_frames, fade_method, chunk_size,
+                                **self.collect_options(kwargs)),)
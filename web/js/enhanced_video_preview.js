@@ -1,14 +1,17 @@
 import { app } from "/scripts/app.js";
 import { api } from "/scripts/api.js";
 
+// Папок за один запрос list_dirs: в огромных папках остальные догружаются пунктом "More"
+const DIRS_PAGE_SIZE = 200;
+
 // --- ЛОГИКА КОНТЕКСТНОГО МЕНЮ ПРОВОДНИКА ---
-async function showFolderContextMenu(path, event, targetWidget, app) {
+async function showFolderContextMenu(path, event, targetWidget, app, offset = 0, prefix = "") {
     let data;
     try {
         const response = await api.fetchApi("/enhanced_preview/list_dirs", {
             method: "POST",
             headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({ path: path })
+            body: JSON.stringify({ path: path, offset: offset, limit: DIRS_PAGE_SIZE, prefix: prefix })
         });
         
         if (!response.ok) throw new Error("Network response was not ok");
@@ -47,6 +50,24 @@ async function showFolderContextMenu(path, event, targetWidget, app) {
     menuValues.push(null); 
     menuOptions.push(null);
 
+    // Фильтр по началу имени и возврат к предыдущей странице
+    menuValues.push(prefix ? `🔍 Filter: ${prefix}*` : "🔍 Filter...");
+    menuOptions.push({
+        content: prefix ? `🔍 Filter: ${prefix}*` : "🔍 Filter...",
+        callback: () => {
+            const value = prompt("Show folders starting with:", prefix);
+            if (value !== null) showFolderContextMenu(data.current_path, event, targetWidget, app, 0, value.trim());
+        }
+    });
+    if (data.offset > 0) {
+        const prevOffset = Math.max(0, data.offset - DIRS_PAGE_SIZE);
+        menuValues.push("⬆️ Previous");
+        menuOptions.push({
+            content: "⬆️ Previous",
+            callback: () => { showFolderContextMenu(data.current_path, event, targetWidget, app, prevOffset, prefix); }
+        });
+    }
+
     if (data.dirs && data.dirs.length > 0) {
         data.dirs.forEach(dirName => {
             menuValues.push("📁 " + dirName);
@@ -62,8 +83,29 @@ async function showFolderContextMenu(path, event, targetWidget, app) {
             });
         });
     } else {
-        menuValues.push("(Empty folder)");
-        menuOptions.push({ content: "(Empty folder)", disabled: true });
+        const emptyText = prefix ? "(No matching folders)" : "(Empty folder)";
+        menuValues.push(emptyText);
+        menuOptions.push({ content: emptyText, disabled: true });
+    }
+
+    if (data.has_more) {
+        const remaining = data.total - data.offset - data.dirs.length;
+        const nextOffset = data.offset + data.dirs.length;
+        menuValues.push(`⬇️ More (${remaining} remaining)`);
+        menuOptions.push({
+            content: `⬇️ More (${remaining} remaining)`,
+            callback: () => { showFolderContextMenu(data.current_path, event, targetWidget, app, nextOffset, prefix); }
+        });
+    }
+
+    // Медленный диск: сервер отдал то, что успел найти, скан идет дальше
+    if (data.partial) {
+        const reloadText = `⏳ Still scanning (${data.total} so far) - Reload`;
+        menuValues.push(reloadText);
+        menuOptions.push({
+            content: reloadText,
+            callback: () => { showFolderContextMenu(data.current_path, event, targetWidget, app, data.offset, prefix); }
+        });
     }
 
     new LiteGraph.ContextMenu(menuValues, {
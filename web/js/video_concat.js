@@ -1,6 +1,9 @@
 import { app } from "/scripts/app.js";
 import { api } from "/scripts/api.js";
 
+// Папок за один запрос list_dirs: в огромных папках остальные догружаются пунктом "More"
+const DIRS_PAGE_SIZE = 200;
+
 app.registerExtension({
     name: "Comfyui.VideoConcat",
     
@@ -169,10 +172,10 @@ function initPathBrowser(node, app) {
     if (pathWidget) { node.addWidget("button", "📂 Browse Output", null, (w, c, n, p, e) => { showFolderContextMenu(pathWidget.value, e, pathWidget, app); }); }
 }
 
-async function showFolderContextMenu(path, event, targetWidget, app) {
+async function showFolderContextMenu(path, event, targetWidget, app, offset = 0, prefix = "") {
     let data;
     try {
-        const response = await api.fetchApi("/save_preview/list_dirs", { method: "POST", headers: { "Content-Type": "application/json" }, body: JSON.stringify({ path: path }) });
+        const response = await api.fetchApi("/save_preview/list_dirs", { method: "POST", headers: { "Content-Type": "application/json" }, body: JSON.stringify({ path: path, offset: offset, limit: DIRS_PAGE_SIZE, prefix: prefix }) });
         if (!response.ok) throw new Error("Network");
         data = await response.json();
     } catch (e) { alert("Error: " + e); return; }
@@ -180,6 +183,11 @@ async function showFolderContextMenu(path, event, targetWidget, app) {
     if (data.parent_path && data.parent_path !== data.current_path) { vals.push("⬅️ UP"); opts.push({ content: "⬅️ UP", callback: () => showFolderContextMenu(data.parent_path, event, targetWidget, app) }); }
     vals.push(`✅ SELECT: ${data.current_path}`); opts.push({ content: `✅ SELECT THIS`, callback: () => { targetWidget.value = data.current_path; if(targetWidget.callback)targetWidget.callback(targetWidget.value); app.graph.setDirtyCanvas(true,true); }});
     vals.push(null); opts.push(null);
+    const filterLabel = prefix ? `🔍 Filter: ${prefix}*` : "🔍 Filter...";
+    vals.push(filterLabel); opts.push({ content: filterLabel, callback: () => { const v = prompt("Show folders starting with:", prefix); if (v !== null) showFolderContextMenu(data.current_path, event, targetWidget, app, 0, v.trim()); }});
+    if (data.offset > 0) { vals.push("⬆️ Previous"); opts.push({ content: "⬆️ Previous", callback: () => showFolderContextMenu(data.current_path, event, targetWidget, app, Math.max(0, data.offset - DIRS_PAGE_SIZE), prefix) }); }
     if (data.dirs) data.dirs.forEach(d => { vals.push("📁 "+d); opts.push({ content: "📁 "+d, callback: () => { const sep = data.current_path.includes("/")?"/":"\\"; const np = data.current_path.endsWith(sep) ? data.current_path+d : data.current_path+sep+d; showFolderContextMenu(np, event, targetWidget, app); }}); });
+    if (data.has_more) { const more = `⬇️ More (${data.total - data.offset - data.dirs.length} remaining)`; vals.push(more); opts.push({ content: more, callback: () => showFolderContextMenu(data.current_path, event, targetWidget, app, data.offset + data.dirs.length, prefix) }); }
+    if (data.partial) { const reload = `⏳ Still scanning (${data.total} so far) - Reload`; vals.push(reload); opts.push({ content: reload, callback: () => showFolderContextMenu(data.current_path, event, targetWidget, app, data.offset, prefix) }); }
     new LiteGraph.ContextMenu(vals, { event: event, callback: (v) => { const idx=vals.indexOf(v); if(opts[idx]&&opts[idx].callback) opts[idx].callback(); }});
 }
\ No newline at end of file
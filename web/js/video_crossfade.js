@@ -4,8 +4,8 @@ import { app } from "/scripts/app.js";
 app.registerExtension({
     name: "Video.BatchCrossfade",
     async nodeCreated(node) {
-        // Проверяем имя класса, которое мы вернули (VideoBatchCrossfade)
-        if (node.comfyClass === "VideoBatchCrossfade") {
+        // Проверяем имя класса, которое мы вернули (VideoBatchCrossfade / VideoBatchCrossfadeStream)
+        if (node.comfyClass === "VideoBatchCrossfade" || node.comfyClass === "VideoBatchCrossfadeStream") {
             
             const updateInputs = () => {
                 const initialWidth = node.size[0];